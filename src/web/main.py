@@ -1,9 +1,11 @@
 import pathlib
 import logging
+import signal
 
 from argparse import ArgumentParser
 
 from script.webserver import WebServer
+from script.tls import TlsSettings
 
 from script.handler.config import ConfigHandler
 from script.handler.file import FileHandler
@@ -42,16 +44,39 @@ if not configfile.exists():
 print(f"Loading config from {configfile}")
 config = Config().load(configfile)
 
+# Accounts are reloaded without restarting, either on SIGHUP or when the file changes.
+# The reload itself runs on the watcher thread, the handler only requests it.
+if hasattr(signal, "SIGHUP"):
+  signal.signal(signal.SIGHUP, lambda _signum, _frame: config.request_reload())
+
+config.watch(config.get_reload_interval())
+
 webServer = WebServer(
   address = config.get_address(),
   port = config.get_port(),
   keyfile = config.get_keyfile(),
-  certfile = config.get_certfile())
+  certfile = config.get_certfile(),
+  mode = config.get_server_mode(),
+  handshake_timeout = config.get_handshake_timeout(),
+  keep_alive_timeout = config.get_keep_alive_timeout(),
+  keep_alive_requests = config.get_keep_alive_requests(),
+  tls = TlsSettings(
+    min_version = config.get_tls_min_version(),
+    curve = config.get_tls_curve(),
+    ciphers = config.get_tls_ciphers(),
+    session_tickets = config.get_tls_session_tickets(),
+    alpn = config.get_tls_alpn()))
 
 webServer.add_handler(ConfigHandler(config))
 
 
-webServer.add_handler(FileHandler(str(config.get_http_root())))
+fileHandler = FileHandler(
+  str(config.get_http_root()), config.get_http_cache_size())
+
+if config.can_precompress():
+  fileHandler.precompress()
+
+webServer.add_handler(fileHandler)
 
 webServer.add_handler(WebSocketHandler(config))
 
@@ -0,0 +1,26 @@
+import shutil
+import pathlib
+import subprocess
+
+
+def create_certificate(directory : str) -> tuple:
+  """
+  Creates a self signed certificate for localhost in the given directory
+  and returns the certificate and key file. Python can not create
+  certificates on its own, thus the openssl command line tool is used.
+  """
+
+  if shutil.which("openssl") is None:
+    raise Exception("The openssl command line tool is required")
+
+  certfile = str(pathlib.Path(directory, "benchmark.cert"))
+  keyfile = str(pathlib.Path(directory, "benchmark.key"))
+
+  subprocess.run([
+    "openssl", "req", "-x509", "-nodes", "-days", "1",
+    "-newkey", "ec", "-pkeyopt", "ec_paramgen_curve:prime256v1",
+    "-subj", "/CN=localhost",
+    "-keyout", keyfile, "-out", certfile],
+    check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+  return (certfile, keyfile)
@@ -0,0 +1,391 @@
+"""
+Measures the proxy end to end. It starts the server with a self signed
+certificate in front of a stub sieve server and opens many websocket
+sessions, which list, download and upload scripts concurrently.
+
+Reported are the session setup latency, the request latency and rate, the
+throughput as well as the server's memory per session and cpu time. Memory
+and cpu are read from /proc and thus only available on linux.
+
+Run it from the web directory via python -m script.benchmark.load
+"""
+
+import os
+import ssl
+import sys
+import time
+import zlib
+import base64
+import socket
+import struct
+import asyncio
+import hashlib
+import pathlib
+import tempfile
+import subprocess
+
+from argparse import ArgumentParser
+
+from .certificate import create_certificate
+from .stubsieve import create_script
+from ..websocket import unmask
+from ..sieve.reader import ResponseReader
+
+WEB_ROOT = pathlib.Path(__file__).parent.parent.parent.absolute()
+
+ACCOUNT = "Benchmark"
+
+CONFIG = """[DEFAULT]
+ServerMode = {mode}
+ServerAddress = 127.0.0.1
+ServerPort = {port}
+ServerCertFile = {certfile}
+ServerKeyFile = {keyfile}
+SieveHost = 127.0.0.1
+SievePort = {sieve_port}
+
+[{account}]
+AuthType = authorization
+AuthUser = benchmark
+SieveUser = benchmark
+SievePassword = benchmark
+"""
+
+OPCODE_CONTINUATION = 0x0
+OPCODE_CLOSE = 0x8
+OPCODE_PING = 0x9
+OPCODE_PONG = 0xA
+
+
+def get_free_port() -> int:
+  with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+    sock.bind(("127.0.0.1", 0))
+    return sock.getsockname()[1]
+
+
+def wait_for_port(port : int, process, timeout : float = 10) -> None:
+  deadline = time.monotonic() + timeout
+
+  while time.monotonic() < deadline:
+    if process.poll() is not None:
+      raise Exception(f"Process {process.args} terminated")
+
+    try:
+      socket.create_connection(("127.0.0.1", port), timeout=1).close()
+      return
+    except OSError:
+      time.sleep(0.1)
+
+  raise Exception(f"Port {port} not ready")
+
+
+def get_rss(pid : int) -> int:
+  """
+  Returns the process' resident memory in bytes or None.
+  """
+  try:
+    with open(f"/proc/{pid}/status", encoding="ascii") as file:
+      for line in file:
+        if line.startswith("VmRSS:"):
+          return int(line.split()[1]) * 1024
+  except OSError:
+    pass
+
+  return None
+
+
+def get_cpu_time(pid : int) -> float:
+  """
+  Returns the process' user and system time in seconds or None.
+  """
+  try:
+    with open(f"/proc/{pid}/stat", encoding="ascii") as file:
+      fields = file.read().rsplit(")", 1)[1].split()
+  except OSError:
+    return None
+
+  return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def percentile(values : list, fraction : float) -> float:
+  values = sorted(values)
+  return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def format_latency(values : list) -> str:
+  return " ".join(
+    f"{name}={percentile(values, fraction)*1000:.1f}ms"
+      for name, fraction in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99), ("max", 1)))
+
+
+class BenchmarkClient:
+  """
+  A websocket client which speaks ManageSieve through the proxy.
+  """
+
+  def __init__(self, port : int, deflate : bool):
+    self.__port = port
+    self.__deflate = deflate
+    self.__inflater = None
+
+    self.__reader = None
+    self.__writer = None
+    self.__responses = ResponseReader()
+
+    self.messages = 0
+    self.bytes = 0
+
+  async def connect(self, ssl_context : ssl.SSLContext) -> float:
+    """
+    Opens the session and returns the seconds until the greeting arrived.
+    """
+
+    start = time.monotonic()
+
+    self.__reader, self.__writer = await asyncio.open_connection(
+      "127.0.0.1", self.__port, ssl=ssl_context)
+
+    account = hashlib.sha256(ACCOUNT.encode()).hexdigest()
+
+    request = (
+      f"GET /websocket/{account} HTTP/1.1\r\n"
+      + "Host: localhost\r\n"
+      + "Upgrade: websocket\r\n"
+      + "Connection: Upgrade\r\n"
+      + f"Sec-WebSocket-Key: {base64.b64encode(os.urandom(16)).decode()}\r\n"
+      + "Sec-WebSocket-Version: 13\r\n")
+
+    if self.__deflate:
+      request += "Sec-WebSocket-Extensions: permessage-deflate\r\n"
+
+    self.__writer.write((request + "\r\n").encode())
+
+    header = await self.__reader.readuntil(b"\r\n\r\n")
+
+    if not header.startswith(b"HTTP/1.1 101"):
+      raise Exception(f"Upgrade failed {header.splitlines()[0]}")
+
+    if b"permessage-deflate" in header.lower():
+      self.__inflater = zlib.decompressobj(-zlib.MAX_WBITS)
+
+    await self.read_response()
+    return time.monotonic() - start
+
+  def send_frame(self, opcode : int, payload : bytes) -> None:
+    mask = os.urandom(4)
+    length = len(payload)
+
+    if length < 126:
+      header = struct.pack("!BB", 0x80 | opcode, 0x80 | length)
+    elif length < 65536:
+      header = struct.pack("!BBH", 0x80 | opcode, 0x80 | 126, length)
+    else:
+      header = struct.pack("!BBQ", 0x80 | opcode, 0x80 | 127, length)
+
+    self.__writer.write(header + mask + unmask(mask, payload))
+
+  async def read_message(self) -> bytes:
+    message = bytearray()
+    compressed = False
+
+    while True:
+      first, second = await self.__reader.readexactly(2)
+      length = second & 0x7F
+
+      if length == 126:
+        length = struct.unpack("!H", await self.__reader.readexactly(2))[0]
+      elif length == 127:
+        length = struct.unpack("!Q", await self.__reader.readexactly(8))[0]
+
+      payload = await self.__reader.readexactly(length)
+      opcode = first & 0x0F
+
+      if opcode == OPCODE_PING:
+        self.send_frame(OPCODE_PONG, payload)
+        continue
+
+      if opcode == OPCODE_PONG:
+        continue
+
+      if opcode == OPCODE_CLOSE:
+        raise ConnectionError("Session closed by the server")
+
+      if opcode != OPCODE_CONTINUATION:
+        compressed = bool(first & 0x40)
+
+      message += payload
+
+      if first & 0x80:
+        break
+
+    if compressed:
+      message = self.__inflater.decompress(bytes(message) + b"\x00\x00\xff\xff")
+
+    self.messages += 1
+    self.bytes += len(message)
+    return message
+
+  async def read_response(self) -> bytes:
+    while True:
+      response = self.__responses.next()
+
+      if response is not None:
+        return response
+
+      self.__responses.feed(await self.read_message())
+
+  async def request(self, command : bytes) -> float:
+    """
+    Sends a command and returns the seconds until its response completed.
+    """
+
+    start = time.monotonic()
+
+    self.send_frame(0x1, command)
+    self.messages += 1
+    self.bytes += len(command)
+
+    response = await self.read_response()
+
+    # The status is the response's last line, literals precede it.
+    status = response.rstrip(b"\r\n").rsplit(b"\r\n", 1)[-1]
+
+    if not status.startswith(b"OK"):
+      raise Exception(f"Request failed {response[-80:]}")
+
+    return time.monotonic() - start
+
+  async def close(self) -> None:
+    try:
+      self.send_frame(OPCODE_CLOSE, struct.pack("!H", 1000))
+      await self.__writer.drain()
+      await asyncio.wait_for(self.__reader.read(), 2)
+    except (OSError, asyncio.TimeoutError):
+      pass
+
+    self.__writer.close()
+
+
+async def benchmark(args, port : int, pid : int) -> None:
+
+  ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+  ssl_context.check_hostname = False
+  ssl_context.verify_mode = ssl.CERT_NONE
+
+  script = create_script(args.script_size)
+  commands = [
+    b"LISTSCRIPTS\r\n",
+    b'GETSCRIPT "benchmark"\r\n',
+    b'PUTSCRIPT "benchmark" {%d+}\r\n%b\r\n' % (len(script), script)]
+
+  clients = [BenchmarkClient(port, args.deflate) for _ in range(args.sessions)]
+
+  # Bounds the number of connects and handshakes in flight.
+  semaphore = asyncio.Semaphore(args.connect_concurrency)
+
+  async def connect(client : BenchmarkClient) -> float:
+    async with semaphore:
+      return await client.connect(ssl_context)
+
+  async def run(client : BenchmarkClient, latencies : list) -> None:
+    for index in range(args.requests):
+      latencies.append(await client.request(commands[index % len(commands)]))
+
+  memory_idle = get_rss(pid)
+
+  setup = await asyncio.gather(*(connect(client) for client in clients))
+
+  memory_sessions = get_rss(pid)
+  cpu_start = get_cpu_time(pid)
+
+  latencies = []
+  start = time.monotonic()
+  await asyncio.gather(*(run(client, latencies) for client in clients))
+  elapsed = time.monotonic() - start
+
+  cpu = get_cpu_time(pid)
+  memory_load = get_rss(pid)
+
+  await asyncio.gather(*(client.close() for client in clients))
+
+  messages = sum(client.messages for client in clients)
+  total = sum(client.bytes for client in clients)
+
+  print(f"Setup of {len(setup)} sessions     {format_latency(setup)}")
+  print(f"Requests {len(latencies)} in {elapsed:.2f}s  {format_latency(latencies)}")
+  print(f"  {len(latencies) / elapsed:10.1f} requests/s")
+  print(f"  {messages / elapsed:10.1f} messages/s")
+  print(f"  {total / elapsed / (1024 * 1024):10.2f} MB/s")
+
+  if memory_idle is not None:
+    print(f"Server memory idle {memory_idle / (1024 * 1024):.1f}MB,"
+      + f" with sessions {memory_sessions / (1024 * 1024):.1f}MB,"
+      + f" under load {memory_load / (1024 * 1024):.1f}MB")
+    print(f"  {(memory_sessions - memory_idle) / len(clients) / 1024:10.1f} KB per session")
+
+  if cpu_start is not None:
+    print(f"Server cpu {cpu - cpu_start:.2f}s,"
+      + f" {(cpu - cpu_start) / len(latencies) * 1000000:.0f}us per request")
+
+
+def main() -> None:
+  parser = ArgumentParser(description='Benchmarks the proxy end to end.')
+  parser.add_argument(
+    "--mode", help="The server mode", choices=["threaded", "asyncio"], default="threaded")
+  parser.add_argument("--sessions", help="The number of concurrent sessions", type=int, default=50)
+  parser.add_argument("--requests", help="The requests per session", type=int, default=100)
+  parser.add_argument("--script-size", help="The script size in bytes", type=int, default=16 * 1024)
+  parser.add_argument("--deflate", help="Offers permessage-deflate", action="store_true")
+  parser.add_argument(
+    "--connect-concurrency", help="The number of sessions connecting at once", type=int, default=16)
+  parser.add_argument("--verbose", help="Shows the server's log", action="store_true")
+
+  args = parser.parse_args()
+
+  with tempfile.TemporaryDirectory() as directory:
+    certfile, keyfile = create_certificate(directory)
+
+    sieve_port = get_free_port()
+    port = get_free_port()
+
+    configfile = pathlib.Path(directory, "config.ini")
+    configfile.write_text(CONFIG.format(
+      mode=args.mode, port=port, certfile=certfile, keyfile=keyfile,
+      sieve_port=sieve_port, account=ACCOUNT), encoding="utf-8")
+
+    output = None if args.verbose else subprocess.DEVNULL
+
+    # The proxy verifies the stub's self signed certificate.
+    env = dict(os.environ, SSL_CERT_FILE=certfile)
+
+    processes = []
+
+    try:
+      stub = subprocess.Popen([
+        sys.executable, "-m", "script.benchmark.stubsieve",
+        "--port", str(sieve_port), "--cert", certfile, "--key", keyfile,
+        "--script-size", str(args.script_size)],
+        cwd=WEB_ROOT, stdout=output, stderr=output)
+      processes.append(stub)
+
+      server = subprocess.Popen(
+        [sys.executable, "main.py", "--config", str(configfile)],
+        cwd=WEB_ROOT, env=env, stdout=output, stderr=output)
+      processes.append(server)
+
+      wait_for_port(sieve_port, stub)
+      wait_for_port(port, server)
+
+      print(f"Server mode {args.mode}, {args.sessions} sessions,"
+        + f" {args.requests} requests each, scripts of {args.script_size} bytes")
+
+      asyncio.run(benchmark(args, port, server.pid))
+
+    finally:
+      for process in processes:
+        process.terminate()
+        process.wait()
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,131 @@
+"""
+Compares the ManageSieve tokenizer against the former implementation, which
+sliced the remaining data for every token.
+
+Run it from the web directory via python -m script.benchmark.parser
+"""
+
+import timeit
+
+from argparse import ArgumentParser
+
+from ..sieve.request import Capabilities
+
+
+class SlicingParser:
+  """
+  The former implementation, each token copies the remaining data.
+  """
+
+  def __init__(self, data):
+    self.__data = data
+
+  def is_line_break(self) -> bool:
+    return self.__data.startswith(b'\r\n')
+
+  def extract_line_break(self) -> None:
+    self.__data = self.__data[2:]
+
+  def extract_space(self) -> None:
+    self.__data = self.__data[1:]
+
+  def is_string(self) -> bool:
+    return self.__data.startswith(b'"')
+
+  def extract_string(self) -> bytes:
+    pos = 1
+
+    while True:
+      pos = self.__data.find(b'"', pos) + 1
+
+      # Counts the backslashes in front of the quote.
+      escapes = len(self.__data[:pos - 1]) - len(self.__data[:pos - 1].rstrip(b"\\"))
+      if escapes % 2 == 0:
+        break
+
+    result = self.__data[:pos]
+    self.__data = self.__data[pos:]
+
+    return result
+
+
+def decode_slicing(data : bytes) -> dict:
+  parser = SlicingParser(data)
+  capabilities = {}
+
+  while parser.is_string():
+    key = parser.extract_string()
+
+    value = b""
+    if not parser.is_line_break():
+      parser.extract_space()
+      value = parser.extract_string()
+
+    parser.extract_line_break()
+    capabilities[key.upper()] = value
+
+  return capabilities
+
+
+def decode_cursor(data : bytes) -> dict:
+  return Capabilities().decode(data).get_capabilities()
+
+
+def create_capabilities(size : int) -> bytes:
+  """
+  Creates a capability response of roughly the given size. Values contain
+  escaped quotes, which the former implementation had to count.
+  """
+
+  lines = [b'"IMPLEMENTATION" "Benchmark \\"Sieve\\" Server"\r\n']
+  length = len(lines[0])
+  index = 0
+
+  while length < size:
+    line = b'"X-EXTENSION-%d" "fileinto reject envelope \\"body\\" %d"\r\n' % (index, index)
+    lines.append(line)
+    length += len(line)
+    index += 1
+
+  lines.append(b"OK\r\n")
+  return b"".join(lines)
+
+
+def measure(name : str, func, data : bytes, repeat : int) -> float:
+  seconds = min(timeit.repeat(lambda: func(data), number=1, repeat=repeat))
+  throughput = len(data) / seconds / (1024 * 1024)
+
+  print(f"  {name:<8} {seconds*1000:10.2f} ms  {throughput:10.1f} MB/s")
+  return throughput
+
+
+def main() -> None:
+  parser = ArgumentParser(description='Benchmarks the ManageSieve response parser.')
+  parser.add_argument("--repeat", help="The number of runs per size", type=int, default=3)
+  parser.add_argument(
+    "--sizes", help="The response sizes in bytes", type=int, nargs="+",
+    default=[64 * 1024, 1024 * 1024, 4 * 1024 * 1024, 16 * 1024 * 1024])
+  parser.add_argument(
+    "--max-slicing-size", type=int, default=2 * 1024 * 1024,
+    help="The largest size measured with the former parser, it is quadratic")
+
+  args = parser.parse_args()
+
+  for size in args.sizes:
+    data = create_capabilities(size)
+
+    print(f"Response of {len(data)} bytes")
+    cursor = measure("cursor", decode_cursor, data, args.repeat)
+
+    if len(data) > args.max_slicing_size:
+      continue
+
+    if decode_cursor(data) != decode_slicing(data):
+      raise Exception("Parsers differ")
+
+    slicing = measure("slicing", decode_slicing, data, args.repeat)
+    print(f"  speedup  {cursor / slicing:10.1f}x")
+
+
+if __name__ == "__main__":
+  main()
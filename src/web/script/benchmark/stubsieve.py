@@ -0,0 +1,155 @@
+"""
+A minimal ManageSieve server for benchmarks. It accepts any credentials and
+serves a single script per connection, which is replaced by PUTSCRIPT.
+
+Run it from the web directory via python -m script.benchmark.stubsieve
+"""
+
+import re
+import ssl
+import asyncio
+import logging
+
+from argparse import ArgumentParser
+
+# A client to server literal at the end of a line, RFC 5804 allows both.
+LITERAL = re.compile(rb"\{([0-9]+)\+?\}\r\n$")
+
+CAPABILITIES = (
+  b'"IMPLEMENTATION" "Benchmark Stub"\r\n'
+  b'"SASL" "PLAIN"\r\n'
+  b'"SIEVE" "fileinto reject envelope body"\r\n'
+  b'"VERSION" "1.0"\r\n')
+
+
+def create_script(size : int) -> bytes:
+  line = b'if header :contains "subject" "benchmark" { fileinto "Junk"; }\r\n'
+  return (b'require "fileinto";\r\n' + line * (size // len(line) + 1))[:size]
+
+
+class StubSieveServer:
+  """
+  Serves connections as coroutines, a stub must never be the bottleneck of
+  the proxy it benchmarks.
+  """
+
+  def __init__(self, certfile : str, keyfile : str, script_size : int = 16 * 1024):
+    self.__ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    self.__ssl_context.load_cert_chain(certfile, keyfile)
+
+    self.__script = create_script(script_size)
+
+  async def read_command(self, reader) -> bytes:
+    """
+    Reads a command including the literals it contains.
+    """
+
+    command = bytearray()
+
+    while True:
+      line = await reader.readuntil(b"\r\n")
+      command += line
+
+      literal = LITERAL.search(line)
+      if literal is None:
+        return bytes(command)
+
+      command += await reader.readexactly(int(literal.group(1)))
+
+  async def start_tls(self, reader, writer) -> asyncio.StreamWriter:
+    """
+    Upgrades the connection to tls and returns the writer for the new
+    transport. Unlike StreamWriter.start_tls this works before python 3.11.
+    """
+
+    loop = asyncio.get_running_loop()
+    protocol = writer.transport.get_protocol()
+
+    transport = await loop.start_tls(
+      writer.transport, protocol, self.__ssl_context, server_side=True)
+
+    return asyncio.StreamWriter(transport, protocol, reader, loop)
+
+  async def handle(self, reader, writer) -> None:
+    script = self.__script
+    capabilities = CAPABILITIES + b'"STARTTLS"\r\nOK\r\n'
+
+    try:
+      writer.write(capabilities)
+
+      while True:
+        command = await self.read_command(reader)
+        name = command.split(None, 1)[0].upper() if command.strip() else b""
+
+        if name == b"STARTTLS":
+          writer.write(b"OK\r\n")
+          await writer.drain()
+          writer = await self.start_tls(reader, writer)
+
+          capabilities = CAPABILITIES + b"OK\r\n"
+          writer.write(capabilities)
+
+        elif name == b"CAPABILITY":
+          writer.write(capabilities)
+
+        elif name == b"AUTHENTICATE":
+          writer.write(b"OK\r\n")
+
+        elif name == b"LISTSCRIPTS":
+          writer.write(b'"benchmark" ACTIVE\r\nOK\r\n')
+
+        elif name == b"GETSCRIPT":
+          writer.write(b"{%d}\r\n%b\r\nOK\r\n" % (len(script), script))
+
+        elif name == b"PUTSCRIPT":
+          literal = LITERAL.search(command, 0, command.index(b"\r\n") + 2)
+          if literal is not None:
+            script = command[literal.end():literal.end() + int(literal.group(1))]
+          writer.write(b"OK\r\n")
+
+        elif name == b"NOOP":
+          tag = command[4:].strip()
+          writer.write(b"OK (TAG %b) \"Done\"\r\n" % tag if tag else b"OK\r\n")
+
+        elif name == b"LOGOUT":
+          writer.write(b'OK "Bye"\r\n')
+          await writer.drain()
+          return
+
+        else:
+          writer.write(b'NO "Unknown command"\r\n')
+
+        await writer.drain()
+
+    except (asyncio.IncompleteReadError, ConnectionError, ssl.SSLError):
+      pass
+
+    finally:
+      writer.close()
+
+  async def listen(self, address : str, port : int) -> None:
+    server = await asyncio.start_server(self.handle, address, port)
+
+    logging.info(f"Stub sieve server listening on {address}:{port}")
+
+    async with server:
+      await server.serve_forever()
+
+
+def main() -> None:
+  parser = ArgumentParser(description='Starts a stub ManageSieve server.')
+  parser.add_argument("--address", help="The address to listen on", default="127.0.0.1")
+  parser.add_argument("--port", help="The port to listen on", type=int, default=4190)
+  parser.add_argument("--cert", help="The certificate file", required=True)
+  parser.add_argument("--key", help="The key file", required=True)
+  parser.add_argument(
+    "--script-size", help="The size of the script in bytes", type=int, default=16 * 1024)
+
+  args = parser.parse_args()
+
+  asyncio.run(
+    StubSieveServer(args.cert, args.key, args.script_size).listen(args.address, args.port))
+
+
+if __name__ == "__main__":
+  main()
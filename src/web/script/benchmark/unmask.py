@@ -0,0 +1,58 @@
+"""
+Compares the throughput of the websocket unmasking routines.
+
+Run it from the web directory via python -m script.benchmark.unmask
+"""
+
+import os
+import timeit
+
+from argparse import ArgumentParser
+
+from ..websocket import unmask
+
+
+def unmask_loop(mask : bytes, payload) -> bytearray:
+  """
+  The former implementation which xors byte by byte.
+  """
+  payload = bytearray(payload)
+
+  for idx, value in enumerate(payload):
+    payload[idx] = mask[idx % 4] ^ value
+
+  return payload
+
+
+def measure(name : str, func, mask : bytes, payload : bytes, repeat : int) -> float:
+  seconds = min(timeit.repeat(lambda: func(mask, payload), number=1, repeat=repeat))
+  throughput = len(payload) / seconds / (1024 * 1024)
+
+  print(f"  {name:<8} {seconds*1000:10.2f} ms  {throughput:10.1f} MB/s")
+  return throughput
+
+
+def main() -> None:
+  parser = ArgumentParser(description='Benchmarks the websocket payload unmasking.')
+  parser.add_argument("--repeat", help="The number of runs per size", type=int, default=5)
+  parser.add_argument(
+    "--sizes", help="The payload sizes in bytes", type=int, nargs="+",
+    default=[125, 64 * 1024, 1024 * 1024, 8 * 1024 * 1024])
+
+  args = parser.parse_args()
+
+  for size in args.sizes:
+    data = os.urandom(size)
+    key = os.urandom(4)
+
+    if unmask(key, data) != unmask_loop(key, data):
+      raise Exception("Unmasking routines differ")
+
+    print(f"Payload of {size} bytes")
+    loop = measure("loop", unmask_loop, key, data, args.repeat)
+    bulk = measure("bulk", unmask, key, data, args.repeat)
+    print(f"  speedup  {bulk / loop:10.1f}x")
+
+
+if __name__ == "__main__":
+  main()
@@ -1,21 +1,49 @@
 import configparser
 import pathlib
 import hashlib
+import logging
+import os
+import time
+import select
+import socket
+import threading
+
+from types import MappingProxyType
 
 class NoSuchPropertyException(Exception):
   pass
 
 class SieveAccount:
+  """
+  An immutable snapshot of an account's section.
+
+  All values are read once when the configuration is loaded, so that the
+  getters do not need to access the configparser on each request.
+  """
+
   def __init__(self, section, config):
-    self._config = config
     self._section = section
 
+    # Includes values inherited from the default section, names are lower case.
+    self._properties = MappingProxyType(dict(config[section]))
+
+    self._id = hashlib.sha256(section.encode()).hexdigest()
+
+    self._host = self._properties.get("sievehost")
+    self._port = None
+
+    if "sieveport" in self._properties:
+      self._port = int(self._properties["sieveport"])
+
+    self._connect_timeout = float(self._properties.get("sieveconnecttimeout", 10))
+    self._read_timeout = float(self._properties.get("sievereadtimeout", 30))
+
   def _has_property(self, name):
-    return name in self._config[self._section]
+    return name.lower() in self._properties
 
   def _get_property(self, name):
     if self._has_property(name):
-      return self._config[self._section][name]
+      return self._properties[name.lower()]
 
     raise NoSuchPropertyException("Unknown Property "+name)
 
@@ -24,7 +52,7 @@ class SieveAccount:
     Returns a unique id for the account it is derived from the name
     An guaranteed that is does not contain any non hex characters.
     """
-    return hashlib.sha256(self.get_name().encode()).hexdigest()
+    return self._id
 
   def get_name(self):
     return self._section
@@ -39,10 +67,30 @@ class SieveAccount:
     raise Exception("No authorization configured")
 
   def get_sieve_host(self):
-    return self._get_property("SieveHost")
+    if self._host is None:
+      raise NoSuchPropertyException("Unknown Property SieveHost")
+
+    return self._host
+
+  def get_sieve_port(self) -> int:
+    if self._port is None:
+      raise NoSuchPropertyException("Unknown Property SievePort")
 
-  def get_sieve_port(self):
-    return self._get_property("SievePort")
+    return self._port
+
+  def get_sieve_connect_timeout(self) -> float:
+    """
+    Returns the seconds connecting to the sieve server may take, including
+    all addresses tried.
+    """
+    return self._connect_timeout
+
+  def get_sieve_read_timeout(self) -> float:
+    """
+    Returns the seconds to wait for the sieve server's responses while the
+    connection is set up.
+    """
+    return self._read_timeout
 
   def can_authorize(self):
     return False
@@ -53,10 +101,16 @@ class SieveAccount:
 
 class SieveClientAccount(SieveAccount):
 
+  def __init__(self, section, config):
+    super().__init__(section, config)
+
+    self._can_authorize = config[section].getboolean(
+      "AuthClientAuthorization", fallback=False)
+
   def get_auth_username(self, request):
 
     if self._has_property("AuthUser"):
-      return self._config[self._section]["AuthUser"]
+      return self._get_property("AuthUser")
 
     header = self._get_property("AuthUserHeader")
 
@@ -66,13 +120,11 @@ class SieveClientAccount(SieveAccount):
     return request.get_header(header)
 
   def can_authorize(self):
-    return self._config[self._section].getboolean("AuthClientAuthorization", fallback=False)
+    return self._can_authorize
 
   def can_authenticate(self):
-    if self._config[self._section]["AuthType"].lower() == "client":
-      return True
-
-    return False
+    # Client accounts are created for a missing AuthType as well.
+    return True
 
 class SieveTokenAccount(SieveAccount):
 
@@ -119,17 +171,125 @@ class SieveAuthorizationAccount(SieveAccount):
 
     ## FIXME only temporarily disabled
     #raise NoSuchPropertyException("Invalid username")
-    return self._config[self._section]["AuthUser"]
+    return self._get_property("AuthUser")
 
 
 class Config:
   def __init__(self):
     self._config = configparser.ConfigParser()
+    self._accounts = MappingProxyType({})
+
+    self._filename = None
+    self._mtime = None
+    self._lock = threading.Lock()
+
+    # Wakes up the watcher thread whenever a reload is requested.
+    self._wakeup_reader, self._wakeup_writer = socket.socketpair()
+    self._wakeup_writer.setblocking(False)
 
   def load(self, name):
-    self._config.read(name)
+    self._filename = name
+    self._mtime = self.get_mtime()
+
+    self._config.read(name, encoding="utf-8")
+    self._accounts = self.compile_accounts(self._config)
     return self
 
+  def get_mtime(self) -> int:
+    try:
+      return os.stat(self._filename).st_mtime_ns
+    except OSError:
+      return None
+
+  def reload(self) -> bool:
+    """
+    Re-reads the configuration file and replaces the account table in a
+    single step. Sessions which are already established keep using their
+    account objects. In case of an error the current configuration is kept.
+
+    Server settings like the port or certificates require a restart.
+    """
+
+    with self._lock:
+      start = time.monotonic()
+      mtime = self.get_mtime()
+
+      try:
+        config = configparser.ConfigParser()
+
+        with open(self._filename, encoding="utf-8") as file:
+          config.read_file(file)
+
+        accounts = self.compile_accounts(config)
+
+      except (OSError, ValueError, configparser.Error) as ex:
+        # Do not retry until the file changes again.
+        self._mtime = mtime
+        logging.error(f"Reloading config from {self._filename} failed, cause {ex}")
+        return False
+
+      self._accounts = accounts
+      self._config = config
+      self._mtime = mtime
+
+      logging.info(
+        f"Reloaded config from {self._filename} with {len(accounts)} accounts"
+        + f" in {(time.monotonic() - start)*1000:.1f}ms")
+
+      return True
+
+  def request_reload(self) -> None:
+    """
+    Asks the watcher thread to reload the configuration. It neither locks
+    nor blocks, thus it is safe to be called from a signal handler.
+    """
+    try:
+      self._wakeup_writer.send(b"\0")
+    except BlockingIOError:
+      # A reload is already pending.
+      pass
+
+  def watch(self, interval : float) -> None:
+    """
+    Reloads the configuration on request or whenever the file's modification
+    time changes. The file is polled in the background, a zero interval
+    disables polling.
+    """
+
+    timeout = interval if interval > 0 else None
+
+    def poll():
+      while True:
+        readable, _writable, _errors = select.select(
+          [self._wakeup_reader], [], [], timeout)
+
+        if readable:
+          self._wakeup_reader.recv(4096)
+          self.reload()
+        elif self.get_mtime() != self._mtime:
+          self.reload()
+
+    threading.Thread(target=poll, name="ConfigWatcher", daemon=True).start()
+
+  def compile_accounts(self, config) -> MappingProxyType:
+    """
+    Creates the account table, it maps the unique account id to the account.
+    Invalid sections are skipped.
+    """
+
+    accounts = {}
+
+    for section in config.sections():
+      try:
+        account = self.create_account(section, config)
+      except (NoSuchPropertyException, ValueError, configparser.Error) as ex:
+        logging.warning(f"Skipping invalid account configuration {section}, cause {ex}")
+        continue
+
+      accounts[account.get_id()] = account
+
+    return MappingProxyType(accounts)
+
   def get_http_root(self):
     """
     Retruns the path to the http root containing the static files.
@@ -139,6 +299,18 @@ class Config:
 
     return pathlib.Path(pathlib.Path(__file__).parent.parent.parent.absolute(), "static")
 
+  def get_http_cache_size(self) -> int:
+    """
+    Returns the memory in bytes used for caching static files.
+    """
+    return self._config["DEFAULT"].getint("HttpCacheSize", fallback=32 * 1024 * 1024)
+
+  def can_precompress(self) -> bool:
+    """
+    Checks if gzip siblings for all static files should be created on startup.
+    """
+    return self._config["DEFAULT"].getboolean("HttpPrecompress", fallback=False)
+
   def get_port(self):
     """
     Returns the port on which the sieve proxy should be started.
@@ -151,6 +323,165 @@ class Config:
     """
     return self._config["DEFAULT"]["ServerAddress"]
 
+  def get_server_mode(self) -> str:
+    """
+    Returns how connections are served, either "threaded" or "asyncio".
+    """
+    if "ServerMode" not in self._config["DEFAULT"]:
+      return "threaded"
+
+    return self._config["DEFAULT"]["ServerMode"].lower()
+
+  def get_handshake_timeout(self) -> float:
+    """
+    Returns the seconds a client may take for the tls handshake.
+    """
+    return self._config["DEFAULT"].getfloat("ServerHandshakeTimeout", fallback=10)
+
+  def get_keep_alive_timeout(self) -> float:
+    """
+    Returns the seconds an idle persistent connection is kept open.
+    """
+    return self._config["DEFAULT"].getfloat("ServerKeepAliveTimeout", fallback=15)
+
+  def get_keep_alive_requests(self) -> int:
+    """
+    Returns the maximum number of requests served on a single connection.
+    """
+    return self._config["DEFAULT"].getint("ServerKeepAliveRequests", fallback=100)
+
+  def get_tls_min_version(self) -> str:
+    """
+    Returns the oldest tls version accepted from browsers, e.g. "TLSv1_3".
+    """
+    return self._config["DEFAULT"].get("ServerTlsMinVersion", fallback="TLSv1_2")
+
+  def get_tls_curve(self) -> str:
+    """
+    Returns the ecdh curve used for the key exchange or None for openssl's
+    defaults.
+    """
+    return self._config["DEFAULT"].get("ServerTlsCurve", fallback=None)
+
+  def get_tls_ciphers(self) -> str:
+    """
+    Returns the openssl cipher list used for tls 1.2 and older.
+    """
+    return self._config["DEFAULT"].get(
+      "ServerTlsCiphers", fallback="ECDHE+AESGCM:ECDHE+CHACHA20")
+
+  def get_tls_session_tickets(self) -> int:
+    """
+    Returns the number of session tickets issued per tls 1.3 handshake,
+    zero disables session tickets.
+    """
+    return self._config["DEFAULT"].getint("ServerTlsSessionTickets", fallback=2)
+
+  def get_tls_alpn(self) -> list:
+    """
+    Returns the protocols offered via alpn.
+    """
+    protocols = self._config["DEFAULT"].get("ServerTlsAlpn", fallback="http/1.1")
+    return [protocol.strip() for protocol in protocols.split(",") if protocol.strip()]
+
+  def can_compress_websocket(self) -> bool:
+    """
+    Checks if websocket messages may be compressed with permessage-deflate.
+    """
+    return self._config["DEFAULT"].getboolean("WebSocketCompression", fallback=True)
+
+  def get_websocket_context_takeover(self) -> bool:
+    """
+    Checks if the compression context is kept between websocket messages.
+    """
+    return self._config["DEFAULT"].getboolean(
+      "WebSocketCompressionContextTakeover", fallback=True)
+
+  def get_websocket_window_bits(self) -> int:
+    """
+    Returns the size of the compression window as a power of two.
+    """
+    return self._config["DEFAULT"].getint(
+      "WebSocketCompressionWindowBits", fallback=15)
+
+  def get_websocket_frame_size(self) -> int:
+    """
+    Returns the size in bytes above which messages are sent fragmented.
+    """
+    return self._config["DEFAULT"].getint(
+      "WebSocketFrameSize", fallback=1024*1024)
+
+  def get_sieve_pool_size(self) -> int:
+    """
+    Returns the number of idle sieve connections kept per account and user,
+    0 disables pooling.
+    """
+    return self._config["DEFAULT"].getint("SievePoolSize", fallback=4)
+
+  def get_sieve_pool_idle_time(self) -> float:
+    """
+    Returns the seconds after which idle sieve connections are closed.
+    """
+    return self._config["DEFAULT"].getfloat("SievePoolIdleTime", fallback=60)
+
+  def get_sieve_pool_check_interval(self) -> float:
+    """
+    Returns the seconds after which idle connections are checked before reuse.
+    """
+    return self._config["DEFAULT"].getfloat("SievePoolCheckInterval", fallback=15)
+
+  def get_sieve_dns_ttl(self) -> float:
+    """
+    Returns the seconds the addresses of sieve servers are cached.
+    """
+    return self._config["DEFAULT"].getfloat("SieveDnsCacheTime", fallback=60)
+
+  def get_sieve_capability_ttl(self) -> float:
+    """
+    Returns the seconds the capabilities of a sieve server are cached, zero
+    disables sending cached capabilities.
+    """
+    return self._config["DEFAULT"].getfloat("SieveCapabilityCacheTime", fallback=300)
+
+  def get_websocket_threads(self) -> int:
+    """
+    Returns the number of threads serving websocket sessions in threaded mode.
+    """
+    return self._config["DEFAULT"].getint("WebSocketThreads", fallback=2)
+
+  def get_websocket_high_watermark(self) -> int:
+    """
+    Returns the bytes queued for a peer before reading from the other one
+    is paused.
+    """
+    return self._config["DEFAULT"].getint(
+      "WebSocketHighWatermark", fallback=1024*1024)
+
+  def get_websocket_low_watermark(self) -> int:
+    """
+    Returns the bytes queued for a peer below which reading is resumed.
+    """
+    return self._config["DEFAULT"].getint(
+      "WebSocketLowWatermark", fallback=256*1024)
+
+  def get_websocket_ping_interval(self) -> float:
+    """
+    Returns the seconds a client may be silent before it is pinged.
+    """
+    return self._config["DEFAULT"].getfloat("WebSocketPingInterval", fallback=20)
+
+  def get_websocket_ping_timeout(self) -> float:
+    """
+    Returns the seconds a client may take to answer a ping.
+    """
+    return self._config["DEFAULT"].getfloat("WebSocketPingTimeout", fallback=10)
+
+  def get_websocket_idle_timeout(self) -> float:
+    """
+    Returns the seconds after which a session without messages is closed.
+    """
+    return self._config["DEFAULT"].getfloat("WebSocketIdleTimeout", fallback=0)
+
   def get_keyfile(self):
     """
     The keyfile used for securing the server.
@@ -163,52 +494,58 @@ class Config:
     """
     return self._config["DEFAULT"]["ServerCertFile"]
 
-  def get_auth_type(self, section : str):
+  def get_reload_interval(self) -> float:
+    """
+    Returns the seconds between checks for a changed configuration file.
+    """
+    return self._config["DEFAULT"].getfloat("ConfigReloadInterval", fallback=5)
 
-    if "AuthType" not in self._config[section]:
+  def get_auth_type(self, section : str, config = None):
+
+    if config is None:
+      config = self._config
+
+    if "AuthType" not in config[section]:
       return "client"
 
-    return self._config[section]["AuthType"].lower()
+    return config[section]["AuthType"].lower()
 
-  def get_account_by_section(self, section: str) -> SieveAccount:
-    """
-    Returns the configuration
-    """
+  def create_account(self, section : str, config) -> SieveAccount:
 
-    authtype = self.get_auth_type(section)
+    authtype = self.get_auth_type(section, config)
 
     if authtype == "client":
-      return SieveClientAccount(section, self._config)
+      return SieveClientAccount(section, config)
 
     if authtype == "token":
-      return SieveTokenAccount(section, self._config)
+      return SieveTokenAccount(section, config)
 
     if authtype == "authorization":
-      return SieveAuthorizationAccount(section, self._config)
+      return SieveAuthorizationAccount(section, config)
 
     #if authtype == "server":
-    #  return SieveServerAccount(section, self._config)
+    #  return SieveServerAccount(section, config)
 
     raise NoSuchPropertyException(f"Invalid account type {authtype}")
 
+  def get_account_by_section(self, section: str) -> SieveAccount:
+    """
+    Returns the configuration
+    """
+    return self.create_account(section, self._config)
+
   def get_account_by_id(self, account_id:str):
     """
     Returns the account by the unique id.
     """
 
-    for section in self._config.sections():
-      if hashlib.sha256(section.encode()).hexdigest() == account_id:
-        return self.get_account_by_section(section)
+    if account_id not in self._accounts:
+      raise NoSuchPropertyException(f"Invalid account id {account_id}")
 
-    raise NoSuchPropertyException(f"Invalid account id {account_id}")
+    return self._accounts[account_id]
 
   def get_accounts(self):
     """
     Returns the settings for all known accounts.
     """
-
-    accounts = []
-    for section in self._config.sections():
-      accounts.append(self.get_account_by_section(section))
-
-    return accounts
+    return list(self._accounts.values())
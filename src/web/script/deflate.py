@@ -0,0 +1,254 @@
+import zlib
+import logging
+
+# The name of the websocket extension as defined in RFC 7692.
+EXTENSION_NAME = "permessage-deflate"
+
+# Every message compressed with a sync flush ends with this empty block.
+DEFLATE_TAIL = b"\x00\x00\xff\xff"
+
+MIN_WINDOW_BITS = 8
+MAX_WINDOW_BITS = 15
+
+# Zlib does not support raw deflate streams with a window of 8 bits.
+MIN_DEFLATE_WINDOW_BITS = 9
+
+# Tiny messages grow when compressed, they are sent as they are.
+MIN_COMPRESS_SIZE = 64
+
+
+class DeflateSettings:
+  """
+  The server side preferences used when negotiating permessage-deflate.
+  """
+
+  def __init__(self,
+    enabled : bool = True, context_takeover : bool = True,
+    window_bits : int = MAX_WINDOW_BITS, level : int = 6):
+
+    if not MIN_DEFLATE_WINDOW_BITS <= window_bits <= MAX_WINDOW_BITS:
+      raise Exception(f"Invalid window bits {window_bits}")
+
+    self.enabled = enabled
+    self.context_takeover = context_takeover
+    self.window_bits = window_bits
+    self.level = level
+
+
+def parse_extensions(header : str) -> list:
+  """
+  Splits the Sec-WebSocket-Extensions header into a list of offers. Each
+  offer is the extension's name and a dict with its parameters, parameters
+  without a value map to None.
+  """
+
+  offers = []
+
+  if header is None:
+    return offers
+
+  for offer in header.split(","):
+    items = offer.split(";")
+    name = items[0].strip().lower()
+
+    if not name:
+      continue
+
+    params = {}
+    for item in items[1:]:
+      key, separator, value = item.partition("=")
+      key = key.strip().lower()
+
+      if not key:
+        continue
+
+      params[key] = value.strip().strip('"') if separator else None
+
+    offers.append((name, params))
+
+  return offers
+
+
+def parse_window_bits(value : str) -> int:
+  if value is None or not value.isdigit():
+    return None
+
+  bits = int(value)
+  if not MIN_WINDOW_BITS <= bits <= MAX_WINDOW_BITS:
+    return None
+
+  return bits
+
+
+class PerMessageDeflate:
+  """
+  Compresses and decompresses websocket messages for a single session.
+
+  Unless context takeover was disabled the compressor and decompressor keep
+  their sliding window between messages, so that repeated content like
+  script names or capabilities is encoded by back references.
+  """
+
+  def __init__(self,
+    server_no_context_takeover : bool = False,
+    client_no_context_takeover : bool = False,
+    server_max_window_bits : int = MAX_WINDOW_BITS,
+    client_max_window_bits : int = MAX_WINDOW_BITS,
+    level : int = 6):
+
+    self.__server_no_context_takeover = server_no_context_takeover
+    self.__client_no_context_takeover = client_no_context_takeover
+    self.__server_max_window_bits = server_max_window_bits
+    self.__client_max_window_bits = client_max_window_bits
+    self.__level = level
+
+    self.__compressor = None
+    self.__decompressor = None
+
+    # The payload sizes before and after compression in both directions.
+    self.bytes_in = 0
+    self.bytes_in_compressed = 0
+    self.bytes_out = 0
+    self.bytes_out_compressed = 0
+
+  @staticmethod
+  def negotiate(header : str, settings : DeflateSettings) -> tuple:
+    """
+    Picks the first acceptable permessage-deflate offer from the client.
+    Returns the session's extension and the response header value, or two
+    times None in case no extension could be negotiated.
+    """
+
+    if settings is None or not settings.enabled:
+      return (None, None)
+
+    for name, params in parse_extensions(header):
+      if name != EXTENSION_NAME:
+        continue
+
+      if any(key not in (
+          "server_no_context_takeover", "client_no_context_takeover",
+          "server_max_window_bits", "client_max_window_bits") for key in params):
+        continue
+
+      server_bits = settings.window_bits
+      client_bits = MAX_WINDOW_BITS
+
+      if "server_max_window_bits" in params:
+        bits = parse_window_bits(params["server_max_window_bits"])
+        if bits is None or bits < MIN_DEFLATE_WINDOW_BITS:
+          continue
+        server_bits = min(server_bits, bits)
+
+      if "client_max_window_bits" in params:
+        bits = MAX_WINDOW_BITS
+        if params["client_max_window_bits"] is not None:
+          bits = parse_window_bits(params["client_max_window_bits"])
+          if bits is None:
+            continue
+        client_bits = min(settings.window_bits, bits)
+
+      server_no_context_takeover = \
+        "server_no_context_takeover" in params or not settings.context_takeover
+      client_no_context_takeover = \
+        "client_no_context_takeover" in params or not settings.context_takeover
+
+      response = [EXTENSION_NAME]
+
+      if server_no_context_takeover:
+        response.append("server_no_context_takeover")
+
+      if client_no_context_takeover:
+        response.append("client_no_context_takeover")
+
+      if server_bits < MAX_WINDOW_BITS:
+        response.append(f"server_max_window_bits={server_bits}")
+
+      # The client's window may only be limited if it announced support.
+      if "client_max_window_bits" in params and client_bits < MAX_WINDOW_BITS:
+        response.append(f"client_max_window_bits={client_bits}")
+
+      extension = PerMessageDeflate(
+        server_no_context_takeover, client_no_context_takeover,
+        server_bits, client_bits, settings.level)
+
+      return (extension, "; ".join(response))
+
+    return (None, None)
+
+  @property
+  def ratio_in(self) -> float:
+    """
+    The compression ratio of the received messages.
+    """
+    if not self.bytes_in_compressed:
+      return 1.0
+    return self.bytes_in / self.bytes_in_compressed
+
+  @property
+  def ratio_out(self) -> float:
+    """
+    The compression ratio of the sent messages.
+    """
+    if not self.bytes_out_compressed:
+      return 1.0
+    return self.bytes_out / self.bytes_out_compressed
+
+  def can_compress(self, payload) -> bool:
+    return len(payload) >= MIN_COMPRESS_SIZE
+
+  def compress(self, payload) -> bytes:
+    """
+    Compresses a whole message, the trailing empty block is stripped.
+    """
+
+    if self.__compressor is None:
+      self.__compressor = zlib.compressobj(
+        self.__level, zlib.DEFLATED, -self.__server_max_window_bits)
+
+    data = self.__compressor.compress(payload)
+    data += self.__compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    if data.endswith(DEFLATE_TAIL):
+      data = data[:-len(DEFLATE_TAIL)]
+
+    if self.__server_no_context_takeover:
+      self.__compressor = None
+
+    self.bytes_out += len(payload)
+    self.bytes_out_compressed += len(data)
+
+    return data
+
+  def decompress(self, payload, max_size : int) -> bytearray:
+    """
+    Decompresses a whole message. Messages which would inflate beyond the
+    maximum size are rejected instead of exhausting the memory.
+    """
+
+    if self.__decompressor is None:
+      self.__decompressor = zlib.decompressobj(
+        -max(self.__client_max_window_bits, MIN_DEFLATE_WINDOW_BITS))
+
+    try:
+      data = self.__decompressor.decompress(
+        bytes(payload) + DEFLATE_TAIL, max_size + 1)
+    except zlib.error as ex:
+      raise Exception(f"Invalid compressed message {ex}") from ex
+
+    if len(data) > max_size or self.__decompressor.unconsumed_tail:
+      raise Exception("Message exceeds the maximum size")
+
+    if self.__client_no_context_takeover:
+      self.__decompressor = None
+
+    self.bytes_in += len(data)
+    self.bytes_in_compressed += len(payload)
+
+    return bytearray(data)
+
+  def log(self) -> None:
+    logging.info(
+      f"Websocket compression in {self.bytes_in_compressed}/{self.bytes_in} bytes"
+      f" ({self.ratio_in:.2f}), out {self.bytes_out_compressed}/{self.bytes_out}"
+      f" bytes ({self.ratio_out:.2f})")
@@ -2,12 +2,16 @@ import json
 import logging
 
 from ..http import HttpResponse
+from ..router import ROUTE_EXACT
 
 class ConfigHandler:
 
   def __init__(self, config):
     self.__config = config
 
+  def get_routes(self) -> list:
+    return [("GET", "/config.json", ROUTE_EXACT)]
+
   def can_handle_request(self, request) -> bool:
     if request.method != "GET":
       return False
@@ -17,7 +21,7 @@ class ConfigHandler:
 
     return True
 
-  def handle_request(self, context, request) -> None:
+  def get_accounts(self, request) -> dict:
 
     data = {}
 
@@ -48,9 +52,19 @@ class ConfigHandler:
 
     # for account ins config:
 
+    return data
+
+  def create_response(self) -> HttpResponse:
     response = HttpResponse()
     response.add_headers({
-      'Content-Type': "application/json",
-      'Connection': 'close'
+      'Content-Type': "application/json"
     })
-    response.send(context, json.dumps(data))
+    return response
+
+  def handle_request(self, context, request) -> None:
+    self.create_response().send(
+      context, json.dumps(self.get_accounts(request)))
+
+  async def handle_request_async(self, context, request) -> None:
+    await self.create_response().send_async(
+      context, json.dumps(self.get_accounts(request)))
@@ -1,12 +1,71 @@
 import os
+import gzip
+import logging
+
+from email.utils import parsedate_to_datetime
 
 from ..http import HttpException, HttpResponse
+from .filecache import FileCache, get_etag, get_last_modified
+from ..router import ROUTE_EXACT, ROUTE_FALLBACK
+
+# The default memory used for caching static files.
+DEFAULT_CACHE_SIZE = 32 * 1024 * 1024
+
+# Only text based files are worth compressing.
+COMPRESSIBLE_TYPES = ('text/html', 'text/javascript', 'text/css', 'application/json')
+
+
+def get_quality(params : str) -> float:
+  """
+  Extracts the q value from the parameters of an Accept-Encoding entry.
+  Invalid values are treated as zero.
+  """
+
+  for param in params.split(";"):
+    name, _separator, value = param.partition("=")
+
+    if name.strip().lower() != "q":
+      continue
+
+    try:
+      return float(value.strip())
+    except ValueError:
+      return 0
+
+  return 1
+
+
+def accepts_gzip(header : str) -> bool:
+  """
+  Checks if the Accept-Encoding header permits a gzip encoded response. An
+  explicit gzip entry takes precedence over the wildcard.
+  """
+
+  if header is None:
+    return False
+
+  wildcard = None
+
+  for item in header.split(","):
+    coding, _separator, params = item.partition(";")
+    coding = coding.strip().lower()
+
+    if coding == "gzip":
+      return get_quality(params) > 0
+
+    if coding == "*":
+      wildcard = get_quality(params)
+
+  return wildcard is not None and wildcard > 0
 
 class FileHandler:
 
-  def __init__(self, base : str):
+  def __init__(self, base : str, cache_size : int = DEFAULT_CACHE_SIZE):
     self.__base = base
 
+    self.__resolved = {}
+    self.__cache = FileCache(cache_size)
+
   def get_content_type(self, filename : str) -> str:
 
     extension = os.path.splitext(self.__base+filename)
@@ -39,6 +98,11 @@ class FileHandler:
 
   def resolve_filename(self, filename : str) -> str:
 
+    if filename in self.__resolved:
+      return self.__resolved[filename]
+
+    path = filename
+
     if filename == "/":
       filename = "/app.html"
 
@@ -52,8 +116,40 @@ class FileHandler:
     if not os.path.isfile(filename):
       return None
 
+    # Precompressed siblings are only served as encoding of their file.
+    if filename.endswith(".gz") and os.path.isfile(filename[:-3]):
+      return None
+
+    # Only existing files are remembered, otherwise random urls would
+    # fill the memory. Files removed later on are detected by stat.
+    self.__resolved[path] = filename
     return filename
 
+  def get_routes(self) -> list:
+    """
+    Returns an exact route for each file below the base directory. Files
+    added after the server started are resolved by the fallback route.
+    """
+
+    routes = []
+
+    for directory, _directories, files in os.walk(self.__base):
+      for name in files:
+        path = os.path.relpath(os.path.join(directory, name), self.__base)
+        path = "/" + path.replace(os.sep, "/")
+
+        if self.resolve_filename(path) is None:
+          continue
+
+        routes.append(("GET", path, ROUTE_EXACT))
+
+    if self.resolve_filename("/") is not None:
+      routes.append(("GET", "/", ROUTE_EXACT))
+
+    routes.append(("GET", "/", ROUTE_FALLBACK))
+
+    return routes
+
   def can_handle_request(self, request) -> bool:
     if request.method != "GET":
       return False
@@ -63,18 +159,203 @@ class FileHandler:
 
     return True
 
-  def handle_request(self, context, request) -> None:
+  def is_compressible(self, filename : str) -> bool:
+    return self.get_content_type(filename) in COMPRESSIBLE_TYPES
+
+  def read(self, filename : str, stat, key = None) -> bytes:
+    """
+    Returns the file's content from the cache or disk. Files too large for
+    the cache result in None.
+    """
+
+    if key is None:
+      key = filename
+
+    data = self.__cache.get(key, stat)
+
+    if (data is None) and self.__cache.can_cache(stat.st_size):
+      with open(filename, "rb") as file:
+        stat = os.fstat(file.fileno())
+        data = file.read()
+
+      self.__cache.put(key, stat, data)
+
+    return data
+
+  def get_compressed(self, filename : str, stat) -> tuple:
+    """
+    Returns the gzip encoded variant as content and file name. A
+    precompressed sibling which is newer than the file is preferred,
+    otherwise the file is compressed once and kept in the cache.
+
+    The content is None in case the sibling is too large for the cache and
+    needs to be streamed. Both are None if no gzip variant is available.
+    """
+
+    sibling = filename + ".gz"
+
+    try:
+      sibling_stat = os.stat(sibling)
+    except OSError:
+      sibling_stat = None
+
+    if sibling_stat is not None and sibling_stat.st_mtime_ns >= stat.st_mtime_ns:
+      return (self.read(sibling, sibling_stat), sibling)
+
+    data = self.read(filename, stat)
+
+    if data is None:
+      return (None, None)
+
+    key = (filename, "gzip")
+    compressed = self.__cache.get(key, stat)
+
+    if compressed is None:
+      compressed = gzip.compress(data, compresslevel=9, mtime=0)
+      self.__cache.put(key, stat, compressed)
+
+    return (compressed, filename)
+
+  def precompress(self) -> None:
+    """
+    Creates a gzip sibling for each compressible file below the base
+    directory, existing siblings are only updated if outdated.
+    """
+
+    count = 0
+
+    for directory, _directories, files in os.walk(self.__base):
+      for name in files:
+        filename = os.path.join(directory, name)
+
+        if not self.is_compressible(filename):
+          continue
+
+        sibling = filename + ".gz"
+
+        try:
+          if os.path.exists(sibling) \
+              and os.stat(sibling).st_mtime_ns >= os.stat(filename).st_mtime_ns:
+            continue
+
+          with open(filename, "rb") as file:
+            data = file.read()
+
+          with open(sibling, "wb") as file:
+            file.write(gzip.compress(data, compresslevel=9, mtime=0))
+
+          count += 1
+
+        except OSError as ex:
+          logging.warning(f"Failed to precompress {filename}, cause {ex}")
+
+    logging.info(f"Precompressed {count} files in {self.__base}")
+
+  def is_not_modified(self, request, etag : str, stat) -> bool:
+    """
+    Evaluates the conditional request headers, If-None-Match takes
+    precedence over If-Modified-Since.
+    """
+
+    etags = request.get_header("If-None-Match")
+
+    if etags is not None:
+      if etags.strip() == "*":
+        return True
+
+
+      for tag in etags.split(","):
+        tag = tag.strip()
+
+        # Weak comparison is sufficient for a get request.
+        if tag.startswith("W/"):
+          tag = tag[2:]
+
+        if tag == etag:
+          return True
+
+      return False
+
+    since = request.get_header("If-Modified-Since")
+
+    if since is None:
+      return False
+
+    try:
+      return int(stat.st_mtime) <= parsedate_to_datetime(since).timestamp()
+    except (TypeError, ValueError):
+      return False
+
+  def create_response(self, request) -> tuple:
+    """
+    Returns the response, the cached content and the file name. The content
+    is None in case the file has to be streamed from disk.
+    """
 
     filename = self.resolve_filename(request.path)
 
     if filename is None:
       raise HttpException(404, "File not found")
 
-    # Check if binary or not...
+    try:
+      stat = os.stat(filename)
+    except FileNotFoundError as ex:
+      self.__resolved.pop(request.path, None)
+      raise HttpException(404, "File not found") from ex
+
+    response = HttpResponse()
+    response.add_headers({
+      'Content-Type': self.get_content_type(filename),
+      'Last-Modified': get_last_modified(stat),
+      # Browsers may store the file but have to revalidate it.
+      'Cache-Control': 'no-cache'
+    })
+
+    etag = get_etag(stat)
+    data = None
+    source = None
+
+    if self.is_compressible(filename):
+      response.add_headers({'Vary': 'Accept-Encoding'})
+
+      if accepts_gzip(request.get_header("Accept-Encoding")):
+        data, source = self.get_compressed(filename, stat)
+
+    if source is not None:
+      # Each representation needs a distinct entity tag.
+      etag = etag[:-1] + '-gzip"'
+      response.add_headers({'Content-Encoding': 'gzip'})
+
+    response.add_headers({'ETag': etag})
+
+    if self.is_not_modified(request, etag, stat):
+      response.set_status(304, "Not Modified")
+      return (response, b"", filename)
+
+    if source is not None:
+      return (response, data, source)
+
+    return (response, self.read(filename, stat), filename)
+
+  def handle_request(self, context, request) -> None:
+
+    response, data, filename = self.create_response(request)
+
+    if data is not None:
+      response.send(context, data)
+      return
+
+    with open(filename, "rb") as file:
+      response.send_file(context, file, os.fstat(file.fileno()).st_size)
+
+  async def handle_request_async(self, context, request) -> None:
+
+    response, data, filename = self.create_response(request)
+
+    if data is not None:
+      await response.send_async(context, data)
+      return
+
     with open(filename, "rb") as file:
-      response = HttpResponse()
-      response.add_headers({
-        'Content-Type': self.get_content_type(filename),
-        'Connection': 'close'
-      })
-      response.send(context, file.read())
+      await response.send_file_async(
+        context, file, os.fstat(file.fileno()).st_size)
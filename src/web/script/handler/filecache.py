@@ -0,0 +1,94 @@
+import threading
+
+from collections import OrderedDict
+from email.utils import formatdate
+
+class FileCacheEntry:
+  """
+  The content of a file together with the metadata it was read with.
+  """
+
+  def __init__(self, stat, data : bytes):
+    self.size = stat.st_size
+    self.mtime = stat.st_mtime_ns
+    self.data = data
+
+  def is_valid(self, stat) -> bool:
+    return self.size == stat.st_size and self.mtime == stat.st_mtime_ns
+
+
+def get_etag(stat) -> str:
+  """
+  Derives the entity tag from the file's size and modification time.
+  """
+  return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+
+def get_last_modified(stat) -> str:
+  return formatdate(stat.st_mtime, usegmt=True)
+
+
+class FileCache:
+  """
+  A size bounded least recently used cache for file contents.
+
+  Entries are validated against the file's size and modification time on
+  each lookup, so changes on disk are picked up without restarting.
+  Files larger than the maximum entry size are never cached.
+  """
+
+  def __init__(self, max_size : int, max_entry_size : int = None):
+    self.__lock = threading.Lock()
+    self.__entries = OrderedDict()
+
+    self.__size = 0
+    self.__max_size = max_size
+
+    if max_entry_size is None:
+      max_entry_size = max_size // 4
+
+    self.__max_entry_size = max_entry_size
+
+  def can_cache(self, size : int) -> bool:
+    return size <= self.__max_entry_size
+
+  def get(self, key, stat) -> bytes:
+    """
+    Returns the cached content or None in case it is unknown or outdated.
+    """
+    with self.__lock:
+      entry = self.__entries.get(key)
+
+      if entry is None:
+        return None
+
+      if not entry.is_valid(stat):
+        self.remove(key)
+        return None
+
+      self.__entries.move_to_end(key)
+      return entry.data
+
+  def put(self, key, stat, data : bytes) -> None:
+
+    if not self.can_cache(len(data)):
+      return
+
+    with self.__lock:
+      self.remove(key)
+
+      self.__entries[key] = FileCacheEntry(stat, data)
+      self.__size += len(data)
+
+      while self.__size > self.__max_size:
+        _key, entry = self.__entries.popitem(last=False)
+        self.__size -= len(entry.data)
+
+  def remove(self, key) -> None:
+    """
+    Drops the entry, the caller has to hold the lock.
+    """
+    entry = self.__entries.pop(key, None)
+
+    if entry is not None:
+      self.__size -= len(entry.data)
@@ -1,14 +1,61 @@
+import hashlib
 import logging
 
+from contextlib import ExitStack, contextmanager, asynccontextmanager
+
 from ..websocket import WebSocket
+from ..deflate import DeflateSettings
 from ..sieve.sievesocket import SieveSocket
+from ..sieve.pool import SieveSocketPool
+from ..sieve.tlscache import TlsSessionCache
+from ..sieve.capabilitycache import CapabilityCache
+from ..sieve.connector import Connector
 from ..messagepump import MessagePump
+from ..multiplexer import SessionMultiplexer, Session, NonBlockingSocket
+from ..router import ROUTE_PREFIX
 
 class WebSocketHandler:
 
   def __init__(self, config):
     self.__config = config
 
+    self.__deflate = DeflateSettings(
+      config.can_compress_websocket(),
+      config.get_websocket_context_takeover(),
+      config.get_websocket_window_bits())
+
+    self.__frame_size = config.get_websocket_frame_size()
+    self.__ping_interval = config.get_websocket_ping_interval()
+    self.__ping_timeout = config.get_websocket_ping_timeout()
+    self.__idle_timeout = config.get_websocket_idle_timeout()
+
+    self.__high_watermark = config.get_websocket_high_watermark()
+    self.__low_watermark = config.get_websocket_low_watermark()
+
+    self.__pool = SieveSocketPool(
+      config.get_sieve_pool_size(),
+      config.get_sieve_pool_idle_time(),
+      config.get_sieve_pool_check_interval())
+
+    self.__tls = TlsSessionCache()
+    self.__connector = Connector(config.get_sieve_dns_ttl())
+    self.__capabilities = CapabilityCache(config.get_sieve_capability_ttl())
+
+    # Serves the sessions in threaded mode, threads are started on demand.
+    self.__multiplexer = SessionMultiplexer(
+      config.get_websocket_threads(),
+      self.__high_watermark, self.__low_watermark)
+
+  def create_websocket(self, context, request) -> WebSocket:
+    return WebSocket(
+      request, context, self.__deflate, self.__frame_size,
+      ping_interval=self.__ping_interval,
+      ping_timeout=self.__ping_timeout,
+      idle_timeout=self.__idle_timeout)
+
+  def get_routes(self) -> list:
+    return [("GET", "/websocket/", ROUTE_PREFIX)]
+
   def can_handle_request(self, request) -> bool:
     if request.method != "GET":
       return False
@@ -18,6 +65,145 @@ class WebSocketHandler:
 
     return True
 
+  def get_credentials(self, account, request) -> tuple:
+    """
+    Returns the user, password and authorization used by the proxy to
+    authenticate or None if the client authenticates on its own.
+    """
+
+    if account.can_authenticate():
+      return None
+
+    return (
+      account.get_sieve_user(request),
+      account.get_sieve_password(request),
+      account.get_auth_username(request))
+
+  def get_pool_key(self, account, credentials : tuple) -> tuple:
+    """
+    Connections are only shared between sessions with the same credentials.
+    Connections authenticated by the client are never shared.
+    """
+
+    if credentials is None:
+      return None
+
+    digest = hashlib.sha256("\0".join(credentials).encode()).hexdigest()
+    return (account.get_id(), account.get_sieve_host(), account.get_sieve_port(), digest)
+
+  def create_sievesocket(self, account) -> SieveSocket:
+    return SieveSocket(
+      account.get_sieve_host(), int(account.get_sieve_port()), self.__tls,
+      self.__connector,
+      account.get_sieve_connect_timeout(),
+      account.get_sieve_read_timeout())
+
+  def get_capability_key(self, account, request) -> tuple:
+    """
+    Clients which authenticate on their own get the server's greeting. In
+    case the proxy authenticates, the capabilities may differ per user, e.g.
+    by OWNER or MAXREDIRECTS, thus they are cached per user.
+    """
+
+    credentials = self.get_credentials(account, request)
+
+    if credentials is None:
+      return (account.get_sieve_host(), account.get_sieve_port(), None, None)
+
+    user, _password, authorization = credentials
+    return (account.get_sieve_host(), account.get_sieve_port(), user, authorization)
+
+  def reconcile(self, key, websocket, greeting : bytes, speculated : bytes) -> bool:
+    """
+    Compares the live greeting with the speculative one. Only confirmed
+    greetings are sent speculatively, so they differ only if the server's
+    configuration changed. The client may already rely on the stale
+    capabilities, thus the session is closed with a service restart. Later
+    sessions wait for the live greeting until the new one is confirmed.
+    """
+
+    if self.__capabilities.update(key, greeting, speculated):
+      return True
+
+    websocket.restart()
+    return False
+
+  @contextmanager
+  def connect(self, account, request):
+    """
+    Provides an authenticated connection to the sieve server, pooled
+    connections are preferred. The connection is returned to the pool once
+    the session ended without error.
+    """
+
+    credentials = self.get_credentials(account, request)
+    key = self.get_pool_key(account, credentials)
+
+    sievesocket = None
+    if key is not None:
+      sievesocket = self.__pool.acquire(key)
+
+    try:
+      if sievesocket is None:
+        sievesocket = self.create_sievesocket(account)
+
+        sievesocket.connect()
+        sievesocket.start_tls()
+
+        if credentials is not None:
+          logging.info(f"Do Proxy authentication for {account.get_name()}")
+          sievesocket.authenticate(*credentials)
+
+      yield sievesocket
+
+    except BaseException:
+      if sievesocket is not None:
+        sievesocket.disconnect()
+      raise
+
+    if key is None:
+      sievesocket.disconnect()
+      return
+
+    self.__pool.release(key, sievesocket)
+
+  @asynccontextmanager
+  async def connect_async(self, account, request):
+    """
+    The coroutine counterpart of connect.
+    """
+
+    credentials = self.get_credentials(account, request)
+    key = self.get_pool_key(account, credentials)
+
+    sievesocket = None
+    if key is not None:
+      sievesocket = await self.__pool.acquire_async(key)
+
+    try:
+      if sievesocket is None:
+        sievesocket = self.create_sievesocket(account)
+
+        await sievesocket.connect_async()
+        await sievesocket.start_tls_async()
+
+        if credentials is not None:
+          logging.info(f"Do Proxy authentication for {account.get_name()}")
+          await sievesocket.authenticate_async(*credentials)
+
+      yield sievesocket
+
+    except BaseException:
+      if sievesocket is not None:
+        await sievesocket.disconnect_async()
+      raise
+
+    if key is None:
+      await sievesocket.disconnect_async()
+      return
+
+    await self.__pool.release_async(key, sievesocket)
+
   def handle_request(self, context, request) -> None:
 
     logging.info(f"Websocket Request for {request.path}")
@@ -25,24 +211,83 @@ class WebSocketHandler:
     account = self.__config.get_account_by_id(
       request.path[len("/websocket/"):])
 
-    host = account.get_sieve_host()
-    port = int(account.get_sieve_port())
+    # The session is set up on the worker thread and then handed over to
+    # the multiplexer. The exit stack closes both sockets if the setup fails
+    # and otherwise once the session ends.
+    key = self.get_capability_key(account, request)
 
-    # Websocket is read
-    with WebSocket(request, context) as websocket:
-      with SieveSocket(host, port) as sievesocket:
+    with ExitStack() as stack:
+      websocket = stack.enter_context(self.create_websocket(context, request))
 
-        sievesocket.start_tls()
+      # The browser gets the cached capabilities while connecting, it can
+      # render and send its first command in the meantime.
+      speculated = self.__capabilities.get(key)
+      if speculated is not None:
+        websocket.send(speculated)
 
-        if not account.can_authenticate():
-          logging.info(f"Do Proxy authentication for {account.get_name()}")
-          sievesocket.authenticate(
-            account.get_sieve_user(request),
-            account.get_sieve_password(request),
-            account.get_auth_username(request))
+      sievesocket = stack.enter_context(self.connect(account, request))
 
+      if speculated is None:
         # Publish capabilities to client...
         websocket.send(
           sievesocket.capabilities)
 
-        MessagePump().run(websocket, sievesocket)
+      if not self.reconcile(key, websocket, sievesocket.capabilities, speculated):
+        return
+
+      context.socket = NonBlockingSocket(context.socket)
+      sievesocket.socket = NonBlockingSocket(sievesocket.socket)
+
+      cleanup = stack.pop_all()
+
+    def on_close(ex : Exception) -> None:
+      # A command which was not completely sent leaves the connection
+      # in an unknown state.
+      if sievesocket.socket.has_output():
+        sievesocket.reusable = False
+
+      sievesocket.socket = sievesocket.socket.detach()
+
+      if ex is None:
+        cleanup.close()
+      else:
+        cleanup.__exit__(type(ex), ex, ex.__traceback__)
+
+      context.socket.close()
+
+    context.detached = True
+    self.__multiplexer.add(Session(
+      websocket, context.socket, sievesocket, sievesocket.socket, on_close))
+
+  async def handle_request_async(self, context, request) -> None:
+
+    logging.info(f"Websocket Request for {request.path}")
+
+    account = self.__config.get_account_by_id(
+      request.path[len("/websocket/"):])
+
+    key = self.get_capability_key(account, request)
+
+    async with self.create_websocket(context, request) as websocket:
+
+      speculated = self.__capabilities.get(key)
+      if speculated is not None:
+        await websocket.send_async(speculated)
+
+      async with self.connect_async(account, request) as sievesocket:
+
+        if speculated is None:
+          await websocket.send_async(
+            sievesocket.capabilities)
+
+        if not self.reconcile(key, websocket, sievesocket.capabilities, speculated):
+          return
+
+        # Sending blocks while a peer's buffer is full, which pauses
+        # reading from the other side.
+        context.writer.transport.set_write_buffer_limits(
+          self.__high_watermark, self.__low_watermark)
+        sievesocket.set_write_buffer_limits(
+          self.__high_watermark, self.__low_watermark)
+
+        await MessagePump().run_async(websocket, sievesocket)
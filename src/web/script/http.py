@@ -1,5 +1,7 @@
+import ssl
 import select
 import time
+import asyncio
 
 class HttpException(Exception):
 
@@ -9,12 +11,243 @@ class HttpException(Exception):
     super().__init__(self.reason)
 
 
+# Requests exceeding these limits are rejected before they are parsed.
+MAX_HEADER_SIZE = 64 * 1024
+MAX_HEADER_COUNT = 100
+
+# The size of a single read from the connection.
+RECV_SIZE = 16 * 1024
+
+# Files are streamed in chunks of this size if the kernel can not send them.
+FILE_CHUNK_SIZE = 64 * 1024
+
+
+class HttpParser:
+  """
+  Incrementally locates and parses the request head within a byte buffer.
+
+  The buffer is scanned only once, even if the request arrives in many small
+  reads, as the parser resumes where the previous search stopped.
+  """
+
+  def __init__(self,
+    max_header_size : int = MAX_HEADER_SIZE, max_header_count : int = MAX_HEADER_COUNT):
+
+    self.__max_header_size = max_header_size
+    self.__max_header_count = max_header_count
+    self.__offset = 0
+
+  def find(self, buffer : bytearray) -> int:
+    """
+    Returns the length of the request head including the empty line or -1
+    in case it is still incomplete.
+    """
+
+    end = buffer.find(b"\r\n\r\n", self.__offset)
+
+    if end == -1:
+      if len(buffer) > self.__max_header_size:
+        raise HttpException(431, "Request Header Fields Too Large")
+
+      # The terminator may span the current and the next read.
+      self.__offset = max(0, len(buffer) - 3)
+      return -1
+
+    if end + 4 > self.__max_header_size:
+      raise HttpException(431, "Request Header Fields Too Large")
+
+    return end + 4
+
+  def parse(self, data : bytes) -> tuple:
+    """
+    Splits the request head into the request line and the headers. Header
+    names are normalized to lower case, repeated headers are joined.
+    """
+
+    lines = data.split(b"\r\n")
+
+    request = lines[0].decode("latin-1").split(" ")
+
+    if len(request) != 3:
+      raise HttpException(400, "Malformed request line")
+
+    headers = {}
+
+    # The head ends with an empty line, which results in two empty entries.
+    if len(lines) - 3 > self.__max_header_count:
+      raise HttpException(431, "Request Header Fields Too Large")
+
+    for line in lines[1:]:
+      if not line:
+        continue
+
+      name, separator, value = line.partition(b":")
+
+      if not separator:
+        raise HttpException(400, "Malformed header")
+
+      name = name.strip().decode("latin-1").lower()
+      value = value.strip().decode("latin-1")
+
+      if name in headers:
+        value = headers[name] + ", " + value
+
+      headers[name] = value
+
+    return (request, headers)
+
+
+class HttpBody:
+  """
+  Exposes the request body as a stream, it is decoded from the connection's
+  buffer on demand. Bodies are either delimited by a Content-Length or use
+  the chunked transfer encoding.
+  """
+
+  def __init__(self, length : int = 0, chunked : bool = False):
+    self.__remaining = length
+    self.__chunked = chunked
+
+    self.__state = "size" if chunked else "data"
+
+    if not chunked and not length:
+      self.__state = "done"
+
+  @property
+  def complete(self) -> bool:
+    return self.__state == "done"
+
+  def decode_line(self, buffer : bytearray) -> bytes:
+    end = buffer.find(b"\r\n")
+
+    if end == -1:
+      if len(buffer) > MAX_HEADER_SIZE:
+        raise HttpException(400, "Malformed chunk")
+      return None
+
+    line = bytes(buffer[:end])
+    del buffer[:end+2]
+    return line
+
+  def decode(self, buffer : bytearray, size : int = -1) -> bytes:
+    """
+    Consumes as much of the buffer as possible and returns the decoded
+    payload, at most size bytes. An empty result means more input is needed
+    unless the body is complete.
+    """
+
+    result = bytearray()
+
+    while not self.complete and (size < 0 or len(result) < size):
+
+      if self.__state == "data":
+        length = min(self.__remaining, len(buffer))
+
+        if size >= 0:
+          length = min(length, size - len(result))
+
+        if not length:
+          break
+
+        result += buffer[:length]
+        del buffer[:length]
+        self.__remaining -= length
+
+        if not self.__remaining:
+          self.__state = "crlf" if self.__chunked else "done"
+
+        continue
+
+      if self.__state == "crlf":
+        if len(buffer) < 2:
+          break
+
+        if buffer[:2] != b"\r\n":
+          raise HttpException(400, "Malformed chunk")
+
+        del buffer[:2]
+        self.__state = "size"
+        continue
+
+      line = self.decode_line(buffer)
+
+      if line is None:
+        break
+
+      if self.__state == "trailer":
+        if not line:
+          self.__state = "done"
+        continue
+
+      try:
+        self.__remaining = int(line.split(b";", 1)[0].strip(), 16)
+      except ValueError as ex:
+        raise HttpException(400, "Malformed chunk size") from ex
+
+      self.__state = "data" if self.__remaining else "trailer"
+
+    return bytes(result)
+
+  def read(self, context, size : int = -1) -> bytes:
+    """
+    Reads up to size bytes of the body, or the whole body if size is
+    negative. Returns an empty bytes object once the body is exhausted.
+    """
+
+    result = bytearray()
+
+    while not self.complete:
+      result += self.decode(context.buffer, size - len(result) if size >= 0 else -1)
+
+      if self.complete or (size >= 0 and len(result)):
+        break
+
+      data = context.socket.recv(RECV_SIZE)
+
+      if data == b'':
+        raise HttpException(400, "Incomplete body")
+
+      context.buffer += data
+
+    return bytes(result)
+
+  async def read_async(self, context, size : int = -1) -> bytes:
+
+    result = bytearray()
+
+    while not self.complete:
+      result += self.decode(context.buffer, size - len(result) if size >= 0 else -1)
+
+      if self.complete or (size >= 0 and len(result)):
+        break
+
+      data = await context.reader.read(RECV_SIZE)
+
+      if data == b'':
+        raise HttpException(400, "Incomplete body")
+
+      context.buffer += data
+
+    return bytes(result)
+
+  def discard(self, context) -> None:
+    """
+    Skips the unread remainder, so that the next pipelined request can be read.
+    """
+    while not self.complete:
+      self.read(context, RECV_SIZE)
+
+  async def discard_async(self, context) -> None:
+    while not self.complete:
+      await self.read_async(context, RECV_SIZE)
+
+
 class HttpRequest:
 
   def __init__(self):
     self.__headers = {}
     self.__request = ["", "", ""]
-    self.__payload = None
+    self.__body = HttpBody()
 
   @property
   def url(self) -> str:
@@ -32,11 +265,39 @@ class HttpRequest:
   def method(self) -> str:
     return self.__request[0]
 
-  def get_header(self, name):
-    if name not in self.__headers:
-      return None
+  @property
+  def version(self) -> str:
+    return self.__request[2]
+
+  @property
+  def body(self) -> HttpBody:
+    return self.__body
+
+  @property
+  def keep_alive(self) -> bool:
+    """
+    Checks if the client wants to reuse the connection for further requests.
+    HTTP/1.1 defaults to persistent connections while HTTP/1.0 needs an
+    explicit opt in.
+    """
+    connection = self.get_header("Connection")
+
+    if connection is not None:
+      connection = connection.lower()
 
-    return self.__headers[name]
+      if "close" in connection:
+        return False
+
+      if "keep-alive" in connection:
+        return True
+
+    return self.version == "HTTP/1.1"
+
+  def get_header(self, name):
+    """
+    Returns the header's value, header names are case insensitive.
+    """
+    return self.__headers.get(name.lower())
 
   def wait(self, context) -> None:
 
@@ -50,27 +311,89 @@ class HttpRequest:
       if context.socket in ready_to_read:
         return
 
+  def append(self, context, data : bytes) -> bool:
+    if data == b'':
+      if len(context.buffer):
+        raise HttpException(400, "Incomplete request")
+
+      return False
 
+    context.buffer += data
+    return True
 
-  def recv(self, context, blocking : bool = True) -> None:
+  def recv(self, context, blocking : bool = True) -> bool:
+    """
+    Reads the next request from the connection. Pipelined requests remain
+    in the context's buffer and are consumed by the next call.
 
-    if blocking:
-      self.wait(context)
+    Returns false in case the connection was closed before a request arrived.
+    """
 
-    data = context.socket.recv(4096).decode()
+    parser = HttpParser()
 
-    data = data.split("\r\n\r\n", 1)
+    while True:
+      end = parser.find(context.buffer)
 
-    headers = data[0].split("\r\n")
+      if end != -1:
+        break
 
-    self.__request = headers.pop(0).split(" ")
-    self.__headers = {}
+      if blocking:
+        self.wait(context)
+
+      if not self.append(context, context.socket.recv(RECV_SIZE)):
+        return False
+
+    self.parse(parser, context.buffer, end)
+    return True
+
+  async def recv_async(self, context) -> bool:
+    """
+    The coroutine counterpart of recv.
+    """
+
+    parser = HttpParser()
+
+    while True:
+      end = parser.find(context.buffer)
+
+      if end != -1:
+        break
+
+      if not self.append(context, await context.reader.read(RECV_SIZE)):
+        return False
+
+    self.parse(parser, context.buffer, end)
+    return True
+
+  def parse(self, parser : HttpParser, buffer : bytearray, end : int) -> None:
+    """
+    Consumes the request head from the buffer and prepares the body stream.
+    """
 
-    for header in headers:
-      header = header.split(":", 1)
-      self.__headers[header[0]] = header[1].lstrip()
+    self.__request, self.__headers = parser.parse(bytes(buffer[:end]))
+    del buffer[:end]
 
-    self.__payload = data[1]
+    encoding = self.get_header("Transfer-Encoding")
+    length = self.get_header("Content-Length")
+
+    if encoding is not None:
+      if length is not None:
+        raise HttpException(400, "Ambiguous message length")
+
+      if encoding.lower() != "chunked":
+        raise HttpException(501, "Unsupported transfer encoding")
+
+      self.__body = HttpBody(chunked=True)
+      return
+
+    if length is None:
+      self.__body = HttpBody()
+      return
+
+    if not length.isdigit():
+      raise HttpException(400, "Invalid content length")
+
+    self.__body = HttpBody(int(length))
 
 
 class HttpResponse:
@@ -93,7 +416,7 @@ class HttpResponse:
     self.__reason = reason
 
 
-  def send(self, context, data : bytes = None):
+  def encode(self, data : bytes = None) -> bytes:
 
     time_now = time.strftime("%a, %d %b %Y %H:%M:%S", time.localtime())
 
@@ -115,4 +438,71 @@ class HttpResponse:
 
       response += data
 
-    context.socket.send(response)
+    return response
+
+  def prepare(self, context, data : bytes = None) -> None:
+    """
+    Adds the framing headers needed to keep the connection alive.
+    """
+
+    if 'Connection' not in self.__headers:
+      self.__headers['Connection'] = 'keep-alive' if context.keep_alive else 'close'
+
+    # Informational responses as well as 204 and 304 never carry a body.
+    if self.__code < 200 or self.__code in (204, 304):
+      return
+
+    if 'Content-Length' not in self.__headers:
+      length = 0
+      if data is not None:
+        length = len(data.encode() if isinstance(data, str) else data)
+
+      self.__headers['Content-Length'] = str(length)
+
+  def send(self, context, data : bytes = None):
+    self.prepare(context, data)
+    context.socket.sendall(self.encode(data))
+
+  async def send_async(self, context, data : bytes = None):
+    self.prepare(context, data)
+    context.writer.write(self.encode(data))
+    await context.writer.drain()
+
+  def send_file(self, context, file, length : int) -> None:
+    """
+    Streams the file as body without loading it into memory. Plain sockets
+    use the kernel's sendfile, tls sockets fall back to fixed size chunks.
+    """
+    self.add_headers({'Content-Length': str(length)})
+    self.prepare(context)
+    context.socket.sendall(self.encode())
+
+    if not isinstance(context.socket, ssl.SSLSocket):
+      context.socket.sendfile(file, 0, length)
+      return
+
+    buffer = bytearray(min(FILE_CHUNK_SIZE, max(length, 1)))
+    view = memoryview(buffer)
+
+    while length > 0:
+      count = file.readinto(view[:min(length, len(buffer))])
+
+      if not count:
+        raise Exception("File truncated while sending")
+
+      context.socket.sendall(view[:count])
+      length -= count
+
+  async def send_file_async(self, context, file, length : int) -> None:
+    """
+    The coroutine counterpart of send_file. The event loop uses the kernel's
+    sendfile where possible and otherwise writes chunks with flow control.
+    """
+    self.add_headers({'Content-Length': str(length)})
+    self.prepare(context)
+    context.writer.write(self.encode())
+    await context.writer.drain()
+
+    if length:
+      await asyncio.get_running_loop().sendfile(
+        context.writer.transport, file, 0, length)
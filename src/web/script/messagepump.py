@@ -1,43 +1,92 @@
-import select
+import asyncio
 import logging
 
 class MessagePump:
 
 
-  def wait(self, server, client):
+  def keepalive(self, server, client) -> float:
+    """
+    Runs the keepalive timers and returns the seconds until the next one
+    is due, or None if there is none.
+    """
 
-    ready_to_read, _ready_to_write, in_error \
-      = select.select([server, client], [], [server, client])
+    timeouts = [item.keepalive() for item in (server, client)
+      if hasattr(item, "keepalive")]
 
-    if server in in_error:
-      raise Exception("Reading server connection failed")
+    timeouts = [timeout for timeout in timeouts if timeout is not None]
 
-    if client in in_error:
-      raise Exception("Reading client connection failed")
+    if not timeouts:
+      return None
 
-    return ready_to_read
+    return min(timeouts)
 
-  def run(self, server, client) -> None:
+  def forward(self, source, target, name : str) -> bool:
+    """
+    Copies a message from the source to the target. Returns false as soon
+    as the source terminated.
+    """
+
+    data = source.recv()
+
+    if data == b'':
+      logging.info(f"{name} terminated")
+      return False
+
+    # A read may contain only control frames or a partial message.
+    if data is None:
+      return True
+
+    logging.debug(data)
+    target.send(data)
+    return True
+
+  async def forward_async(self, source, target, name : str) -> None:
+    """
+    Copies messages from the source to the target until the source terminates.
+    """
 
     while True:
-      sockets = self.wait(server, client)
+      data = await source.recv_async()
+
+      if data == b'':
+        logging.info(f"{name} terminated")
+        return
 
-      if server in sockets:
-        data = server.recv()
+      logging.debug(data)
+      await target.send_async(data)
+
+  async def keepalive_async(self, item) -> None:
+    """
+    Runs the item's keepalive timers until they raise a TimeoutError.
+    """
+    while True:
+      await asyncio.sleep(await item.keepalive_async())
 
-        if data == b'':
-          logging.info("Server terminated")
-          return
+  async def run_async(self, server, client) -> None:
+    """
+    Forwards messages between the server and the client until either side
+    terminates. Both directions are forwarded by independent tasks, the
+    pump stops as soon as one of them terminates.
+    """
 
-        logging.debug(data)
-        client.send(data)
+    tasks = [
+      asyncio.ensure_future(self.forward_async(server, client, "Server")),
+      asyncio.ensure_future(self.forward_async(client, server, "Client"))
+    ]
 
-      if client in sockets:
-        data = client.recv()
+    for item in (server, client):
+      if getattr(item, "keepalive_enabled", False):
+        tasks.append(asyncio.ensure_future(self.keepalive_async(item)))
 
-        if data == b'':
-          logging.info(" Client terminated")
-          return
+    try:
+      done, _pending = await asyncio.wait(
+        tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+      for task in tasks:
+        task.cancel()
 
-        logging.debug(data)
-        server.send(data)
+    for task in done:
+      try:
+        task.result()
+      except TimeoutError as ex:
+        logging.info(f"Session closed, {ex}")
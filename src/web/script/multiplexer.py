@@ -0,0 +1,461 @@
+import ssl
+import time
+import heapq
+import socket
+import logging
+import selectors
+import threading
+import itertools
+
+from collections import deque
+
+from .messagepump import MessagePump
+
+# The maximum number of bytes handed to a single send call.
+SEND_SIZE = 256 * 1024
+
+# Reading from a peer stops as soon as more than the high watermark is
+# queued for the other side and resumes once it drained below the low one.
+DEFAULT_HIGH_WATERMARK = 1024 * 1024
+DEFAULT_LOW_WATERMARK = 256 * 1024
+
+# Raised by non-blocking sockets in case no data is available or the send
+# buffer is full. Tls sockets may need to read in order to write and vice
+# versa, both cases are handled the same way.
+WOULD_BLOCK = (ssl.SSLWantReadError, ssl.SSLWantWriteError, BlockingIOError)
+
+
+class NonBlockingSocket:
+  """
+  Wraps a connected socket for the multiplexer. Reads fail instead of
+  blocking and writes are queued in an output buffer which is flushed as
+  soon as the peer accepts more data.
+
+  It behaves like a blocking socket to the websocket and sieve code, so
+  that the protocol handling is shared between all server modes.
+  """
+
+  def __init__(self, sock):
+    self.__socket = sock
+    self.__socket.setblocking(False)
+
+    self.__output = deque()
+    self.__output_size = 0
+
+  def fileno(self) -> int:
+    return self.__socket.fileno()
+
+  def pending(self) -> int:
+    if not hasattr(self.__socket, "pending"):
+      return 0
+
+    return self.__socket.pending()
+
+  @property
+  def output_size(self) -> int:
+    """
+    The number of bytes waiting to be sent.
+    """
+    return self.__output_size
+
+  def has_output(self) -> bool:
+    return self.__output_size > 0
+
+  def recv(self, size : int) -> bytes:
+    return self.__socket.recv(size)
+
+  def recv_into(self, buffer, size : int = 0) -> int:
+    return self.__socket.recv_into(buffer, size)
+
+  def sendall(self, data) -> None:
+    if not len(data):
+      return
+
+    self.__output.append(memoryview(data))
+    self.__output_size += len(data)
+
+    self.flush()
+
+  def send(self, data) -> int:
+    self.sendall(data)
+    return len(data)
+
+  def flush(self) -> None:
+    """
+    Sends as much of the output buffer as possible without blocking.
+    """
+
+    output = self.__output
+
+    while output:
+      chunk = output[0]
+
+      try:
+        # A retry after a tls want error has to pass the same data again.
+        length = self.__socket.send(chunk[:SEND_SIZE])
+      except WOULD_BLOCK:
+        return
+
+      self.__output_size -= length
+
+      if length < len(chunk):
+        output[0] = chunk[length:]
+      else:
+        output.popleft()
+
+  def detach(self):
+    """
+    Returns the wrapped socket in blocking mode. Unsent output is dropped.
+    """
+    self.__output.clear()
+    self.__output_size = 0
+
+    self.__socket.setblocking(True)
+    return self.__socket
+
+  def settimeout(self, _timeout) -> None:
+    # The multiplexer never blocks, timeouts are done via timers.
+    pass
+
+  def shutdown(self, how) -> None:
+    self.__socket.shutdown(how)
+
+  def close(self) -> None:
+    """
+    Sends what is possible without blocking, e.g. a close frame, and
+    closes the socket.
+    """
+    try:
+      self.flush()
+    except OSError:
+      pass
+
+    self.__output.clear()
+    self.__output_size = 0
+
+    self.__socket.close()
+
+
+class Session:
+  """
+  A websocket and its sieve connection served by the multiplexer.
+  """
+
+  def __init__(self,
+    server, server_socket : NonBlockingSocket,
+    client, client_socket : NonBlockingSocket, on_close):
+
+    self.server = server
+    self.server_socket = server_socket
+    self.client = client
+    self.client_socket = client_socket
+
+    self.on_close = on_close
+    self.closed = False
+
+    # The selector events currently registered per socket.
+    self.events = {}
+    # Reading is paused while the other side's output buffer is full.
+    self.paused = {server_socket: False, client_socket: False}
+
+  def get_route(self, sock) -> tuple:
+    """
+    Returns the source, the target and the source's name for the socket.
+    """
+    if sock is self.server_socket:
+      return (self.server, self.client, "Server")
+
+    return (self.client, self.server, "Client")
+
+  def get_peer(self, sock) -> NonBlockingSocket:
+    """
+    Returns the socket which receives the data read from the given one.
+    """
+    if sock is self.server_socket:
+      return self.client_socket
+
+    return self.server_socket
+
+
+class SessionLoop:
+  """
+  Serves sessions on a single thread. All sockets are multiplexed via a
+  selector, which uses epoll on linux and is not bound to FD_SETSIZE.
+  """
+
+  def __init__(self, name : str,
+    high_watermark : int = DEFAULT_HIGH_WATERMARK,
+    low_watermark : int = DEFAULT_LOW_WATERMARK):
+
+    self.__name = name
+    self.__high_watermark = high_watermark
+    self.__low_watermark = min(low_watermark, high_watermark)
+    self.__selector = selectors.DefaultSelector()
+    self.__pending = deque()
+    self.__pump = MessagePump()
+
+    # The keepalive timers as heap of deadline, sequence and session.
+    self.__timers = []
+    self.__sequence = itertools.count()
+
+    # Sessions are added from the worker threads and closed on the loop.
+    self.__sessions = 0
+    self.__sessions_lock = threading.Lock()
+
+    self.__wakeup_reader, self.__wakeup_writer = socket.socketpair()
+    self.__wakeup_reader.setblocking(False)
+    self.__selector.register(self.__wakeup_reader, selectors.EVENT_READ, None)
+
+    self.__thread = None
+
+  @property
+  def sessions(self) -> int:
+    return self.__sessions
+
+  def start(self) -> 'SessionLoop':
+    self.__thread = threading.Thread(
+      target=self.run, name=self.__name, daemon=True)
+    self.__thread.start()
+    return self
+
+  def queue(self, session : Session, callback) -> None:
+    """
+    Schedules the callback to be run on the loop's thread. The session is
+    closed in case the callback fails.
+    """
+    self.__pending.append((session, callback))
+    self.__wakeup_writer.send(b"\0")
+
+  def add(self, session : Session) -> None:
+    with self.__sessions_lock:
+      self.__sessions += 1
+
+    self.queue(session, lambda: self.register(session))
+
+  def register(self, session : Session) -> None:
+    for sock in (session.server_socket, session.client_socket):
+      self.__selector.register(
+        sock, selectors.EVENT_READ, (session, sock))
+      session.events[sock] = selectors.EVENT_READ
+
+    self.schedule(session)
+
+    # Data received during the setup is invisible to the selector.
+    for sock in (session.server_socket, session.client_socket):
+      if not session.closed:
+        self.ready(session, sock, selectors.EVENT_READ)
+
+  def update(self, session : Session) -> None:
+    """
+    Waits for writability only while output is queued and for readability
+    only while the peer's output buffer is below the watermarks.
+    """
+
+    resumed = []
+
+    for sock in (session.server_socket, session.client_socket):
+      queued = session.get_peer(sock).output_size
+
+      if session.paused[sock] and queued <= self.__low_watermark:
+        session.paused[sock] = False
+        resumed.append(sock)
+
+      elif not session.paused[sock] and queued > self.__high_watermark:
+        session.paused[sock] = True
+
+      events = 0
+
+      if not session.paused[sock]:
+        events |= selectors.EVENT_READ
+
+      if sock.has_output():
+        events |= selectors.EVENT_WRITE
+
+      self.set_events(session, sock, events)
+
+    # Data buffered while paused is invisible to the selector.
+    for sock in resumed:
+      if not session.closed:
+        self.ready(session, sock, selectors.EVENT_READ)
+
+  def set_events(self, session : Session, sock, events : int) -> None:
+    current = session.events[sock]
+
+    if current == events:
+      return
+
+    if not events:
+      self.__selector.unregister(sock)
+    elif not current:
+      self.__selector.register(sock, events, (session, sock))
+    else:
+      self.__selector.modify(sock, events, (session, sock))
+
+    session.events[sock] = events
+
+  def close(self, session : Session, ex : Exception = None) -> None:
+    if session.closed:
+      return
+
+    session.closed = True
+
+    with self.__sessions_lock:
+      self.__sessions -= 1
+
+    for sock in (session.server_socket, session.client_socket):
+      try:
+        self.__selector.unregister(sock)
+      except (KeyError, ValueError):
+        pass
+
+    try:
+      session.on_close(ex)
+    except Exception as error:
+      logging.debug(f"Closing session failed {error}")
+
+  def ready(self, session : Session, sock, events) -> None:
+
+    try:
+      if events & selectors.EVENT_WRITE:
+        sock.flush()
+
+      if events & selectors.EVENT_READ and not session.paused[sock]:
+        source, target, name = session.get_route(sock)
+        peer = session.get_peer(sock)
+
+        while True:
+          try:
+            if not self.__pump.forward(source, target, name):
+              self.close(session)
+              return
+          except WOULD_BLOCK:
+            break
+
+          # Stops reading as soon as the other side can not keep up.
+          if peer.output_size > self.__high_watermark:
+            break
+
+          # Tls may have decrypted more than was consumed.
+          if not source.pending():
+            break
+
+      self.update(session)
+
+    except OSError as ex:
+      logging.debug(f"Session connection lost {ex}")
+      self.close(session, ex)
+
+    except Exception as ex:
+      logging.info(f"Session failed {ex}")
+      self.close(session, ex)
+
+  def schedule(self, session : Session) -> None:
+    """
+    Runs the session's keepalive and arms its next timer.
+    """
+
+    try:
+      timeout = self.__pump.keepalive(session.server, session.client)
+      self.update(session)
+
+    except Exception as ex:
+      logging.info(f"Session closed, {ex}")
+      self.close(session, ex if not isinstance(ex, TimeoutError) else None)
+      return
+
+    if timeout is None:
+      return
+
+    heapq.heappush(self.__timers,
+      (time.monotonic() + timeout, next(self.__sequence), session))
+
+  def run_timers(self) -> float:
+    """
+    Runs all due timers and returns the seconds until the next one.
+    """
+
+    timers = self.__timers
+
+    while timers:
+      deadline, _sequence, session = timers[0]
+      remaining = deadline - time.monotonic()
+
+      if remaining > 0:
+        return remaining
+
+      heapq.heappop(timers)
+      self.dispatch(session, self.schedule, session)
+
+    return None
+
+  def dispatch(self, session : Session, callback, *args) -> None:
+    """
+    Runs a callback for the session. A failure closes only this session,
+    it must never terminate the loop serving all others.
+    """
+
+    if session.closed:
+      return
+
+    try:
+      callback(*args)
+
+    except Exception as ex:
+      logging.error(f"Session callback failed {ex}")
+      self.close(session, ex)
+
+  def run(self) -> None:
+
+    while True:
+      while self.__pending:
+        session, callback = self.__pending.popleft()
+        self.dispatch(session, callback)
+
+      timeout = self.run_timers()
+
+      for key, events in self.__selector.select(timeout=timeout):
+        if key.data is None:
+          self.__wakeup_reader.recv(4096)
+          continue
+
+        session, sock = key.data
+        self.dispatch(session, self.ready, session, sock, events)
+
+
+class SessionMultiplexer:
+  """
+  Serves all websocket sessions of the threaded mode on a small fixed number
+  of threads, instead of occupying a worker thread per session. The number
+  of concurrent sessions is only bound by memory and file descriptors.
+
+  The memory per session is bound by flow control. Each direction's output
+  buffer holds at most the high watermark plus a single message.
+  """
+
+  def __init__(self, threads : int = 2,
+    high_watermark : int = DEFAULT_HIGH_WATERMARK,
+    low_watermark : int = DEFAULT_LOW_WATERMARK):
+
+    self.__threads = max(int(threads), 1)
+    self.__high_watermark = int(high_watermark)
+    self.__low_watermark = int(low_watermark)
+    self.__loops = None
+    self.__lock = threading.Lock()
+
+  def start(self) -> 'SessionMultiplexer':
+    with self.__lock:
+      if self.__loops is None:
+        self.__loops = [
+          SessionLoop(
+            f"SessionLoop-{index}",
+            self.__high_watermark, self.__low_watermark).start()
+            for index in range(self.__threads)]
+
+    return self
+
+  def add(self, session : Session) -> None:
+    """
+    Hands the session to the loop serving the fewest sessions.
+    """
+    self.start()
+    min(self.__loops, key=lambda loop: loop.sessions).add(session)
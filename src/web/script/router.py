@@ -0,0 +1,87 @@
+import logging
+
+# Matches only the given path.
+ROUTE_EXACT = "exact"
+# Matches all paths below the given single segment prefix, e.g. "/websocket/".
+ROUTE_PREFIX = "prefix"
+# Probes the handler via can_handle_request for paths without a route.
+ROUTE_FALLBACK = "fallback"
+
+class Router:
+  """
+  Dispatches requests to handlers with constant costs per request.
+
+  The routes are collected once from the handlers when the server starts
+  and compiled into lookup tables. Exact routes are keyed by method and
+  path, prefix routes by method and the path's first segment.
+
+  Handlers without a get_routes method or with a fallback route are probed
+  via can_handle_request in order of registration, as a fallback for
+  unknown paths.
+  """
+
+  def __init__(self):
+    self.__exact = {}
+    self.__prefixes = {}
+    self.__fallback = []
+
+  def add(self, method : str, path : str, handler, kind : str = ROUTE_EXACT) -> None:
+    """
+    Registers a route, the first handler registered for a route wins.
+    """
+
+    if kind == ROUTE_EXACT:
+      self.__exact.setdefault((method, path), handler)
+      return
+
+    if kind == ROUTE_PREFIX:
+      if not path.startswith("/") or not path.endswith("/") or path.count("/") != 2:
+        raise Exception(f"Prefix route {path} is not a single path segment")
+
+      self.__prefixes.setdefault((method, path), handler)
+      return
+
+    if kind == ROUTE_FALLBACK:
+      if handler not in self.__fallback:
+        self.__fallback.append(handler)
+      return
+
+    raise Exception(f"Invalid route type {kind}")
+
+  def compile(self, handlers) -> 'Router':
+
+    for handler in handlers:
+      if not hasattr(handler, "get_routes"):
+        self.__fallback.append(handler)
+        continue
+
+      for method, path, kind in handler.get_routes():
+        self.add(method, path, handler, kind)
+
+    logging.info(
+      f"Compiled {len(self.__exact)} exact and {len(self.__prefixes)} prefix routes")
+
+    return self
+
+  def route(self, request):
+    """
+    Returns the handler for the request or None if there is none.
+    """
+
+    path = request.path
+
+    handler = self.__exact.get((request.method, path))
+    if handler is not None:
+      return handler
+
+    end = path.find("/", 1)
+    if end != -1:
+      handler = self.__prefixes.get((request.method, path[:end+1]))
+      if handler is not None:
+        return handler
+
+    for handler in self.__fallback:
+      if handler.can_handle_request(request):
+        return handler
+
+    return None
@@ -0,0 +1,79 @@
+import time
+import logging
+import threading
+
+DEFAULT_TTL = 300
+
+
+class CapabilityCache:
+  """
+  Remembers the capabilities each sieve server announced after STARTTLS.
+
+  A new session sends the cached greeting to the browser right away and
+  connects to the sieve server meanwhile, so that the editor does not wait
+  for the tcp and tls handshakes and the authentication.
+
+  A greeting is only used once two consecutive connections announced it.
+  After a mismatch the cache falls back to waiting for the live greeting
+  until the new one is confirmed.
+  """
+
+  def __init__(self, ttl : float = DEFAULT_TTL):
+    self.__ttl = float(ttl)
+    self.__entries = {}
+    self.__lock = threading.Lock()
+
+    self.hits = 0
+    self.misses = 0
+    self.mismatches = 0
+
+  @property
+  def enabled(self) -> bool:
+    return self.__ttl > 0
+
+  def get(self, key) -> bytes:
+    """
+    Returns the greeting for the key or None if it is unknown, expired or
+    not yet confirmed.
+    """
+
+    if not self.enabled:
+      return None
+
+    with self.__lock:
+      entry = self.__entries.get(key)
+
+      if entry is not None and entry[0] < time.monotonic():
+        del self.__entries[key]
+        entry = None
+
+      if entry is None or not entry[2]:
+        self.misses += 1
+        return None
+
+      self.hits += 1
+      return entry[1]
+
+  def update(self, key, greeting : bytes, speculated : bytes = None) -> bool:
+    """
+    Stores the live greeting. Returns false if it differs from the one
+    which was sent speculatively.
+    """
+
+    if not self.enabled:
+      return True
+
+    with self.__lock:
+      entry = self.__entries.get(key)
+      confirmed = entry is not None and entry[1] == greeting
+
+      self.__entries[key] = (time.monotonic() + self.__ttl, greeting, confirmed)
+
+      if speculated is None or speculated == greeting:
+        return True
+
+      self.mismatches += 1
+
+    logging.info(
+      f"Sieve capabilities changed, {self.mismatches} mismatches in {self.hits} hits")
+    return False
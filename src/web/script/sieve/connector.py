@@ -0,0 +1,244 @@
+import time
+import errno
+import socket
+import asyncio
+import logging
+import selectors
+import threading
+
+DEFAULT_DNS_TTL = 60
+DEFAULT_CONNECT_TIMEOUT = 10
+DEFAULT_READ_TIMEOUT = 30
+
+# The delay before the next address is tried while the previous attempt is
+# still pending, as recommended by RFC 8305.
+CONNECTION_ATTEMPT_DELAY = 0.25
+
+IN_PROGRESS = (errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EAGAIN)
+
+
+def interleave(addresses : list) -> list:
+  """
+  Orders the addresses so that the families alternate, starting with the
+  family of the most preferred address, as described in RFC 8305.
+  """
+
+  if not addresses:
+    return []
+
+  preferred = [item for item in addresses if item[0] == addresses[0][0]]
+  others = [item for item in addresses if item[0] != addresses[0][0]]
+
+  result = []
+  for index in range(max(len(preferred), len(others))):
+    result.extend(group[index] for group in (preferred, others) if index < len(group))
+
+  return result
+
+
+class Connector:
+  """
+  Establishes the tcp connections to sieve servers.
+
+  Resolved addresses are cached for the dns ttl, so that connecting does not
+  wait for a lookup each time. Ipv6 and ipv4 addresses are tried in parallel
+  staggered by a short delay (Happy Eyeballs), a broken ipv6 route then costs
+  a quarter of a second instead of the system's tcp timeout. The whole
+  attempt is bound by the connect timeout.
+  """
+
+  def __init__(self,
+    dns_ttl : float = DEFAULT_DNS_TTL,
+    attempt_delay : float = CONNECTION_ATTEMPT_DELAY):
+
+    self.__dns_ttl = float(dns_ttl)
+    self.__attempt_delay = float(attempt_delay)
+
+    self.__addresses = {}
+    self.__lock = threading.Lock()
+
+  def lookup(self, host : str, port : int) -> list:
+    """
+    Returns the cached addresses or None.
+    """
+
+    with self.__lock:
+      entry = self.__addresses.get((host, port))
+
+      if entry is None or entry[0] < time.monotonic():
+        return None
+
+      return entry[1]
+
+  def store(self, host : str, port : int, infos : list) -> list:
+    addresses = interleave(
+      [(family, kind, proto, address) for family, kind, proto, _name, address in infos])
+
+    if not addresses:
+      raise OSError(f"No address found for {host}")
+
+    if self.__dns_ttl > 0:
+      with self.__lock:
+        self.__addresses[(host, port)] = (time.monotonic() + self.__dns_ttl, addresses)
+
+    return addresses
+
+  def resolve(self, host : str, port : int) -> list:
+    addresses = self.lookup(host, port)
+
+    if addresses is not None:
+      return addresses
+
+    return self.store(
+      host, port, socket.getaddrinfo(host, port, type=socket.SOCK_STREAM))
+
+  async def resolve_async(self, host : str, port : int) -> list:
+    addresses = self.lookup(host, port)
+
+    if addresses is not None:
+      return addresses
+
+    loop = asyncio.get_running_loop()
+    return self.store(
+      host, port, await loop.getaddrinfo(host, port, type=socket.SOCK_STREAM))
+
+  def forget(self, host : str, port : int) -> None:
+    """
+    Drops the cached addresses, e.g. after all of them failed.
+    """
+    with self.__lock:
+      self.__addresses.pop((host, port), None)
+
+  def connect(self,
+    host : str, port : int, timeout : float = DEFAULT_CONNECT_TIMEOUT) -> socket.socket:
+    """
+    Returns a connected blocking socket, attempts run concurrently on a
+    selector without additional threads.
+    """
+
+    deadline = time.monotonic() + timeout
+    addresses = list(self.resolve(host, port))
+
+    selector = selectors.DefaultSelector()
+    error = None
+
+    try:
+      while True:
+        if addresses:
+          family, kind, proto, address = addresses.pop(0)
+          sock = socket.socket(family, kind, proto)
+          sock.setblocking(False)
+
+          result = sock.connect_ex(address)
+
+          if result == 0:
+            sock.setblocking(True)
+            return self.connected(sock)
+
+          if result in IN_PROGRESS:
+            selector.register(sock, selectors.EVENT_WRITE, address)
+          else:
+            sock.close()
+            error = OSError(result, f"Connecting {address} failed")
+            # A failed attempt starts the next one right away.
+            continue
+
+        elif not selector.get_map():
+          self.forget(host, port)
+          raise error or OSError(f"Connecting {host}:{port} failed")
+
+        remaining = deadline - time.monotonic()
+
+        if remaining <= 0:
+          raise TimeoutError(f"Connecting {host}:{port} timed out")
+
+        wait = remaining
+        if addresses:
+          wait = min(self.__attempt_delay, remaining)
+
+        for key, _events in selector.select(wait):
+          sock = key.fileobj
+          selector.unregister(sock)
+
+          result = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+
+          if result == 0:
+            sock.setblocking(True)
+            return self.connected(sock)
+
+          sock.close()
+          error = OSError(result, f"Connecting {key.data} failed")
+
+    finally:
+      # Closes the attempts which lost the race.
+      for key in list(selector.get_map().values()):
+        key.fileobj.close()
+
+      selector.close()
+
+  def connected(self, sock : socket.socket) -> socket.socket:
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    logging.debug(f"Connected to {sock.getpeername()}")
+    return sock
+
+  async def connect_async(self,
+    host : str, port : int, timeout : float = DEFAULT_CONNECT_TIMEOUT) -> socket.socket:
+    """
+    The coroutine counterpart of connect, it returns a connected socket
+    to be passed to asyncio.open_connection.
+    """
+
+    loop = asyncio.get_running_loop()
+
+    async def attempt(family, kind, proto, address) -> socket.socket:
+      sock = socket.socket(family, kind, proto)
+      sock.setblocking(False)
+
+      try:
+        await loop.sock_connect(sock, address)
+      except BaseException:
+        sock.close()
+        raise
+
+      return sock
+
+    async def race() -> socket.socket:
+      addresses = list(await self.resolve_async(host, port))
+      attempts = set()
+      error = None
+
+      try:
+        while True:
+          if addresses:
+            attempts.add(asyncio.ensure_future(attempt(*addresses.pop(0))))
+          elif not attempts:
+            self.forget(host, port)
+            raise error or OSError(f"Connecting {host}:{port} failed")
+
+          done, attempts = await asyncio.wait(
+            attempts, timeout=self.__attempt_delay if addresses else None,
+            return_when=asyncio.FIRST_COMPLETED)
+
+          winner = None
+
+          for task in done:
+            if task.exception() is not None:
+              error = task.exception()
+            elif winner is None:
+              winner = task.result()
+            else:
+              task.result().close()
+
+          if winner is not None:
+            return self.connected(winner)
+
+      finally:
+        # Attempts which lost the race close their socket when cancelled.
+        for task in attempts:
+          task.cancel()
+
+    try:
+      return await asyncio.wait_for(race(), timeout)
+    except asyncio.TimeoutError as ex:
+      raise TimeoutError(f"Connecting {host}:{port} timed out") from ex
@@ -1,77 +1,179 @@
+import re
+
+# The tokens of the ManageSieve grammar as defined in RFC 5804.
+ATOM = re.compile(rb"[!#-'*-\[\]-z|-~]+")
+NUMBER = re.compile(rb"[0-9]+")
+QUOTED = re.compile(rb'"(?:[^"\\\r\n]|\\["\\])*"')
+LITERAL = re.compile(rb"\{([0-9]+)\+?\}\r\n")
+
+
 class Parser:
+  """
+  Tokenizes a ManageSieve response.
+
+  The parser only advances a position, the data is never copied while
+  parsing. Tokens are sliced via a memoryview, thus the costs are linear
+  in the size of the response.
+
+  Strings are returned as they were received, including the quotes or the
+  literal's length, so that they can be forwarded unchanged.
+  """
 
   def __init__(self, data):
     self.__data = data
+    self.__view = memoryview(data)
+    self.__pos = 0
+
+  @property
+  def position(self) -> int:
+    return self.__pos
+
+  def slice(self, start : int, end : int) -> bytes:
+    return bytes(self.__view[start:end])
+
+  def advance(self, end : int) -> bytes:
+    """
+    Consumes and returns the data up to the given position.
+    """
+    token = self.slice(self.__pos, end)
+    self.__pos = end
+    return token
 
   def is_line_break(self) -> bool:
-    return self.__data.startswith(b'\r\n')
+    return self.__data.startswith(b'\r\n', self.__pos)
 
   def extract_line_break(self) -> None:
     if not self.is_line_break():
       raise Exception("No Linebreak found")
 
-    self.__data = self.__data[2:]
+    self.__pos += 2
 
   def is_space(self) -> bool:
-    return self.__data.startswith(b' ')
+    return self.__data.startswith(b' ', self.__pos)
 
   def extract_space(self) -> None:
     if not self.is_space():
       raise Exception("No Space found")
 
-    self.__data = self.__data[1:]
+    self.__pos += 1
 
-  def is_string(self) -> bool:
-    return self.__data.startswith(b'"')
+  def startswith(self, token) -> bool:
+    return self.__data.startswith(token, self.__pos)
 
-  def startswith(self, token: str) -> bool:
-    return self.__data.startswith(token)
+  def is_empty(self) -> bool:
+    return self.__pos >= len(self.__data)
 
-  def extract(self, token) -> str:
-    for item in token:
-      if not self.__data.startswith(item):
-        continue
+  def extract(self, token) -> bytes:
+    """
+    Consumes the given token or the first matching one of a list.
+    """
 
-      result = self.__data[:len(item)]
-      self.__data = self.__data[len(item):]
-      return result
+    if isinstance(token, (bytes, bytearray)):
+      token = [token]
+
+    for item in token:
+      if self.startswith(item):
+        return self.advance(self.__pos + len(item))
 
     raise Exception("Failed to extract token")
 
-  def extract_string(self) -> str:
+  def is_atom(self) -> bool:
+    return ATOM.match(self.__data, self.__pos) is not None
+
+  def extract_atom(self) -> bytes:
+    match = ATOM.match(self.__data, self.__pos)
+
+    if match is None:
+      raise Exception("Expected Atom")
+
+    return self.advance(match.end())
+
+  def is_number(self) -> bool:
+    return NUMBER.match(self.__data, self.__pos) is not None
 
-    if not self.is_string():
+  def extract_number(self) -> int:
+    match = NUMBER.match(self.__data, self.__pos)
+
+    if match is None:
+      raise Exception("Expected Number")
+
+    return int(self.advance(match.end()))
+
+  def is_quoted(self) -> bool:
+    return self.startswith(b'"')
+
+  def extract_quoted(self) -> bytes:
+    """
+    Consumes a quoted string, the quotes and escapes are kept.
+    """
+
+    match = QUOTED.match(self.__data, self.__pos)
+
+    if match is None:
       raise Exception("Expected Quote")
 
-    pos = 1
+    return self.advance(match.end())
+
+  def is_literal(self) -> bool:
+    return self.startswith(b'{')
+
+  def extract_literal(self) -> bytes:
+    """
+    Consumes a literal including its length announcement.
+    """
+
+    match = LITERAL.match(self.__data, self.__pos)
+
+    if match is None:
+      raise Exception("Expected Literal")
+
+    end = match.end() + int(match.group(1))
+
+    if end > len(self.__data):
+      raise Exception("Incomplete Literal")
+
+    return self.advance(end)
+
+  def is_string(self) -> bool:
+    return self.is_quoted() or self.is_literal()
+
+  def extract_string(self) -> bytes:
+    """
+    Consumes a string, either quoted or as literal.
+    """
 
-    while True:
-      pos = self.__data.find(b'"', pos)
+    if self.is_literal():
+      return self.extract_literal()
 
-      if pos == -1:
-        raise Exception("Expected Quote")
+    return self.extract_quoted()
 
-      pos += 1
+  def extract_response_code(self) -> tuple:
+    """
+    Consumes a response code in brackets, like (TAG "1") or (QUOTA/MAXSIZE).
+    Returns the code's name and a list with its arguments.
+    """
 
-      # Handle Escape Characters
-      if self.__data[pos-2] != b"\\":
-        break
+    self.extract(b"(")
 
-      cnt = 0
-      for char in self.__data[pos-2:1:-1]:
-        if char != b"\\":
-          break
+    code = self.extract_atom()
+    arguments = []
 
-        cnt += 1
+    while self.is_space():
+      self.extract_space()
 
-      # Odd number of backslashes the quote is not escaped
-      if (cnt % 2) != 0:
-        break
+      if self.is_string():
+        arguments.append(self.extract_string())
+      elif self.is_number():
+        arguments.append(self.extract_number())
+      else:
+        arguments.append(self.extract_atom())
 
-    result = self.__data[:pos]
-    self.__data = self.__data[pos:]
+    self.extract(b")")
 
-    return result
+    return (code, arguments)
 
-  def get_data(self):
-    return self.__data
+  def get_data(self) -> bytes:
+    """
+    Returns the data which was not yet consumed.
+    """
+    return self.slice(self.__pos, len(self.__data))
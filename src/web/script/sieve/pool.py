@@ -0,0 +1,226 @@
+import os
+import time
+import logging
+import threading
+
+from collections import deque
+
+DEFAULT_POOL_SIZE = 4
+DEFAULT_MAX_IDLE = 60
+DEFAULT_CHECK_INTERVAL = 15
+
+# The seconds the server may take to answer a health check.
+CHECK_TIMEOUT = 5
+
+
+def create_tag() -> bytes:
+  return os.urandom(8).hex().encode()
+
+
+class SieveSocketPool:
+  """
+  Keeps authenticated sieve connections for reuse by later sessions of the
+  same account and credentials. A reused connection needs neither a tcp nor
+  a tls handshake nor an authentication.
+
+  Returned connections are reset by a tagged NOOP, which discards pending
+  responses and proves that the server is alive and the connection idle.
+  Connections on which the client changed the authentication state, e.g. by
+  UNAUTHENTICATE, are logged out instead. Connections idle for longer than
+  the check interval are checked again before reuse, those idle for longer
+  than the max idle time are logged out.
+
+  In threaded mode resets and expiry run on a background thread. In asyncio
+  mode they are done as coroutines whenever a connection is acquired or
+  released.
+  """
+
+  def __init__(self,
+    max_size : int = DEFAULT_POOL_SIZE, max_idle : float = DEFAULT_MAX_IDLE,
+    check_interval : float = DEFAULT_CHECK_INTERVAL):
+
+    self.__max_size = int(max_size)
+    self.__max_idle = float(max_idle)
+    self.__check_interval = float(check_interval)
+
+    # Maps the key to a list of idle times and connections, newest last.
+    self.__idle = {}
+    # Connections returned in threaded mode which wait for their reset.
+    self.__released = deque()
+
+    self.__lock = threading.Condition()
+    self.__thread = None
+
+    self.hits = 0
+    self.misses = 0
+
+  @property
+  def enabled(self) -> bool:
+    return self.__max_size > 0
+
+  def take(self, key) -> tuple:
+    """
+    Removes the most recently used idle connection for the key. Returns its
+    idle time and the connection, or None if there is none.
+    """
+
+    with self.__lock:
+      entries = self.__idle.get(key)
+
+      if not entries:
+        self.misses += 1
+        return None
+
+      since, sievesocket = entries.pop()
+      return (time.monotonic() - since, sievesocket)
+
+  def put(self, key, sievesocket) -> bool:
+    """
+    Adds an idle connection, returns false if the pool is full.
+    """
+
+    with self.__lock:
+      entries = self.__idle.setdefault(key, [])
+
+      if len(entries) >= self.__max_size:
+        return False
+
+      entries.append((time.monotonic(), sievesocket))
+      return True
+
+  def expire(self) -> list:
+    """
+    Removes and returns all connections which exceeded the max idle time.
+    """
+
+    expired = []
+    deadline = time.monotonic() - self.__max_idle
+
+    with self.__lock:
+      for key, entries in list(self.__idle.items()):
+        expired.extend(
+          sievesocket for since, sievesocket in entries if since < deadline)
+
+        entries[:] = [entry for entry in entries if entry[0] >= deadline]
+
+        if not entries:
+          del self.__idle[key]
+
+    return expired
+
+  def log(self) -> None:
+    logging.debug(f"Sieve connection pool {self.hits} hits, {self.misses} misses")
+
+  def acquire(self, key):
+    """
+    Returns an authenticated connection for the key or None, in which case
+    the caller has to establish a new one.
+    """
+
+    if not self.enabled:
+      return None
+
+    while True:
+      entry = self.take(key)
+
+      if entry is None:
+        return None
+
+      idle, sievesocket = entry
+
+      if idle < self.__check_interval or sievesocket.check(create_tag(), CHECK_TIMEOUT):
+        with self.__lock:
+          self.hits += 1
+
+        self.log()
+        return sievesocket
+
+      sievesocket.disconnect()
+
+  def release(self, key, sievesocket) -> None:
+    """
+    Returns the connection after the session ended. It is reset in the
+    background, so that the caller never blocks.
+    """
+
+    self.start()
+
+    with self.__lock:
+      self.__released.append((key, sievesocket))
+      self.__lock.notify()
+
+  def reset(self, key, sievesocket) -> None:
+
+    if self.enabled and sievesocket.reusable \
+        and sievesocket.check(create_tag(), CHECK_TIMEOUT) \
+        and self.put(key, sievesocket):
+      return
+
+    sievesocket.logout()
+
+  def start(self) -> 'SieveSocketPool':
+    with self.__lock:
+      if self.__thread is None:
+        self.__thread = threading.Thread(
+          target=self.run, name="SieveSocketPool", daemon=True)
+        self.__thread.start()
+
+    return self
+
+  def run(self) -> None:
+
+    while True:
+      with self.__lock:
+        if not self.__released:
+          self.__lock.wait(timeout=1)
+
+        released = list(self.__released)
+        self.__released.clear()
+
+      for key, sievesocket in released:
+        self.reset(key, sievesocket)
+
+      for sievesocket in self.expire():
+        sievesocket.logout()
+
+  async def acquire_async(self, key):
+    """
+    The coroutine counterpart of acquire.
+    """
+
+    if not self.enabled:
+      return None
+
+    for sievesocket in self.expire():
+      await sievesocket.logout_async()
+
+    while True:
+      entry = self.take(key)
+
+      if entry is None:
+        return None
+
+      idle, sievesocket = entry
+
+      if idle < self.__check_interval \
+          or await sievesocket.check_async(create_tag(), CHECK_TIMEOUT):
+        self.hits += 1
+        self.log()
+        return sievesocket
+
+      await sievesocket.disconnect_async()
+
+  async def release_async(self, key, sievesocket) -> None:
+    """
+    Resets the connection and returns it to the pool.
+    """
+
+    reused = self.enabled and sievesocket.reusable \
+      and await sievesocket.check_async(create_tag(), CHECK_TIMEOUT) \
+      and self.put(key, sievesocket)
+
+    if not reused:
+      await sievesocket.logout_async()
+
+    for expired in self.expire():
+      await expired.logout_async()
@@ -0,0 +1,157 @@
+import re
+
+# The number of bytes requested from the socket per read.
+RECV_SIZE = 64 * 1024
+
+# A literal announced at the end of a line, either synchronizing or not.
+LITERAL = re.compile(rb"\{(\d+)\+?\}")
+
+STATUS = (b"OK", b"NO", b"BYE")
+
+
+def is_status(buffer : bytearray, pos : int) -> bool:
+  """
+  Checks if the line at the given position is the final status line of a
+  response, OK, NO or BYE followed by a space, a bracket or the line end.
+  """
+
+  for status in STATUS:
+    if not buffer.startswith(status, pos):
+      continue
+
+    follower = buffer[pos + len(status):pos + len(status) + 1]
+    return follower in (b" ", b"(", b"\r")
+
+  return False
+
+
+def is_quoted(buffer : bytearray, start : int, end : int) -> bool:
+  """
+  Checks if the position end is within a quoted string which starts
+  between start and end.
+  """
+
+  quoted = False
+  pos = start
+
+  while pos < end:
+    char = buffer[pos]
+
+    if quoted and char == 0x5C:
+      pos += 2
+      continue
+
+    if char == 0x22:
+      quoted = not quoted
+
+    pos += 1
+
+  return quoted
+
+
+class ResponseReader:
+  """
+  Splits the data received from the sieve server into complete responses.
+
+  Data is collected in a single buffer until the response's status line is
+  complete. Literals are skipped by their announced length, so that their
+  content is never mistaken for a status line. The scan resumes where the
+  last one stopped, thus a large response is scanned only once no matter
+  how many reads it takes.
+  """
+
+  def __init__(self):
+    self.__buffer = bytearray()
+
+    # Blocking sockets read into this chunk instead of allocating one per read.
+    self.__chunk = bytearray(RECV_SIZE)
+    self.__view = memoryview(self.__chunk)
+
+    self.reset()
+
+  def reset(self) -> None:
+    # The position where scanning continues.
+    self.__offset = 0
+    # Cleared while scanning the remainder of a line after a literal.
+    self.__line_start = True
+    # Set as soon as the current line is the response's status line.
+    self.__final = False
+
+  def pending(self) -> int:
+    """
+    Returns the number of bytes buffered but not yet consumed.
+    """
+    return len(self.__buffer)
+
+  def feed(self, data) -> None:
+    self.__buffer += data
+
+  def receive(self, sock) -> int:
+    """
+    Reads once from the socket and returns the number of bytes received.
+    """
+    length = sock.recv_into(self.__chunk)
+    self.__buffer += self.__view[:length]
+    return length
+
+  def take(self) -> bytes:
+    """
+    Consumes everything buffered, whether the response is complete or not.
+    """
+    data = bytes(self.__buffer)
+    self.__buffer.clear()
+    self.reset()
+    return data
+
+  def find_end(self) -> int:
+    """
+    Returns the end of the first complete response or None.
+    """
+
+    buffer = self.__buffer
+    pos = self.__offset
+
+    while True:
+      eol = buffer.find(b"\r\n", pos)
+
+      if eol == -1:
+        self.__offset = pos
+        return None
+
+      if self.__line_start:
+        self.__final = is_status(buffer, pos)
+
+      literal = None
+      if eol > pos and buffer[eol - 1] == 0x7D:
+        start = buffer.rfind(b"{", pos, eol)
+
+        if start != -1 and not is_quoted(buffer, pos, start):
+          literal = LITERAL.fullmatch(buffer, start, eol)
+
+      if literal is not None:
+        # The line continues after the literal, which may still be incomplete.
+        pos = eol + 2 + int(literal.group(1))
+        self.__line_start = False
+        continue
+
+      if self.__final:
+        return eol + 2
+
+      pos = eol + 2
+      self.__line_start = True
+
+  def next(self) -> bytes:
+    """
+    Consumes and returns the next complete response or None.
+    """
+
+    end = self.find_end()
+
+    if end is None:
+      return None
+
+    response = bytes(self.__buffer[:end])
+    del self.__buffer[:end]
+    self.reset()
+
+    return response
@@ -4,10 +4,19 @@ class Response:
 
   def __init__(self):
     self.__status = None
+    self.__code = None
+    self.__message = None
 
   def decode(self, data) -> 'Response':
+    return self.parse(Parser(data))
 
-    parser = Parser(data)
+  def parse(self, parser : Parser) -> 'Response':
+    """
+    Parses the status line, e.g. OK (TAG "1") "Done".
+    """
+
+    self.__code = None
+    self.__message = None
 
     self.__status = parser.extract([b"OK", b"NO", b"BYE"])
 
@@ -16,13 +25,9 @@ class Response:
       return self
 
     parser.extract_space()
-    if parser.startswith(b"("):
 
-      parser.extract(b"(")
-
-      while not parser.startswith(b")"):
-        parser.extract_space()
-        parser.extract_string()
+    if parser.startswith(b"("):
+      self.__code = parser.extract_response_code()
 
       if parser.is_line_break():
         parser.extract_line_break()
@@ -30,7 +35,7 @@ class Response:
 
       parser.extract_space()
 
-    parser.extract_string()
+    self.__message = parser.extract_string()
     parser.extract_line_break()
 
     return self
@@ -39,6 +44,17 @@ class Response:
   def status(self) -> str:
     return self.__status.decode()
 
+  @property
+  def code(self) -> tuple:
+    """
+    The response code's name and arguments or None.
+    """
+    return self.__code
+
+  @property
+  def message(self) -> bytes:
+    return self.__message
+
 class Capabilities(Response):
 
   def __init__(self):
@@ -61,7 +77,7 @@ class Capabilities(Response):
     while parser.is_string():
       key = parser.extract_string()
 
-      value = ""
+      value = b""
       if not parser.is_line_break():
         parser.extract_space()
         value = parser.extract_string()
@@ -73,9 +89,7 @@ class Capabilities(Response):
     if b'"IMPLEMENTATION"' not in self._capabilities:
       raise Exception("Implementation expected")
 
-    super().decode(parser.get_data())
-
-    return self
+    return self.parse(parser)
 
   def encode(self) -> bytes:
 
@@ -1,23 +1,72 @@
+import re
 import ssl
-import socket
+import asyncio
 import select
 import logging
 
 from base64 import b64encode
 
 from . request import Capabilities, Response
+from . tlscache import TlsSessionCache
+from . reader import ResponseReader, RECV_SIZE
+from . connector import Connector, DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT
+
+# Commands which change the connection's authentication state. Once the
+# client sent one of them the connection can not be reused.
+STATEFUL_COMMANDS = re.compile(
+  rb"(?:^|\n)\s*(?:UNAUTHENTICATE|AUTHENTICATE|STARTTLS|LOGOUT)\b", re.IGNORECASE)
+
+
+def find_tagged_response(response : bytes, tag : bytes) -> bool:
+  """
+  Checks a complete response for the tag of a NOOP. Returns None if it
+  answers another command and otherwise if the server answered with OK.
+  """
+
+  if tag not in response:
+    return None
+
+  # The tag may be sent as quoted string or as literal.
+  return response.startswith(b"OK (TAG")
+
 
 
 class SieveSocket:
 
-  def __init__(self, hostname : str, port : int):
+  def __init__(self,
+    hostname : str, port : int, tls : TlsSessionCache = None,
+    connector : Connector = None,
+    connect_timeout : float = DEFAULT_CONNECT_TIMEOUT,
+    read_timeout : float = DEFAULT_READ_TIMEOUT):
+
     self.__socket = None
     self.__old_socket = None
     self.__capabilities = None
 
+    self.__reader = None
+    self.__writer = None
+
+    # Collects the server's responses until they are complete.
+    self.__responses = ResponseReader()
+
     self.__hostname = hostname
     self.__port = port
 
+    if connector is None:
+      connector = Connector()
+
+    self.__connector = connector
+    self.__connect_timeout = connect_timeout
+    # Bounds the wait for a response while setting up the connection.
+    self.__read_timeout = read_timeout
+
+    # Shares ssl contexts and sessions with other connections.
+    self.__tls = tls
+    self.__ssl_context = None
+
+    # Cleared as soon as the connection's state is unknown.
+    self.__reusable = True
+
   def __enter__(self):
     self.connect()
     return self
@@ -29,11 +78,14 @@ class SieveSocket:
     self.disconnect()
 
   def connect(self):
-    self.__socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    self.__socket.connect((self.__hostname, self.__port))
+    self.__socket = self.__connector.connect(
+      self.__hostname, self.__port, self.__connect_timeout)
+    self.__socket.settimeout(self.__read_timeout)
+
+    self.__capabilities = self.check_capabilities(
+      Capabilities().decode(self.read_response()))
 
-    capabilities = Capabilities()
-    capabilities.decode(self.recv())
+  def check_capabilities(self, capabilities : Capabilities) -> Capabilities:
 
     if b'"SASL"' not in capabilities.get_capabilities():
       raise Exception("Sasl Plain not supported")
@@ -41,7 +93,7 @@ class SieveSocket:
     if b'PLAIN' not in capabilities.get_capabilities()[b'"SASL"'][1:-1].split(b" "):
       raise Exception("Sasl Plain not supported")
 
-    self.__capabilities = capabilities
+    return capabilities
 
   def __del__(self) -> None:
     self.disconnect()
@@ -49,6 +101,35 @@ class SieveSocket:
   def fileno(self):
     return self.__socket.fileno()
 
+  @property
+  def socket(self):
+    return self.__socket
+
+  @socket.setter
+  def socket(self, sock):
+    self.__socket = sock
+
+  @property
+  def reusable(self) -> bool:
+    """
+    Checks if the connection is still in the state it was set up with.
+    """
+    return self.__reusable and (self.__socket is not None or self.__writer is not None)
+
+  @reusable.setter
+  def reusable(self, reusable : bool):
+    self.__reusable = reusable
+
+  def track(self, data) -> None:
+    if self.__reusable and STATEFUL_COMMANDS.search(data):
+      self.__reusable = False
+
+  def pending(self) -> bool:
+    if self.__responses.pending():
+      return True
+
+    return hasattr(self.__socket, "pending") and self.__socket.pending() > 0
+
   def disconnect(self) -> None:
     if self.__socket:
       self.__socket.close()
@@ -56,15 +137,25 @@ class SieveSocket:
     self.__socket = None
     self.__old_socket = None
 
-  def upgrade(self) -> None:
-    self.__old_socket =  self.__socket
+  def create_ssl_context(self) -> ssl.SSLContext:
+    if self.__tls is None:
+      self.__tls = TlsSessionCache()
+
+    self.__ssl_context = self.__tls.get_context(self.__hostname, self.__port)
+    return self.__ssl_context
 
-    ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
-    ssl_context.check_hostname = False
-    #ssl_context.verify_mode = ssl.CERT_OPTIONAL
-    ssl_context.load_default_certs()
+  def update_tls_session(self, ssl_object) -> None:
+    """
+    Called once the server's first response after the handshake arrived,
+    which carries the session tickets in case of tls 1.3.
+    """
+    if ssl_object is not None:
+      self.__tls.update(self.__ssl_context, ssl_object)
 
-    self.__socket = ssl_context.wrap_socket(self.__old_socket)
+  def upgrade(self) -> None:
+    self.__old_socket =  self.__socket
+    self.__socket = self.create_ssl_context().wrap_socket(
+      self.__old_socket, server_hostname=self.__hostname)
 
   def wait(self):
     while True:
@@ -77,43 +168,246 @@ class SieveSocket:
       if self.__socket in ready_to_read:
         return
 
-  def recv(self):
-    chunk = self.__socket.recv(1024*1024)
+  def recv(self) -> bytes:
+    """
+    Returns whatever was received, regardless of response boundaries. An
+    empty result means the server closed the connection.
+    """
+    if self.__responses.pending():
+      return self.__responses.take()
+
+    return self.__socket.recv(RECV_SIZE)
+
+  def read_response(self) -> bytes:
+    """
+    Reads until a complete response is available, which may take several
+    reads in case of a large literal or a response split into segments.
+    """
+
+    while True:
+      response = self.__responses.next()
+
+      if response is not None:
+        return response
+
+      if not self.__responses.receive(self.__socket):
+        raise Exception("Connection terminated")
+
+  def write(self, data: bytes) -> None:
+    self.__socket.sendall(data)
 
-    if chunk == "":
-      raise Exception("Connetion Terminated...")
+  def send(self, data: bytes) -> None:
+    """
+    Forwards the client's data, commands changing the state are tracked.
+    """
+    self.track(data)
+    self.write(data)
 
-    return chunk
+  def check(self, tag : bytes, timeout : float) -> bool:
+    """
+    Sends a tagged NOOP and discards everything received up to its response,
+    e.g. the answer to a command the client did not wait for. Returns true
+    if the server is alive and the connection is idle.
+    """
 
-  def send(self, data: str) -> None:
-    self.__socket.send(data)
+    self.__socket.settimeout(timeout)
+
+    try:
+      self.write(b'NOOP "' + tag + b'"\r\n')
+
+      while True:
+        status = find_tagged_response(self.read_response(), tag)
+
+        # Data after the response means the connection was not idle.
+        if status is not None:
+          return status and not self.__responses.pending()
+
+    except Exception as ex:
+      logging.debug(f"Checking the sieve connection failed {ex}")
+      return False
+
+    finally:
+      if self.__socket is not None:
+        self.__socket.settimeout(None)
+
+  def logout(self) -> None:
+    """
+    Ends the session politely, the server's answer is not awaited.
+    """
+    try:
+      if self.__socket is not None:
+        self.write(b"LOGOUT\r\n")
+    except OSError:
+      pass
+
+    self.disconnect()
 
   def start_tls(self) -> None:
     if b'"STARTTLS"' not in self.__capabilities.get_capabilities():
       raise Exception("Starttls not supported")
 
-    self.send(b"STARTTLS\r\n")
+    self.write(b"STARTTLS\r\n")
 
-    if Response().decode(self.recv()).status != "OK" :
+    if Response().decode(self.read_response()).status != "OK" :
       raise Exception("Starting tls failed")
 
+    # Anything received before the handshake was not protected by tls.
+    if self.__responses.pending():
+      raise Exception("Unexpected data before tls handshake")
+
     self.upgrade()
 
     #update the capabilities
-    self.__capabilities.decode(self.recv())
+    self.__capabilities.decode(self.read_response())
+    self.update_tls_session(self.__socket)
+
+
+  def encode_authenticate(
+      self, authentication: str, password: str, authorization:str ) -> bytes:
 
+    return b'AUTHENTICATE "PLAIN" "'+b64encode(
+        authorization.encode()+b"\0"
+        + authentication.encode()+b"\0"
+        + password.encode())+b'"\r\n'
 
   def authenticate(self, authentication: str, password: str, authorization:str ) -> None:
 
     self.__capabilities.disable_authentication()
 
-    self.send(
-      b'AUTHENTICATE "PLAIN" "'+b64encode(
-        authorization.encode()+b"\0"
-        + authentication.encode()+b"\0"
-        + password.encode())+b'"\r\n')
+    self.write(
+      self.encode_authenticate(authentication, password, authorization))
+
+    if Response().decode(self.read_response()).status != "OK" :
+      raise Exception("Authentication failed")
+
+  async def __aenter__(self):
+    await self.connect_async()
+    return self
+
+  async def __aexit__(self, exc_type, exc_val, exc_tb) -> None:
+    await self.disconnect_async()
+
+  async def connect_async(self) -> None:
+    """
+    The coroutine counterpart of connect, it uses asyncio streams instead
+    of a blocking socket.
+    """
+    self.__reader, self.__writer = await asyncio.open_connection(
+      sock=await self.__connector.connect_async(
+        self.__hostname, self.__port, self.__connect_timeout))
+
+    self.__capabilities = self.check_capabilities(
+      Capabilities().decode(await self.read_response_async()))
+
+  async def disconnect_async(self) -> None:
+    if self.__writer:
+      self.__writer.close()
+
+      try:
+        await self.__writer.wait_closed()
+      except OSError:
+        pass
+
+    self.__reader = None
+    self.__writer = None
+
+  def set_write_buffer_limits(self, high : int, low : int) -> None:
+    """
+    Limits the data buffered by the stream before send_async blocks.
+    """
+    self.__writer.transport.set_write_buffer_limits(high, low)
+
+  async def recv_async(self) -> bytes:
+    if self.__responses.pending():
+      return self.__responses.take()
+
+    return await self.__reader.read(RECV_SIZE)
+
+  async def read_response_async(self) -> bytes:
+    """
+    The coroutine counterpart of read_response.
+    """
+
+    while True:
+      response = self.__responses.next()
+
+      if response is not None:
+        return response
+
+      chunk = await asyncio.wait_for(
+        self.__reader.read(RECV_SIZE), self.__read_timeout)
+
+      if not chunk:
+        raise Exception("Connection terminated")
+
+      self.__responses.feed(chunk)
+
+  async def write_async(self, data: bytes) -> None:
+    self.__writer.write(data)
+    await self.__writer.drain()
+
+  async def send_async(self, data: bytes) -> None:
+    self.track(data)
+    await self.write_async(data)
+
+  async def check_async(self, tag : bytes, timeout : float) -> bool:
+    """
+    The coroutine counterpart of check.
+    """
+
+    async def read() -> bool:
+      while True:
+        status = find_tagged_response(await self.read_response_async(), tag)
+
+        if status is not None:
+          return status and not self.__responses.pending()
+
+    try:
+      await self.write_async(b'NOOP "' + tag + b'"\r\n')
+      return await asyncio.wait_for(read(), timeout)
+
+    except Exception as ex:
+      logging.debug(f"Checking the sieve connection failed {ex}")
+      return False
+
+  async def logout_async(self) -> None:
+    try:
+      if self.__writer is not None:
+        self.__writer.write(b"LOGOUT\r\n")
+    except OSError:
+      pass
+
+    await self.disconnect_async()
+
+  async def start_tls_async(self) -> None:
+    if b'"STARTTLS"' not in self.__capabilities.get_capabilities():
+      raise Exception("Starttls not supported")
+
+    await self.write_async(b"STARTTLS\r\n")
+
+    if Response().decode(await self.read_response_async()).status != "OK" :
+      raise Exception("Starting tls failed")
+
+    if self.__responses.pending():
+      raise Exception("Unexpected data before tls handshake")
+
+    # Upgrading a stream in place requires python 3.11 or newer.
+    await self.__writer.start_tls(
+      self.create_ssl_context(), server_hostname=self.__hostname,
+      ssl_handshake_timeout=self.__read_timeout)
+
+    self.__capabilities.decode(await self.read_response_async())
+    self.update_tls_session(self.__writer.get_extra_info("ssl_object"))
+
+  async def authenticate_async(
+      self, authentication: str, password: str, authorization:str ) -> None:
+
+    self.__capabilities.disable_authentication()
+
+    await self.write_async(
+      self.encode_authenticate(authentication, password, authorization))
 
-    if Response().decode(self.recv()).status != "OK" :
+    if Response().decode(await self.read_response_async()).status != "OK" :
       raise Exception("Authentication failed")
 
   @property
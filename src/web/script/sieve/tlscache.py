@@ -0,0 +1,96 @@
+import ssl
+import logging
+import threading
+
+
+class ResumingSSLContext(ssl.SSLContext):
+  """
+  A client context which resumes the last tls session established with it.
+
+  Asyncio's start_tls has no way to pass a session, it wraps the connection
+  via wrap_bio. Thus the session is injected there as well as in
+  wrap_socket. The context is bound to a single host and port, so that the
+  session always belongs to the server connected to.
+  """
+
+  session = None
+
+  def wrap_socket(self, *args, session=None, **kwargs):
+    return super().wrap_socket(
+      *args, session=session or self.session, **kwargs)
+
+  def wrap_bio(self, *args, session=None, **kwargs):
+    return super().wrap_bio(
+      *args, session=session or self.session, **kwargs)
+
+
+class TlsSessionCache:
+  """
+  Shares one client ssl context per sieve server. Loading the system's ca
+  certificates is done once instead of on every connect.
+
+  The context remembers the most recent session, later STARTTLS upgrades
+  resume it with an abbreviated handshake.
+  """
+
+  def __init__(self):
+    self.__contexts = {}
+    self.__lock = threading.Lock()
+
+    self.hits = 0
+    self.misses = 0
+
+  @property
+  def hit_rate(self) -> float:
+    total = self.hits + self.misses
+
+    if not total:
+      return 0.0
+
+    return self.hits / total
+
+  def create_ssl_context(self) -> ssl.SSLContext:
+    ssl_context = ResumingSSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    ssl_context.check_hostname = False
+    #ssl_context.verify_mode = ssl.CERT_OPTIONAL
+    ssl_context.load_default_certs()
+
+    return ssl_context
+
+  def get_context(self, hostname : str, port : int) -> ssl.SSLContext:
+    with self.__lock:
+      key = (hostname, port)
+
+      if key not in self.__contexts:
+        self.__contexts[key] = self.create_ssl_context()
+
+      return self.__contexts[key]
+
+  def update(self, ssl_context : ssl.SSLContext, ssl_object) -> None:
+    """
+    Records if the handshake resumed a session and keeps the connection's
+    session for the next one. It has to be called after data was received,
+    tls 1.3 sends the session tickets after the handshake.
+    """
+
+    with self.__lock:
+      if ssl_object.session_reused:
+        self.hits += 1
+      else:
+        self.misses += 1
+
+    self.log()
+
+    session = ssl_object.session
+
+    if session is None:
+      return
+
+    # Without a ticket a tls 1.3 session can not be resumed.
+    if session.has_ticket or ssl_object.version() != "TLSv1.3":
+      ssl_context.session = session
+
+  def log(self) -> None:
+    logging.debug(
+      f"Sieve tls sessions {self.hits} resumed, {self.misses} full handshakes"
+      f" ({self.hit_rate:.0%})")
@@ -0,0 +1,52 @@
+import threading
+
+class Statistics:
+  """
+  Collects counters and timings which are reported via the log.
+
+  It is shared between worker threads, thus all updates are guarded by a lock.
+  """
+
+  def __init__(self):
+    self.__lock = threading.Lock()
+    self.__counters = {}
+    self.__timings = {}
+
+  def increment(self, name : str, value : int = 1) -> None:
+    with self.__lock:
+      self.__counters[name] = self.__counters.get(name, 0) + value
+
+  def get_counter(self, name : str) -> int:
+    with self.__lock:
+      return self.__counters.get(name, 0)
+
+  def record(self, name : str, seconds : float) -> None:
+    """
+    Adds a duration in seconds to the named timing.
+    """
+    with self.__lock:
+      if name not in self.__timings:
+        self.__timings[name] = [0, 0.0, seconds, seconds]
+
+      timing = self.__timings[name]
+      timing[0] += 1
+      timing[1] += seconds
+      timing[2] = min(timing[2], seconds)
+      timing[3] = max(timing[3], seconds)
+
+  def get_timing(self, name : str) -> dict:
+    """
+    Returns the number of samples as well as the average, minimum and maximum
+    duration in seconds.
+    """
+    with self.__lock:
+      if name not in self.__timings:
+        return {"count" : 0, "avg" : 0.0, "min" : 0.0, "max" : 0.0}
+
+      count, total, minimum, maximum = self.__timings[name]
+      return {"count" : count, "avg" : total / count, "min" : minimum, "max" : maximum}
+
+  def format_timing(self, name : str) -> str:
+    timing = self.get_timing(name)
+    return (f"{name} count={timing['count']} avg={timing['avg']*1000:.1f}ms"
+      + f" min={timing['min']*1000:.1f}ms max={timing['max']*1000:.1f}ms")
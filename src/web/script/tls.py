@@ -0,0 +1,88 @@
+import ssl
+import logging
+
+# Ciphers for tls 1.2 and older, restricted to forward secret aead suites.
+# Tls 1.3 suites are configured by openssl and always enabled.
+DEFAULT_CIPHERS = "ECDHE+AESGCM:ECDHE+CHACHA20"
+
+DEFAULT_MIN_VERSION = "TLSv1_2"
+
+# The number of session tickets issued after a tls 1.3 handshake. Each
+# ticket allows the browser to resume the session on a new connection.
+DEFAULT_SESSION_TICKETS = 2
+
+
+class TlsSettings:
+  """
+  The server side tls configuration shared by all server modes.
+  """
+
+  def __init__(self,
+    min_version : str = DEFAULT_MIN_VERSION, curve : str = None,
+    ciphers : str = DEFAULT_CIPHERS,
+    session_tickets : int = DEFAULT_SESSION_TICKETS, alpn : list = None):
+
+    if min_version not in ssl.TLSVersion.__members__:
+      raise Exception(f"Invalid tls version {min_version}")
+
+    if alpn is None:
+      alpn = ["http/1.1"]
+
+    self.min_version = ssl.TLSVersion[min_version]
+    self.curve = curve
+    self.ciphers = ciphers
+    self.session_tickets = int(session_tickets)
+    self.alpn = alpn
+
+  def create_ssl_context(self, certfile : str, keyfile : str) -> ssl.SSLContext:
+    """
+    Creates the server context. Tls 1.3 is preferred whenever the client
+    supports it, it completes a full handshake in a single round trip.
+
+    Returning clients resume their session either by a ticket or via the
+    context's session cache, which skips the costly key exchange and
+    certificate signature. Both only work as long as the context is shared
+    between all connections.
+    """
+
+    ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    ssl_context.load_cert_chain(certfile, keyfile)
+
+    ssl_context.minimum_version = self.min_version
+    ssl_context.maximum_version = ssl.TLSVersion.MAXIMUM_SUPPORTED
+
+    if self.ciphers:
+      ssl_context.set_ciphers(self.ciphers)
+
+    # Defaults to openssl's list of groups, which starts with x25519.
+    if self.curve:
+      ssl_context.set_ecdh_curve(self.curve)
+
+    if self.session_tickets > 0:
+      ssl_context.num_tickets = self.session_tickets
+    else:
+      ssl_context.options |= ssl.OP_NO_TICKET
+      ssl_context.num_tickets = 0
+
+    if self.alpn:
+      ssl_context.set_alpn_protocols(self.alpn)
+
+    return ssl_context
+
+
+def record_handshake(statistics, ssl_object, seconds : float) -> None:
+  """
+  Tracks the duration of a completed handshake and if it was resumed.
+  """
+
+  statistics.record("handshake", seconds)
+
+  if ssl_object is not None and ssl_object.session_reused:
+    statistics.increment("handshake.resumed")
+  else:
+    statistics.increment("handshake.full")
+
+  logging.debug(
+    statistics.format_timing("handshake")
+    + f" full={statistics.get_counter('handshake.full')}"
+    + f" resumed={statistics.get_counter('handshake.resumed')}")
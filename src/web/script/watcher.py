@@ -0,0 +1,173 @@
+import ssl
+import time
+import socket
+import logging
+import selectors
+import threading
+
+from collections import deque
+
+from .tls import record_handshake
+
+class ConnectionWatcher:
+  """
+  Watches connections which are waiting for the peer on a single background
+  thread, instead of blocking a worker thread for each of them.
+
+  It drives the tls handshakes of freshly accepted connections and parks
+  idle keep-alive connections until the next request arrives. Sockets are
+  multiplexed via a selector, so that a slow or stalled client never blocks
+  the accept loop nor any other connection. Each watch is bound by a deadline,
+  connections exceeding it are closed.
+  """
+
+  def __init__(self, statistics):
+    self.__statistics = statistics
+
+    self.__selector = selectors.DefaultSelector()
+    self.__pending = deque()
+
+    # Used to wake up the selector whenever a new connection is queued.
+    self.__wakeup_reader, self.__wakeup_writer = socket.socketpair()
+    self.__wakeup_reader.setblocking(False)
+    self.__selector.register(self.__wakeup_reader, selectors.EVENT_READ, None)
+
+    self.__thread = None
+
+  def start(self) -> 'ConnectionWatcher':
+    self.__thread = threading.Thread(
+      target=self.run, name="ConnectionWatcher", daemon=True)
+    self.__thread.start()
+    return self
+
+  def queue(self, sock, callback) -> None:
+    """
+    Schedules the callback to be run on the watcher thread. The socket is
+    closed in case the callback fails.
+    """
+    self.__pending.append((sock, callback))
+    self.__wakeup_writer.send(b"\0")
+
+  def handshake(self, connstream : ssl.SSLSocket, timeout : float, on_ready) -> None:
+    """
+    Completes the tls handshake of a socket which was wrapped without
+    handshake on connect and passes it in blocking mode to on_ready.
+    """
+    start = time.monotonic()
+
+    def step(_events):
+      self.step_handshake(connstream, start, on_ready)
+
+    def init():
+      connstream.setblocking(False)
+      self.watch(connstream, selectors.EVENT_READ, start + timeout, step)
+      step(selectors.EVENT_READ)
+
+    self.queue(connstream, init)
+
+  def park(self, sock, timeout : float, on_ready) -> None:
+    """
+    Waits until the socket becomes readable and then calls on_ready. The
+    socket is closed in case it stays idle longer than the timeout.
+    """
+
+    def ready(_events):
+      self.unwatch(sock)
+      on_ready()
+
+    self.queue(sock, lambda: self.watch(
+      sock, selectors.EVENT_READ, time.monotonic() + timeout, ready))
+
+  def watch(self, sock, events, deadline : float, callback) -> None:
+    try:
+      self.__selector.modify(sock, events, (deadline, callback))
+    except KeyError:
+      self.__selector.register(sock, events, (deadline, callback))
+
+  def unwatch(self, sock) -> None:
+    try:
+      self.__selector.unregister(sock)
+    except (KeyError, ValueError):
+      pass
+
+  def fail(self, sock, reason) -> None:
+    self.__statistics.increment("watcher.closed")
+    logging.debug(f"Closing connection {reason}")
+
+    self.unwatch(sock)
+    sock.close()
+
+  def step_handshake(self, connstream, start : float, on_ready) -> None:
+    """
+    Advances the handshake as far as the buffered bytes allow.
+    """
+
+    deadline, callback = self.__selector.get_key(connstream).data
+
+    try:
+      connstream.do_handshake()
+
+    except ssl.SSLWantReadError:
+      self.watch(connstream, selectors.EVENT_READ, deadline, callback)
+      return
+
+    except ssl.SSLWantWriteError:
+      self.watch(connstream, selectors.EVENT_WRITE, deadline, callback)
+      return
+
+    except OSError as ex:
+      self.__statistics.increment("handshake.failed")
+      self.fail(connstream, f"tls handshake failed {ex}")
+      return
+
+    self.unwatch(connstream)
+
+    record_handshake(self.__statistics, connstream, time.monotonic() - start)
+
+    connstream.setblocking(True)
+    on_ready(connstream)
+
+  def expire(self) -> None:
+    """
+    Closes all connections which exceeded their deadline.
+    """
+    now = time.monotonic()
+
+    for key in list(self.__selector.get_map().values()):
+      if key.data is None:
+        continue
+
+      if key.data[0] < now:
+        self.fail(key.fileobj, "timeout")
+
+  def dispatch(self, sock, callback, *args) -> None:
+    """
+    Runs a callback for the socket. A failure closes only this connection,
+    it must never terminate the watcher thread.
+    """
+    try:
+      callback(*args)
+
+    except Exception as ex:
+      logging.error(f"Connection callback failed {ex}")
+
+      try:
+        self.fail(sock, ex)
+      except OSError:
+        pass
+
+  def run(self) -> None:
+
+    while True:
+      while self.__pending:
+        sock, callback = self.__pending.popleft()
+        self.dispatch(sock, callback)
+
+      for key, events in self.__selector.select(timeout=1):
+        if key.data is None:
+          self.__wakeup_reader.recv(4096)
+          continue
+
+        self.dispatch(key.fileobj, key.data[1], events)
+
+      self.expire()
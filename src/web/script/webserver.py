@@ -1,12 +1,18 @@
 import ssl
+import sys
 import socket
+import asyncio
 import traceback
-import sys
 import logging
+import time
 
 from concurrent.futures import ThreadPoolExecutor
 
 from .http import HttpRequest, HttpException, HttpResponse
+from .statistics import Statistics
+from .watcher import ConnectionWatcher
+from .router import Router
+from .tls import TlsSettings, record_handshake
 
 class HttpContext:
 
@@ -14,20 +20,77 @@ class HttpContext:
     self.__socket = sock
     self.__handers = handlers
 
+    # Bytes received but not yet consumed, e.g. pipelined requests.
+    self.buffer = bytearray()
+    # The number of requests served on this connection.
+    self.requests = 0
+    # Set to false as soon as the connection should be closed after
+    # the current response.
+    self.keep_alive = False
+    # Set by handlers which took over the connection, it is neither
+    # reused nor closed by the server.
+    self.detached = False
+
   @property
   def socket(self):
     return self.__socket
 
+  @socket.setter
+  def socket(self, sock):
+    self.__socket = sock
+
   @property
   def handlers(self):
     return self.__handers
 
+  def has_pending(self) -> bool:
+    """
+    Checks if data was already received but not yet consumed.
+    """
+    if len(self.buffer):
+      return True
+
+    if hasattr(self.__socket, "pending") and self.__socket.pending():
+      return True
+
+    return False
+
+
+class AsyncHttpContext:
+
+  def __init__(self, reader, writer, handlers):
+    self.__reader = reader
+    self.__writer = writer
+    self.__handers = handlers
+
+    self.buffer = bytearray()
+    self.requests = 0
+    self.keep_alive = False
+
+  @property
+  def reader(self) -> asyncio.StreamReader:
+    return self.__reader
+
+  @property
+  def writer(self) -> asyncio.StreamWriter:
+    return self.__writer
+
+  @property
+  def handlers(self):
+    return self.__handers
+
+
+MODE_THREADED = "threaded"
+MODE_ASYNCIO = "asyncio"
 
 class WebServer:
 
   def __init__(self,
     port : int = 8765, address: str = None,
-    keyfile : str = None, certfile : str = None):
+    keyfile : str = None, certfile : str = None,
+    mode : str = MODE_THREADED, handshake_timeout : float = 10,
+    keep_alive_timeout : float = 15, keep_alive_requests : int = 100,
+    tls : TlsSettings = None):
 
     if keyfile is None:
       keyfile = "default.key"
@@ -38,13 +101,38 @@ class WebServer:
     if address is None:
       address = "127.0.0.1"
 
+    if tls is None:
+      tls = TlsSettings()
+
     self.__port = int(port)
     self.__address = address
     self.__handlers = []
     self.__executor = None
+    self.__ssl_context = None
 
     self.__certfile = certfile
     self.__keyfile = keyfile
+    self.__tls = tls
+
+    if mode not in (MODE_THREADED, MODE_ASYNCIO):
+      raise Exception(f"Invalid server mode {mode}")
+
+    # Upgrading a stream to tls in place needs StreamWriter.start_tls.
+    if mode == MODE_ASYNCIO and sys.version_info < (3, 11):
+      raise Exception("The asyncio server mode requires python 3.11 or newer")
+
+    self.__mode = mode
+
+    self.__handshake_timeout = float(handshake_timeout)
+    self.__keep_alive_timeout = float(keep_alive_timeout)
+    self.__keep_alive_requests = int(keep_alive_requests)
+    self.__watcher = None
+    self.__router = None
+    self.__statistics = Statistics()
+
+  @property
+  def statistics(self) -> Statistics:
+    return self.__statistics
 
   def add_handler(self, handler):
     self.__handlers.append(handler)
@@ -52,57 +140,230 @@ class WebServer:
   def get_handlers(self):
     return self.__handlers
 
+  def get_handler(self, request):
+
+    handler = self.__router.route(request)
+
+    if handler is not None:
+      return handler
+
+    logging.warning("404 File not found "+request.url)
+    raise HttpException(404, "File not found "+request.url)
+
+  def create_error_response(self, ex : Exception) -> tuple:
+    """
+    Converts an exception into an error response and its body.
+    """
+
+    response = HttpResponse()
+    response.add_headers({'Connection': 'close'})
+
+    if isinstance(ex, HttpException):
+      response.set_status(ex.code, ex.reason)
+      return (response, None)
+
+    response.set_status(500, "Internal Server Error")
+
+    trace = traceback.format_exception(type(ex), ex, ex.__traceback__)
+
+    logging.warning(str(ex))
+    logging.warning("".join(trace))
+
+    return (response, "Internal Server error\r\n\r\n" + "\r\n".join(trace))
+
+  def update_keep_alive(self, context, request) -> None:
+    """
+    Decides if the connection is reused after the current request.
+    """
+    context.requests += 1
+    context.keep_alive = request.keep_alive \
+      and context.requests < self.__keep_alive_requests
+
+  def close(self, context) -> None:
+    try:
+      context.socket.shutdown(socket.SHUT_RDWR)
+    except OSError:
+      pass
+
+    context.socket.close()
+
   def handle_message(self, context) -> None:
+    """
+    Serves requests on the connection as long as the client keeps it alive.
+    Once no more data is pending the connection is handed to the watcher,
+    so that idle keep-alive connections do not occupy a worker.
+    """
 
     try:
-      request = HttpRequest()
-      request.recv(context)
+      # Bounds the time a client may take to send a request.
+      context.socket.settimeout(self.__keep_alive_timeout)
 
-      for handler in context.handlers:
-        if not handler.can_handle_request(request):
-          continue
+      while True:
+        request = HttpRequest()
+        if not request.recv(context, blocking=False):
+          break
 
-        handler.handle_request(context, request)
-        return
+        self.update_keep_alive(context, request)
 
-      logging.warning("404 File not found "+request.url)
-      raise HttpException(404, "File not found "+request.url)
+        context.socket.settimeout(None)
+        self.get_handler(request).handle_request(context, request)
 
-    except HttpException as ex:
-      response = HttpResponse()
-      response.set_status(ex.code, ex.reason)
-      response.add_headers({'Connection': 'close'})
-      response.send(context)
+        if context.detached:
+          return
+
+        if not context.keep_alive:
+          break
+
+        request.body.discard(context)
+
+        context.socket.settimeout(self.__keep_alive_timeout)
+
+        if not context.has_pending():
+          self.park(context)
+          return
+
+    except socket.timeout:
+      logging.debug("Connection timed out")
 
     except Exception as ex:
-      response = HttpResponse()
-      response.set_status(500, "Internal Server Error")
-      response.add_headers({'Connection': 'close'})
+      context.keep_alive = False
+      response, data = self.create_error_response(ex)
+
+      try:
+        response.send(context, data)
+      except OSError:
+        pass
+
+    self.close(context)
+
+  def record_handshake(self, start : float, ssl_object) -> None:
+    record_handshake(self.__statistics, ssl_object, time.monotonic() - start)
+
+  def park(self, context) -> None:
+    """
+    Waits in the background for the next request on an idle connection.
+    """
+    self.__watcher.park(
+      context.socket, self.__keep_alive_timeout,
+      lambda: self.__executor.submit(self.handle_message, context))
+
+  def submit(self, connstream) -> None:
+    """
+    Called as soon as the handshake completed.
+    """
+    self.park(HttpContext(connstream, self.__handlers))
+
+  async def handshake_async(self, writer) -> bool:
+    """
+    Upgrades the plain connection to tls. The handshake is bound by the
+    handshake timeout so that slow clients can not stall the server.
+    """
+
+    start = time.monotonic()
+
+    try:
+      await writer.start_tls(
+        self.__ssl_context, ssl_handshake_timeout=self.__handshake_timeout)
+
+    except (OSError, asyncio.TimeoutError) as ex:
+      self.__statistics.increment("handshake.failed")
+      logging.debug(f"Tls handshake failed {ex}")
+
+      writer.transport.abort()
+      return False
+
+    self.record_handshake(start, writer.get_extra_info("ssl_object"))
+    return True
+
+  async def handle_message_async(self, reader, writer) -> None:
+    """
+    Handles a single connection on the event loop.
+    """
+
+    if not await self.handshake_async(writer):
+      return
+
+    context = AsyncHttpContext(reader, writer, self.__handlers)
+
+    try:
+      while True:
+        request = HttpRequest()
+
+        if not await asyncio.wait_for(
+            request.recv_async(context), self.__keep_alive_timeout):
+          break
 
-      exc_type, exc_value, exc_tb = sys.exc_info()
-      response.send(context,"Internal Server error\r\n\r\n"
-        + "\r\n".join(traceback.format_exception(exc_type, exc_value, exc_tb)))
+        self.update_keep_alive(context, request)
 
-      logging.warning(str(ex))
-      logging.warning("".join(traceback.format_exception(exc_type, exc_value, exc_tb)))
+        await self.get_handler(request).handle_request_async(context, request)
+
+        if not context.keep_alive:
+          break
+
+        await request.body.discard_async(context)
+
+    except asyncio.TimeoutError:
+      logging.debug("Connection timed out")
+
+    except (asyncio.IncompleteReadError, ConnectionError):
+      logging.debug("Connection closed by peer")
+
+    except Exception as ex:
+      context.keep_alive = False
+      response, data = self.create_error_response(ex)
+      try:
+        await response.send_async(context, data)
+      except ConnectionError:
+        pass
 
     finally:
-      context.socket.shutdown(socket.SHUT_RDWR)
-      context.socket.close()
+      writer.close()
+
+      try:
+        await writer.wait_closed()
+      except (OSError, ssl.SSLError):
+        pass
+
+  def create_ssl_context(self) -> ssl.SSLContext:
+    return self.__tls.create_ssl_context(self.__certfile, self.__keyfile)
+
+  async def listen_async(self) -> None:
+    """
+    Serves all connections as coroutines on a single event loop.
+    """
+
+    # The handshake is done per connection, this allows to time it.
+    self.__ssl_context = self.create_ssl_context()
+
+    server = await asyncio.start_server(
+      self.handle_message_async, self.__address, self.__port)
+
+    logging.info(f"Listening on https://{self.__address}:{self.__port} (asyncio)")
+
+    async with server:
+      await server.serve_forever()
 
   def listen(self) -> None:
     """
     Starts listening for incoming requests
     """
 
-    ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
-    ssl_context.load_cert_chain(self.__certfile, self.__keyfile)
+    # Handlers are final as soon as the server starts.
+    self.__router = Router().compile(self.__handlers)
+
+    if self.__mode == MODE_ASYNCIO:
+      asyncio.run(self.listen_async())
+      return
+
+    ssl_context = self.create_ssl_context()
 
     self.__executor = ThreadPoolExecutor(max_workers=3)
 
+    self.__watcher = ConnectionWatcher(self.__statistics).start()
+
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
       sock.bind((self.__address, self.__port))
-      sock.listen(5)
+      sock.listen(socket.SOMAXCONN)
 
       logging.info(f"Listening on https://{self.__address}:{self.__port}")
 
@@ -110,22 +371,18 @@ class WebServer:
         # accept connections from outside
         clientsocket, _address = sock.accept()
 
+        # Responses are often sent in several small writes, e.g. the
+        # websocket upgrade followed by the greeting. Like asyncio does,
+        # Nagle's algorithm is disabled so that they are not delayed.
+        clientsocket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
 
         connstream = ssl_context.wrap_socket(
           clientsocket,
           server_side=True,
           do_handshake_on_connect=False)
 
-        try:
-          connstream.do_handshake()
-        except ConnectionAbortedError:
-          continue
-        except OSError:
-          continue
-        except ssl.SSLError as err:
-          if err.args[1].find("sslv3 alert") == -1:
-            raise
-
-        self.__executor.submit(
-          self.handle_message,
-          HttpContext(connstream, self.__handlers))
+        # The handshake runs concurrently in the background, so that
+        # a slow client does not block accepting new connections.
+        self.__watcher.handshake(
+          connstream, self.__handshake_timeout, self.submit)
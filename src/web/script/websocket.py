@@ -1,8 +1,12 @@
 from hashlib import sha1
 from base64 import b64encode
 import logging
+import struct
+import time
+import asyncio
 
 from .http import HttpException, HttpResponse
+from .deflate import PerMessageDeflate, DeflateSettings
 
 
 # class SocketMock:
@@ -33,22 +37,252 @@ from .http import HttpException, HttpResponse
 #   def socket(self):
 #     return self.__socket
 
+def unmask(mask : bytes, payload) -> bytearray:
+  """
+  Applies the 4 byte websocket mask to the payload.
+
+  Instead of xor-ing byte by byte, the payload and the repeated mask are
+  converted into two big integers. So the whole buffer is processed by a
+  single xor operation implemented in C.
+  """
+
+  length = len(payload)
+
+  if not length:
+    return bytearray()
+
+  repeated = (bytes(mask) * (length // 4 + 1))[:length]
+
+  value = int.from_bytes(payload, "little") ^ int.from_bytes(repeated, "little")
+  return bytearray(value.to_bytes(length, "little"))
+
+
+OPCODE_CONTINUATION = 0
+OPCODE_TEXT = 1
+OPCODE_BINARY = 2
+OPCODE_CLOSE = 8
+OPCODE_PING = 9
+OPCODE_PONG = 10
+
+# The size of a single read from the connection.
+RECV_SIZE = 64 * 1024
+
+# Limits the memory used by a single (reassembled) message.
+MAX_MESSAGE_SIZE = 64 * 1024 * 1024
+
+# Larger messages are split into continuation frames of this size.
+DEFAULT_FRAME_SIZE = 1024 * 1024
+
+# Frames up to this size are written together with their header.
+SMALL_FRAME_SIZE = 16 * 1024
+
+# A ping is sent after the client was silent for this many seconds and it
+# is considered dead if it does not answer within the ping timeout.
+DEFAULT_PING_INTERVAL = 20
+DEFAULT_PING_TIMEOUT = 10
+
+# The seconds to wait for the client to confirm the close handshake.
+CLOSE_TIMEOUT = 2
+
+CLOSE_NORMAL = 1000
+CLOSE_GOING_AWAY = 1001
+CLOSE_INTERNAL_ERROR = 1011
+CLOSE_SERVICE_RESTART = 1012
+
+
+def encode_header(fin : bool, opcode : int, length : int, rsv1 : bool = False) -> bytes:
+  """
+  Packs the header of an unmasked server to client frame.
+  """
+
+  first = opcode
+  if fin:
+    first |= 0b10000000
+  if rsv1:
+    first |= 0b01000000
+
+  if length < 126:
+    return struct.pack("!BB", first, length)
+
+  if length <= 0xFFFF:
+    return struct.pack("!BBH", first, 126, length)
+
+  return struct.pack("!BBQ", first, 127, length)
+
+
+class WebSocketFrame:
+
+  def __init__(self, fin : bool, opcode : int, masked : bool, payload : bytearray,
+    rsv1 : bool = False):
+    self.fin = fin
+    self.opcode = opcode
+    self.masked = masked
+    self.payload = payload
+    # Marks the first frame of a compressed message.
+    self.rsv1 = rsv1
+
+
+class FrameDecoder:
+  """
+  Decodes websocket frames from a receive buffer.
+
+  Data is fed as it arrives, independent of frame boundaries. Frames are
+  only returned once they were received completely, incomplete frames
+  remain in the buffer until more data is fed.
+  """
+
+  def __init__(self):
+    self.__buffer = bytearray()
+
+  def feed(self, data) -> None:
+    self.__buffer += data
+
+  def parse_header(self) -> tuple:
+    """
+    Returns the header's length, the payload length and the mask or None
+    in case the header is incomplete.
+    """
+    buffer = self.__buffer
+
+    if len(buffer) < 2:
+      return None
+
+    length = buffer[1] & 0b01111111
+    offset = 2
+
+    if length == 126:
+      offset = 4
+    elif length == 127:
+      offset = 10
+
+    masked = bool(buffer[1] & 0b10000000)
+
+    if len(buffer) < offset + (4 if masked else 0):
+      return None
+
+    if offset > 2:
+      length = int.from_bytes(buffer[2:offset], "big")
+
+    if length > MAX_MESSAGE_SIZE:
+      raise Exception("Frame exceeds the maximum message size")
+
+    mask = None
+    if masked:
+      mask = bytes(buffer[offset:offset+4])
+      offset += 4
+
+    return (offset, length, mask)
+
+  def has_frame(self) -> bool:
+    header = self.parse_header()
+
+    if header is None:
+      return False
+
+    offset, length, _mask = header
+    return len(self.__buffer) >= offset + length
+
+  def decode(self) -> WebSocketFrame:
+    """
+    Removes the next complete frame from the buffer and returns it unmasked,
+    or None if no complete frame is available.
+    """
+
+    header = self.parse_header()
+
+    if header is None:
+      return None
+
+    offset, length, mask = header
+
+    if len(self.__buffer) < offset + length:
+      return None
+
+    first = self.__buffer[0]
+    payload = self.__buffer[offset:offset+length]
+    del self.__buffer[:offset+length]
+
+    if first & 0b00110000:
+      raise Exception("Reserved bits set without a negotiated extension")
+
+    if mask is not None:
+      payload = unmask(mask, payload)
+
+    return WebSocketFrame(
+      bool(first & 0b10000000), first & 0b00001111, mask is not None, payload,
+      bool(first & 0b01000000))
+
+
 class WebSocket:
 
-  def __init__(self, request, context):
+  def __init__(self, request, context, deflate : DeflateSettings = None,
+    frame_size : int = DEFAULT_FRAME_SIZE,
+    ping_interval : float = DEFAULT_PING_INTERVAL,
+    ping_timeout : float = DEFAULT_PING_TIMEOUT, idle_timeout : float = 0):
     self.__context = context
     # we cache the initial request so that we have access to the headers.
     self.__request = request
 
+    self.__decoder = FrameDecoder()
+    # Collects the fragments of the current message.
+    self.__message = bytearray()
+    self.__compressed = False
+
+    self.__frame_size = max(int(frame_size), 1)
+
+    self.__deflate_settings = deflate
+    # The negotiated permessage-deflate extension, if any.
+    self.__deflate = None
+
+    self.__receive_buffer = bytearray(RECV_SIZE)
+    self.__receive_view = memoryview(self.__receive_buffer)
+
+    # Control frames queued while decoding, e.g. pongs.
+    self.__control = []
+
+    self.__ping_interval = float(ping_interval)
+    self.__ping_timeout = float(ping_timeout)
+    self.__idle_timeout = float(idle_timeout)
+
+    now = time.monotonic()
+    # The last frame of any kind received from the client.
+    self.__last_received = now
+    # The last message sent or received, pings do not count.
+    self.__last_message = now
+
+    self.__pings = 0
+    # The ping timeout starts once the queued ping was actually sent.
+    self.__ping_queued = False
+    self.__ping_sent = None
+
+    self.__close_sent = False
+    self.__close_received = False
+    self.__close_code = CLOSE_NORMAL
+    self.__peer_dead = False
+
   @property
   def request(self):
     return self.__request
 
+  @property
+  def keepalive_enabled(self) -> bool:
+    return self.__ping_interval > 0 or self.__idle_timeout > 0
+
+  @property
+  def compression(self) -> PerMessageDeflate:
+    """
+    The session's compression counters, None if compression is off.
+    """
+    return self.__deflate
+
   def fileno(self):
     return self.__context.socket.fileno()
 
 
-  def __enter__(self):
+  def accept(self) -> HttpResponse:
+    """
+    Validates the upgrade request and returns the handshake response.
+    """
     if self.request.get_header("Upgrade") != "websocket":
       raise HttpException(400, "Upgrade header expected")
 
@@ -63,6 +297,17 @@ class WebSocket:
 
     accept = b64encode(message.digest()).decode()
 
+    self.__deflate, extensions = PerMessageDeflate.negotiate(
+      self.request.get_header("Sec-WebSocket-Extensions"),
+      self.__deflate_settings)
+
+    # The connection belongs to the websocket from now on. Frames which
+    # were received together with the upgrade request are not lost.
+    self.__context.keep_alive = False
+
+    self.__decoder.feed(self.__context.buffer)
+    self.__context.buffer.clear()
+
     response = HttpResponse()
     response.set_status(101, "Switching Protocols")
     response.add_headers(headers={
@@ -70,118 +315,391 @@ class WebSocket:
       "Connection": "Upgrade",
       "Sec-WebSocket-Accept": accept
     })
-    response.send(self.__context)
 
+    if extensions is not None:
+      response.add_headers({"Sec-WebSocket-Extensions": extensions})
+
+    return response
+
+  def __enter__(self):
+    self.accept().send(self.__context)
     return self
 
   def __exit__(self, exc_type, exc_val, exc_tb) -> None:
     logging.debug("On Exit")
-    #TODO send a websocket disconnect message...
-    #self.disconnect()
 
-  def extract_masked_data(self, length : int) -> bytearray:
-    payload = bytearray()
+    if self.__deflate is not None:
+      self.__deflate.log()
+
+    if not self.start_close(exc_type):
+      return
+
+    try:
+      self.flush()
+
+      # Waits for the client to confirm, the worker is released latest
+      # after the close timeout.
+      self.__context.socket.settimeout(CLOSE_TIMEOUT)
+
+      while not self.__close_received:
+        if self.recv() == b'':
+          break
+
+    except Exception as ex:
+      logging.debug(f"Close handshake failed {ex}")
+
+  async def __aenter__(self):
+    await self.accept().send_async(self.__context)
+    return self
+
+  async def __aexit__(self, exc_type, exc_val, exc_tb) -> None:
+    logging.debug("On Exit")
+
+    if self.__deflate is not None:
+      self.__deflate.log()
 
-    mask = self.__context.socket.recv(4)
-    payload += self.__context.socket.recv(length)
+    if not self.start_close(exc_type):
+      return
 
-    for idx, value in enumerate(payload):
-      payload[idx] = mask[idx % 4] ^ value #payload[i]
+    try:
+      await self.flush_async()
+      await asyncio.wait_for(self.wait_close_async(), CLOSE_TIMEOUT)
 
-    return payload
+    except Exception as ex:
+      logging.debug(f"Close handshake failed {ex}")
+
+  async def wait_close_async(self) -> None:
+    while not self.__close_received:
+      if await self.recv_async() == b'':
+        return
+
+  def restart(self) -> None:
+    """
+    Ends the session with a status code asking the client to reconnect.
+    """
+    self.__close_code = CLOSE_SERVICE_RESTART
+
+  def start_close(self, exc_type = None) -> bool:
+    """
+    Queues the close frame when the server ends the session. Returns false
+    in case no close handshake is needed or possible.
+    """
+
+    if self.__close_sent or self.__peer_dead:
+      return False
+
+    code = self.__close_code
+    if exc_type is not None:
+      code = CLOSE_INTERNAL_ERROR
+
+    self.queue_control(OPCODE_CLOSE, struct.pack("!H", code))
+    self.__close_sent = True
+    return True
+
+  def queue_control(self, opcode : int, payload : bytes = b"") -> None:
+    """
+    Control frames are never fragmented and may be sent between the frames
+    of a fragmented message.
+    """
+    self.__control.append(
+      encode_header(True, opcode, len(payload)) + bytes(payload))
+
+  def flushed(self) -> None:
+    """
+    Called after the queued control frames were sent.
+    """
+    if self.__ping_queued:
+      self.__ping_queued = False
+      self.__ping_sent = time.monotonic()
+
+  def flush(self) -> None:
+    while self.__control:
+      self.__context.socket.sendall(self.__control.pop(0))
+
+    self.flushed()
+
+  async def flush_async(self) -> None:
+    if not self.__control:
+      return
+
+    control = self.__control
+    self.__control = []
+
+    self.__context.writer.writelines(control)
+    await self.__context.writer.drain()
+
+    self.flushed()
+
+  def check_keepalive(self) -> float:
+    """
+    Queues a ping when the client was silent for the ping interval. Raises
+    a TimeoutError if the client did not answer the ping or the session
+    was idle for too long.
+
+    Returns the seconds until the next check is due, or None if neither
+    pings nor an idle timeout are configured.
+    """
+
+    now = time.monotonic()
+    timeouts = []
+
+    if self.__idle_timeout > 0:
+      remaining = self.__last_message + self.__idle_timeout - now
+
+      if remaining <= 0:
+        self.__close_code = CLOSE_GOING_AWAY
+        raise TimeoutError("Websocket session idle")
+
+      timeouts.append(remaining)
+
+    if self.__ping_interval > 0:
+      if self.__ping_sent is not None:
+        remaining = self.__ping_sent + self.__ping_timeout - now
+
+        if remaining <= 0:
+          self.__peer_dead = True
+          raise TimeoutError("Websocket client did not answer the ping")
+      elif self.__ping_queued:
+        remaining = self.__ping_timeout
+      else:
+        remaining = self.__last_received + self.__ping_interval - now
+
+        if remaining <= 0:
+          self.__pings += 1
+          self.queue_control(OPCODE_PING, struct.pack("!Q", self.__pings))
+          self.__ping_queued = True
+          remaining = self.__ping_timeout
+
+      timeouts.append(remaining)
+
+    if not timeouts:
+      return None
+
+    return min(timeouts)
+
+  def keepalive(self) -> float:
+    """
+    Sends a ping if needed and returns the seconds until it has to be called
+    again. See check_keepalive.
+    """
+    timeout = self.check_keepalive()
+    self.flush()
+    return timeout
+
+  async def keepalive_async(self) -> float:
+    timeout = self.check_keepalive()
+    await self.flush_async()
+    return timeout
+
+  def pending(self) -> bool:
+    """
+    Checks if data was already received but not yet consumed. This data is
+    invisible to select, so it has to be processed before waiting.
+    """
+    if self.__decoder.has_frame():
+      return True
+
+    socket = getattr(self.__context, "socket", None)
+    return hasattr(socket, "pending") and socket.pending() > 0
 
   def handle_pong(self, data) -> None:
-    raise Exception("Implement me")
+    if self.__ping_sent is None:
+      return
 
-  def extract_length(self, data) -> int:
-    length = data[1] & 0b01111111
+    # Unsolicited pongs are allowed, they count as a sign of life as well.
+    if bytes(data) == struct.pack("!Q", self.__pings):
+      logging.debug(
+        f"Websocket ping answered in {time.monotonic() - self.__ping_sent:.3f}s")
 
-    if length == 126:
-      data = self.__context.socket.recv(2)
-      return (data[0] << (1*8)) + (data[1] << (0*8))
+    self.__ping_sent = None
+
+  def handle_close(self, data) -> None:
+    """
+    Answers the client's close frame, the session ends afterwards.
+    """
+
+    code = CLOSE_NORMAL
+    if len(data) >= 2:
+      code = int.from_bytes(data[:2], "big")
+      logging.debug(f"Websocket closed by client {code} {data[2:].decode(errors='replace')}")
+
+    self.__close_received = True
+
+    if self.__close_sent:
+      return
 
+    # Echoes the status code as required by RFC 6455.
+    self.queue_control(OPCODE_CLOSE, struct.pack("!H", code) if len(data) >= 2 else b"")
+    self.__close_sent = True
 
-    if length == 127:
-      data = self.__context.socket.recv(8)
-      return (data[0] << (7*8)) + (data[1] << (6*8)) + (data[2] << (5*8)) + (data[3] << (4*8)) \
-        + (data[4] << (3*8)) + (data[5] << (2*8)) + (data[6] << (1*8)) + (data[7] << (0*8))
+  def process(self) -> bytearray:
+    """
+    Decodes the buffered frames until a message is complete. Returns None in
+    case more data is needed and an empty bytes object once the client
+    closed the session.
+    """
 
-    return length
+    while True:
+      frame = self.__decoder.decode()
+
+      if frame is None:
+        return None
+
+      # Any frame proves that the client is still alive.
+      self.__last_received = time.monotonic()
+
+      if frame.opcode == OPCODE_PONG:
+        self.handle_pong(frame.payload)
+        continue
+
+      self.__ping_sent = None
+
+      if frame.opcode == OPCODE_CLOSE:
+        self.handle_close(frame.payload)
+        return b''
+
+      if frame.opcode == OPCODE_PING:
+        self.queue_control(OPCODE_PONG, frame.payload[:125])
+        continue
+
+      if frame.opcode not in (OPCODE_CONTINUATION, OPCODE_TEXT, OPCODE_BINARY):
+        continue
+
+      if not frame.masked:
+        raise Exception("Client to server messages have to be masked.")
+
+      # Only the message's first frame carries the compression flag.
+      if frame.opcode != OPCODE_CONTINUATION:
+        self.__compressed = frame.rsv1
+      elif frame.rsv1:
+        raise Exception("Compression flag set on a continuation frame")
+
+      if self.__compressed and self.__deflate is None:
+        raise Exception("Compressed message without a negotiated extension")
+
+      self.__message += frame.payload
+
+      if len(self.__message) > MAX_MESSAGE_SIZE:
+        raise Exception("Message exceeds the maximum size")
+
+      if frame.fin:
+        message = self.__message
+        self.__message = bytearray()
+
+        if self.__compressed:
+          message = self.__deflate.decompress(message, MAX_MESSAGE_SIZE)
+
+        self.__last_message = self.__last_received
+        return message
 
   def recv(self) -> bytearray:
+    """
+    Returns the next complete message. Reads are done in large chunks into a
+    reused buffer, a single read may contain several frames or only a part
+    of one. Returns an empty bytes object in case the peer disconnected.
 
-    fin = False
-    payload = bytearray()
+    At most one read is done, so that control frames or a partial message
+    do not block the caller. None is returned if no message is complete yet.
+    """
 
-    while not fin:
-      data = self.__context.socket.recv(2)
+    try:
+      message = self.process()
 
-      opcode = data[0] & 0b00001111
-      fin = bool(data[0] & 0b10000000)
-      length = self.extract_length(data)
+      if message is None:
+        length = self.__context.socket.recv_into(self.__receive_buffer)
 
-      if opcode == 8:
         if not length:
-          raise Exception("Connection gracefully closed.")
+          return b''
 
-        message = self.extract_masked_data(length)
+        self.__decoder.feed(self.__receive_view[:length])
+        message = self.process()
 
-        code = (message[0] << (1*8)) + (message[1] << (0*8))
+      return message
 
-        text = message[2:]
+    finally:
+      # Pongs queued before the read would block must not be held back.
+      self.flush()
 
-        logging.debug(str(code) + " - " + text.decode())
-        raise Exception("Connection gracefully closed. "+str(code)+" "+text.decode())
+  async def recv_async(self) -> bytearray:
+    """
+    The coroutine counterpart of recv.
+    """
 
+    while True:
+      message = self.process()
+      await self.flush_async()
 
+      if message is not None:
+        return message
 
-      if opcode == 10:
-        self.handle_pong(data)
-        continue
+      data = await self.__context.reader.read(RECV_SIZE)
 
-      if (opcode == 0) or (opcode == 1) or (opcode == 2):
+      if not data:
+        return b''
 
-        if not bool(data[1] & 0b10000000):
-          raise Exception("Client to server messages have to be masked.")
+      self.__decoder.feed(data)
 
-        payload += self.extract_masked_data(length)
+  def encode(self, payload) -> list:
+    """
+    Splits the message into frames and returns them as a list of header and
+    payload pairs. The payloads are views into the message, so that it is
+    never copied.
+    """
 
-        if fin:
-          break
+    if not isinstance(payload, (bytes, bytearray)):
+      payload = payload.encode()
+
+    rsv1 = False
+
+    if self.__deflate is not None and self.__deflate.can_compress(payload):
+      payload = self.__deflate.compress(payload)
+      rsv1 = True
+
+    view = memoryview(payload)
+    length = len(view)
+    frame_size = self.__frame_size
 
-    return payload
+    frames = []
+    opcode = OPCODE_TEXT
+    offset = 0
+
+    while True:
+      chunk = view[offset:offset+frame_size]
+      offset += len(chunk)
+
+      fin = offset >= length
+      frames.append((encode_header(fin, opcode, len(chunk), rsv1), chunk))
+
+      if fin:
+        return frames
+
+      # Only the first frame carries the opcode and the compression flag.
+      opcode = OPCODE_CONTINUATION
+      rsv1 = False
 
   def send(self, payload) -> None:
+    """
+    Sends the message, sendall loops until every frame was written.
+    """
+    self.__last_message = time.monotonic()
+    socket = self.__context.socket
+
+    for header, chunk in self.encode(payload):
+      # Small frames are cheaper in a single record than in two.
+      if len(chunk) <= SMALL_FRAME_SIZE:
+        socket.sendall(header + chunk)
+        continue
+
+      socket.sendall(header)
+      socket.sendall(chunk)
+
+  async def send_async(self, payload) -> None:
+    self.__last_message = time.monotonic()
+    writer = self.__context.writer
 
-    data = bytearray()
-    data.append(0b10000001)
-
-    length = len(payload)
-    #FIXME the length is in Network byte order and needs to be converted to host byte order
-
-    if length < 126:
-      data.append(length & 0b01111111)
-    elif length <= 0xFFFF:
-      data.append(126)
-      data.append((length >> (1*8)) & 0xFF)
-      data.append((length >> (0*8)) & 0xFF)
-    elif length <= 0xFFFFFFFFFFFFFFFF:
-      data.append(127)
-      data.append((length >> (7*8)) & 0xFF)
-      data.append((length >> (6*8)) & 0xFF)
-      data.append((length >> (5*8)) & 0xFF)
-      data.append((length >> (4*8)) & 0xFF)
-      data.append((length >> (3*8)) & 0xFF)
-      data.append((length >> (2*8)) & 0xFF)
-      data.append((length >> (1*8)) & 0xFF)
-      data.append((length >> (0*8)) & 0xFF)
-
-    if isinstance(payload, (bytes, bytearray)):
-      data.extend(payload)
-    else:
-      data.extend(payload.encode())
-
-    self.__context.socket.send(data)
+    for header, chunk in self.encode(payload):
+      writer.writelines((header, chunk))
+      await writer.drain()
 
 
 #ws = WebSocket(None, ContextMock(bytearray([0x81,0x05,0x48,0x65,0x6c,0x6c,0x6f])))
@@ -0,0 +1,48 @@
+"""
+Stand-ins for the sockets and connection contexts the parsers read from.
+"""
+
+
+def split(data : bytes, size : int = 1) -> list:
+  """
+  Cuts the data into chunks of the given size, like small reads would.
+  """
+  return [data[index:index+size] for index in range(0, len(data), size)]
+
+
+class Connection:
+  """
+  Returns the data in the given chunks, then signals the end of the stream.
+  Exceptions among the chunks are raised instead, e.g. a would-block error.
+  Everything sent is recorded.
+  """
+
+  def __init__(self, *chunks):
+    self.__chunks = list(chunks)
+    self.sent = bytearray()
+
+  def recv(self, _size) -> bytes:
+    if not self.__chunks:
+      return b''
+
+    chunk = self.__chunks.pop(0)
+
+    if isinstance(chunk, Exception):
+      raise chunk
+
+    return chunk
+
+  def recv_into(self, buffer) -> int:
+    chunk = self.recv(len(buffer))
+    buffer[:len(chunk)] = chunk
+    return len(chunk)
+
+  def sendall(self, data) -> None:
+    self.sent += data
+
+
+class Context:
+
+  def __init__(self, *chunks):
+    self.socket = Connection(*chunks)
+    self.buffer = bytearray()
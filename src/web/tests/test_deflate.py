@@ -0,0 +1,162 @@
+import zlib
+
+import pytest
+
+from script.deflate import (
+  PerMessageDeflate, DeflateSettings, DEFLATE_TAIL, parse_extensions)
+
+
+MESSAGE = b'"sieve.script" ACTIVE\r\n' * 20
+
+
+def client_compress(compressor, message : bytes) -> bytes:
+  """
+  Compresses a message like a client does, the trailing empty block is
+  stripped.
+  """
+
+  data = compressor.compress(message) + compressor.flush(zlib.Z_SYNC_FLUSH)
+  assert data.endswith(DEFLATE_TAIL)
+  return data[:-len(DEFLATE_TAIL)]
+
+
+def test_parse_extensions():
+  assert parse_extensions(
+    'permessage-deflate; client_max_window_bits, x-foo; bar="1"') == [
+      ("permessage-deflate", {"client_max_window_bits": None}),
+      ("x-foo", {"bar": "1"})]
+
+  assert not parse_extensions(None)
+
+
+@pytest.mark.parametrize("header, response", [
+  ("permessage-deflate", "permessage-deflate"),
+  ("permessage-deflate; client_max_window_bits",
+    "permessage-deflate"),
+  ("permessage-deflate; server_max_window_bits=10",
+    "permessage-deflate; server_max_window_bits=10"),
+  ("permessage-deflate; client_max_window_bits=9",
+    "permessage-deflate; client_max_window_bits=9"),
+  ("permessage-deflate; server_no_context_takeover",
+    "permessage-deflate; server_no_context_takeover"),
+  ("permessage-deflate; client_no_context_takeover",
+    "permessage-deflate; client_no_context_takeover"),
+  ("x-webkit-deflate-frame, permessage-deflate; client_max_window_bits",
+    "permessage-deflate")])
+def test_negotiate(header, response):
+  extension, value = PerMessageDeflate.negotiate(header, DeflateSettings())
+
+  assert extension is not None
+  assert value == response
+
+
+@pytest.mark.parametrize("header", [
+  None,
+  "",
+  "x-webkit-deflate-frame",
+  "permessage-deflate; unknown",
+  "permessage-deflate; server_max_window_bits=8",
+  "permessage-deflate; server_max_window_bits=16",
+  "permessage-deflate; server_max_window_bits",
+  "permessage-deflate; client_max_window_bits=abc"])
+def test_negotiate_rejected(header):
+  assert PerMessageDeflate.negotiate(header, DeflateSettings()) == (None, None)
+
+
+def test_negotiate_fallback_offer():
+  _extension, value = PerMessageDeflate.negotiate(
+    "permessage-deflate; server_max_window_bits=8, permessage-deflate",
+    DeflateSettings())
+
+  assert value == "permessage-deflate"
+
+
+def test_negotiate_settings():
+  settings = DeflateSettings(context_takeover=False, window_bits=10)
+
+  _extension, value = PerMessageDeflate.negotiate(
+    "permessage-deflate; client_max_window_bits", settings)
+
+  assert value == "permessage-deflate; server_no_context_takeover;" \
+    + " client_no_context_takeover; server_max_window_bits=10;" \
+    + " client_max_window_bits=10"
+
+  settings.enabled = False
+  assert PerMessageDeflate.negotiate("permessage-deflate", settings) == (None, None)
+  assert PerMessageDeflate.negotiate("permessage-deflate", None) == (None, None)
+
+
+def test_invalid_settings():
+  with pytest.raises(Exception):
+    DeflateSettings(window_bits=8)
+
+
+def test_compress_strips_tail():
+  data = PerMessageDeflate().compress(MESSAGE)
+
+  assert not data.endswith(DEFLATE_TAIL)
+  assert zlib.decompressobj(-15).decompress(data + DEFLATE_TAIL) == MESSAGE
+
+
+@pytest.mark.parametrize("takeover", [True, False])
+def test_compress_round_trip(takeover):
+  extension = PerMessageDeflate(server_no_context_takeover=not takeover)
+  decompressor = zlib.decompressobj(-15)
+
+  first = extension.compress(MESSAGE)
+  second = extension.compress(MESSAGE)
+
+  assert decompressor.decompress(first + DEFLATE_TAIL) == MESSAGE
+  assert decompressor.decompress(second + DEFLATE_TAIL) == MESSAGE
+
+  # With context takeover the repeated message is a back reference.
+  assert (len(second) < len(first)) == takeover
+
+  assert extension.bytes_out == 2 * len(MESSAGE)
+  assert extension.bytes_out_compressed == len(first) + len(second)
+  assert extension.ratio_out > 1
+
+
+@pytest.mark.parametrize("takeover", [True, False])
+def test_decompress_round_trip(takeover):
+  extension = PerMessageDeflate(client_no_context_takeover=not takeover)
+
+  compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+  for _ in range(3):
+    if not takeover:
+      compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+
+    data = client_compress(compressor, MESSAGE)
+    assert extension.decompress(data, len(MESSAGE)) == MESSAGE
+
+  assert extension.bytes_in == 3 * len(MESSAGE)
+
+
+def test_decompress_small_window():
+  extension, _value = PerMessageDeflate.negotiate(
+    "permessage-deflate; client_max_window_bits=9", DeflateSettings())
+
+  compressor = zlib.compressobj(6, zlib.DEFLATED, -9)
+  data = client_compress(compressor, MESSAGE)
+
+  assert extension.decompress(data, len(MESSAGE)) == MESSAGE
+
+
+def test_extension_round_trip():
+  server = PerMessageDeflate()
+  client = PerMessageDeflate()
+
+  for message in (MESSAGE, b"", b"OK\r\n", bytes(range(256)) * 10):
+    assert client.decompress(server.compress(message), len(message)) == message
+
+
+def test_decompress_oversized():
+  data = client_compress(zlib.compressobj(6, zlib.DEFLATED, -15), b"a" * 10000)
+
+  with pytest.raises(Exception, match="maximum size"):
+    PerMessageDeflate().decompress(data, 9999)
+
+
+def test_decompress_invalid():
+  with pytest.raises(Exception, match="Invalid compressed message"):
+    PerMessageDeflate().decompress(b"\xff\xff\xff\xff", 1024)
@@ -0,0 +1,47 @@
+import pytest
+
+from script.handler.file import accepts_gzip, get_quality
+
+
+@pytest.mark.parametrize("header", [
+  "gzip",
+  "GZIP",
+  "deflate, gzip",
+  "gzip;q=0.5",
+  "gzip ; q=1.0",
+  "*",
+  "deflate, *;q=0.1",
+  "gzip;q=1, *;q=0",
+  "*;q=0, gzip"])
+def test_accepts_gzip(header):
+  assert accepts_gzip(header)
+
+
+@pytest.mark.parametrize("header", [
+  "",
+  "identity",
+  "deflate, br",
+  "gzip;q=0",
+  "gzip;q=0.0",
+  "*;q=0",
+  "*;q=0.5, gzip;q=0",
+  "gzip;q=0, *",
+  "gzip;q=invalid",
+  "*;q="])
+def test_rejects_gzip(header):
+  assert not accepts_gzip(header)
+
+
+def test_accepts_gzip_no_header():
+  assert not accepts_gzip(None)
+
+
+@pytest.mark.parametrize("params, quality", [
+  ("", 1),
+  ("level=1", 1),
+  ("q=0.3", 0.3),
+  (" Q = 0.7 ", 0.7),
+  ("q=abc", 0),
+  ("q=", 0)])
+def test_get_quality(params, quality):
+  assert get_quality(params) == quality
@@ -0,0 +1,243 @@
+import pytest
+
+from script.http import HttpParser, HttpBody, HttpRequest, HttpException
+
+from .fakes import Context
+
+
+REQUEST = b"GET /index.html HTTP/1.1\r\nHost: localhost\r\n\r\n"
+
+
+def find_split(data : bytes, parser : HttpParser) -> int:
+  """
+  Feeds the data byte by byte and returns the length of the request head.
+  """
+
+  buffer = bytearray()
+
+  for index in range(len(data)):
+    buffer += data[index:index+1]
+    end = parser.find(buffer)
+
+    if end != -1:
+      return end
+
+  return -1
+
+
+def test_find_complete_head():
+  assert HttpParser().find(bytearray(REQUEST + b"body")) == len(REQUEST)
+
+
+def test_find_split_reads():
+  assert find_split(REQUEST, HttpParser()) == len(REQUEST)
+
+
+def test_find_split_terminator():
+  parser = HttpParser()
+  buffer = bytearray(REQUEST[:-3])
+
+  assert parser.find(buffer) == -1
+
+  buffer += REQUEST[-3:]
+  assert parser.find(buffer) == len(REQUEST)
+
+
+def test_find_incomplete_head():
+  assert find_split(REQUEST[:-1], HttpParser()) == -1
+
+
+def test_find_oversized_partial():
+  parser = HttpParser(max_header_size=64)
+
+  with pytest.raises(HttpException) as ex:
+    parser.find(bytearray(b"GET / HTTP/1.1\r\nX-Long: " + b"a" * 64))
+
+  assert ex.value.code == 431
+
+
+def test_find_oversized_head():
+  parser = HttpParser(max_header_size=32)
+
+  with pytest.raises(HttpException) as ex:
+    parser.find(bytearray(REQUEST))
+
+  assert ex.value.code == 431
+
+
+def test_parse_headers():
+  request, headers = HttpParser().parse(
+    b"GET / HTTP/1.1\r\nHost: localhost\r\nAccept: a\r\naccept:  b \r\n\r\n")
+
+  assert request == ["GET", "/", "HTTP/1.1"]
+  assert headers == {"host": "localhost", "accept": "a, b"}
+
+
+def test_parse_too_many_headers():
+  head = b"GET / HTTP/1.1\r\n" + b"X-Header: a\r\n" * 3 + b"\r\n"
+
+  HttpParser(max_header_count=3).parse(head)
+
+  with pytest.raises(HttpException) as ex:
+    HttpParser(max_header_count=2).parse(head)
+
+  assert ex.value.code == 431
+
+
+@pytest.mark.parametrize("head", [
+  b"GET /\r\n\r\n",
+  b"GET / HTTP/1.1\r\nNo separator\r\n\r\n"])
+def test_parse_malformed(head):
+  with pytest.raises(HttpException) as ex:
+    HttpParser().parse(head)
+
+  assert ex.value.code == 400
+
+
+def decode_split(body : HttpBody, data : bytes) -> tuple:
+  """
+  Decodes the data fed byte by byte, returns the payload and the remainder.
+  """
+
+  buffer = bytearray()
+  result = bytearray()
+
+  for index in range(len(data)):
+    buffer += data[index:index+1]
+    result += body.decode(buffer)
+
+  return (bytes(result), bytes(buffer))
+
+
+def test_body_content_length():
+  buffer = bytearray(b"hello worldNEXT")
+  body = HttpBody(11)
+
+  assert body.decode(buffer) == b"hello world"
+  assert body.complete
+  assert buffer == b"NEXT"
+
+
+def test_body_length_split_reads():
+  body = HttpBody(11)
+
+  assert decode_split(body, b"hello worldNEXT") == (b"hello world", b"NEXT")
+  assert body.complete
+
+
+def test_body_empty():
+  assert HttpBody().complete
+  assert HttpBody().decode(bytearray(b"NEXT")) == b""
+
+
+def test_body_size_limit():
+  buffer = bytearray(b"hello world")
+  body = HttpBody(11)
+
+  assert body.decode(buffer, 5) == b"hello"
+  assert not body.complete
+  assert body.decode(buffer) == b" world"
+  assert body.complete
+
+
+CHUNKED = b"4\r\nWiki\r\n5\r\npedia\r\n0\r\n\r\n"
+
+CHUNKED_EXTENSIONS = (
+  b"4;name=value\r\nWiki\r\n"
+  + b"5 ; quoted=\"a;b\"\r\npedia\r\n"
+  + b"0;last\r\nX-Trailer: a\r\nX-Other: b\r\n\r\n")
+
+
+@pytest.mark.parametrize("data", [CHUNKED, CHUNKED_EXTENSIONS])
+def test_body_chunked(data):
+  buffer = bytearray(data + b"NEXT")
+  body = HttpBody(chunked=True)
+
+  assert body.decode(buffer) == b"Wikipedia"
+  assert body.complete
+  assert buffer == b"NEXT"
+
+
+@pytest.mark.parametrize("data", [CHUNKED, CHUNKED_EXTENSIONS])
+def test_body_chunked_split_reads(data):
+  body = HttpBody(chunked=True)
+
+  assert decode_split(body, data + b"NEXT") == (b"Wikipedia", b"NEXT")
+  assert body.complete
+
+
+def test_body_chunked_size_limit():
+  buffer = bytearray(CHUNKED)
+  body = HttpBody(chunked=True)
+
+  assert body.decode(buffer, 6) == b"Wikipe"
+  assert body.decode(buffer, 6) == b"dia"
+  assert body.complete
+
+
+@pytest.mark.parametrize("data", [
+  b"x\r\nWiki\r\n",
+  b"4\r\nWikiXX",
+  b"4" * (64 * 1024 + 1)])
+def test_body_chunked_malformed(data):
+  with pytest.raises(HttpException) as ex:
+    HttpBody(chunked=True).decode(bytearray(data))
+
+  assert ex.value.code == 400
+
+
+def test_recv_pipelined_requests():
+  post = b"POST /a HTTP/1.1\r\nContent-Length: 5\r\n\r\nhello"
+  context = Context(post[:10], post[10:] + REQUEST[:5], REQUEST[5:])
+
+  request = HttpRequest()
+  assert request.recv(context, blocking=False)
+  assert (request.method, request.path) == ("POST", "/a")
+  assert request.body.read(context) == b"hello"
+
+  request = HttpRequest()
+  assert request.recv(context, blocking=False)
+  assert (request.method, request.path) == ("GET", "/index.html")
+  assert request.body.complete
+
+  assert not HttpRequest().recv(context, blocking=False)
+
+
+def test_recv_chunked_body():
+  context = Context(
+    b"POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n",
+    CHUNKED_EXTENSIONS[:20], CHUNKED_EXTENSIONS[20:])
+
+  request = HttpRequest()
+  assert request.recv(context, blocking=False)
+  assert request.body.read(context) == b"Wikipedia"
+
+
+@pytest.mark.parametrize("head, code", [
+  (b"POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\nContent-Length: 4\r\n\r\n", 400),
+  (b"POST / HTTP/1.1\r\nTransfer-Encoding: gzip\r\n\r\n", 501),
+  (b"POST / HTTP/1.1\r\nContent-Length: -1\r\n\r\n", 400)])
+def test_recv_invalid_length(head, code):
+  with pytest.raises(HttpException) as ex:
+    HttpRequest().recv(Context(head), blocking=False)
+
+  assert ex.value.code == code
+
+
+def test_recv_incomplete_request():
+  with pytest.raises(HttpException) as ex:
+    HttpRequest().recv(Context(REQUEST[:10]), blocking=False)
+
+  assert ex.value.code == 400
+
+
+def test_recv_incomplete_body():
+  context = Context(b"POST / HTTP/1.1\r\nContent-Length: 10\r\n\r\nhello")
+
+  request = HttpRequest()
+  request.recv(context, blocking=False)
+
+  with pytest.raises(HttpException) as ex:
+    request.body.read(context)
+
+  assert ex.value.code == 400
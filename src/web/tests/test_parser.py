@@ -0,0 +1,150 @@
+import pytest
+
+from script.sieve.parser import Parser
+from script.sieve.request import Response, Capabilities
+
+
+def test_extract_tokens():
+  parser = Parser(b'ACTIVE 42 "quoted" {3}\r\nabc\r\n')
+
+  assert parser.extract_atom() == b"ACTIVE"
+  parser.extract_space()
+  assert parser.extract_number() == 42
+  parser.extract_space()
+  assert parser.extract_string() == b'"quoted"'
+  parser.extract_space()
+  assert parser.extract_string() == b"{3}\r\nabc"
+  parser.extract_line_break()
+
+  assert parser.is_empty()
+
+
+@pytest.mark.parametrize("data, expected", [
+  (b'""', b'""'),
+  (b'"a \\"b\\" c" rest', b'"a \\"b\\" c"'),
+  (b'"back\\\\" rest', b'"back\\\\"'),
+  (b'"{5}" rest', b'"{5}"')])
+def test_extract_quoted(data, expected):
+  parser = Parser(data)
+
+  assert parser.extract_quoted() == expected
+  assert parser.get_data() == data[len(expected):]
+
+
+@pytest.mark.parametrize("data", [
+  b'"unterminated',
+  b'"line\r\nbreak"',
+  b'"escaped\\"',
+  b'"invalid \\n escape"',
+  b'no quote'])
+def test_extract_quoted_invalid(data):
+  with pytest.raises(Exception, match="Expected Quote"):
+    Parser(data).extract_quoted()
+
+
+@pytest.mark.parametrize("data, expected", [
+  (b"{0}\r\n", b"{0}\r\n"),
+  (b'{9}\r\n"a"\r\nOK\r\n\r\n', b'{9}\r\n"a"\r\nOK\r\n'),
+  (b"{4+}\r\n\r\n\r\n rest", b"{4+}\r\n\r\n\r\n")])
+def test_extract_literal(data, expected):
+  parser = Parser(data)
+
+  assert parser.extract_literal() == expected
+  assert parser.position == len(expected)
+
+
+@pytest.mark.parametrize("data, error", [
+  (b"{10}\r\nshort", "Incomplete Literal"),
+  (b"{x}\r\n", "Expected Literal"),
+  (b"{3}abc", "Expected Literal")])
+def test_extract_literal_invalid(data, error):
+  with pytest.raises(Exception, match=error):
+    Parser(data).extract_literal()
+
+
+def test_extract_large_literal():
+  script = b"keep;\r\n" * 100000
+  data = bytearray(b"{%d}\r\n%b\r\nOK\r\n" % (len(script), script))
+
+  parser = Parser(data)
+  assert parser.extract_literal()[-len(script):] == script
+  parser.extract_line_break()
+  assert parser.get_data() == b"OK\r\n"
+
+
+@pytest.mark.parametrize("data, expected", [
+  (b"(TAG \"1\")", (b"TAG", [b'"1"'])),
+  (b"(QUOTA/MAXSIZE)", (b"QUOTA/MAXSIZE", [])),
+  (b"(TAG {3}\r\nx y)", (b"TAG", [b"{3}\r\nx y"])),
+  (b"(SASL \"c2Vy\\\"dmVy\")", (b"SASL", [b'"c2Vy\\"dmVy"'])),
+  (b"(WARNINGS 12 ATOM)", (b"WARNINGS", [12, b"ATOM"]))])
+def test_extract_response_code(data, expected):
+  parser = Parser(data)
+
+  assert parser.extract_response_code() == expected
+  assert parser.is_empty()
+
+
+@pytest.mark.parametrize("data", [b"(TAG \"1\"", b"()", b"TAG"])
+def test_response_code_invalid(data):
+  with pytest.raises(Exception):
+    Parser(data).extract_response_code()
+
+
+@pytest.mark.parametrize("data, status, code, message", [
+  (b"OK\r\n", "OK", None, None),
+  (b'OK "Done"\r\n', "OK", None, b'"Done"'),
+  (b'OK (TAG "a")\r\n', "OK", (b"TAG", [b'"a"']), None),
+  (b'NO (QUOTA/MAXSIZE) "Too big"\r\n', "NO", (b"QUOTA/MAXSIZE", []), b'"Too big"'),
+  (b"NO {12}\r\nline\r\n\"OK\"\r\n\r\n", "NO", None, b'{12}\r\nline\r\n"OK"\r\n'),
+  (b'BYE (REFERRAL "sieve://example.com") "Moved"\r\n',
+    "BYE", (b"REFERRAL", [b'"sieve://example.com"']), b'"Moved"')])
+def test_response(data, status, code, message):
+  parser = Parser(data)
+  response = Response().parse(parser)
+
+  assert response.status == status
+  assert response.code == code
+  assert response.message == message
+  assert parser.is_empty()
+
+
+@pytest.mark.parametrize("data", [b"OKAY\r\n", b"OK", b'OK "Done"', b"MAYBE\r\n"])
+def test_response_invalid(data):
+  with pytest.raises(Exception):
+    Response().decode(data)
+
+
+CAPABILITIES = (
+  b'"IMPLEMENTATION" "Example"\r\n'
+  + b'"SASL" "PLAIN LOGIN"\r\n'
+  + b'"SIEVE" {19}\r\nfileinto "reject"\r\n\r\n'
+  + b'"STARTTLS"\r\n'
+  + b'"VERSION" "1.0"\r\n'
+  + b'OK\r\n')
+
+
+def test_capabilities():
+  capabilities = Capabilities().decode(CAPABILITIES)
+
+  assert capabilities.status == "OK"
+  assert capabilities.get_capabilities() == {
+    b'"IMPLEMENTATION"': b'"Example"',
+    b'"SASL"': b'"PLAIN LOGIN"',
+    b'"SIEVE"': b'{19}\r\nfileinto "reject"\r\n',
+    b'"STARTTLS"': b"",
+    b'"VERSION"': b'"1.0"'}
+
+  capabilities.disable_authentication()
+
+  assert capabilities.encode() == (
+    b'"IMPLEMENTATION" "Example"\r\n'
+    + b'"SASL" ""\r\n'
+    + b'"SIEVE" {19}\r\nfileinto "reject"\r\n\r\n'
+    + b'"VERSION" "1.0"\r\n'
+    + b'OK\r\n')
+
+
+def test_capabilities_invalid():
+  with pytest.raises(Exception, match="Implementation expected"):
+    Capabilities().decode(b'"VERSION" "1.0"\r\nOK\r\n')
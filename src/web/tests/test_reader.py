@@ -0,0 +1,132 @@
+import pytest
+
+from script.sieve.reader import ResponseReader, is_status
+
+from .fakes import Connection
+
+
+def read_split(data : bytes) -> list:
+  """
+  Feeds the data byte by byte and collects the responses.
+  """
+
+  reader = ResponseReader()
+  responses = []
+
+  for index in range(len(data)):
+    reader.feed(data[index:index+1])
+
+    response = reader.next()
+    while response is not None:
+      responses.append(response)
+      response = reader.next()
+
+  assert reader.pending() == 0
+  return responses
+
+
+RESPONSES = [
+  b"OK\r\n",
+  b'OK "Done"\r\n',
+  b'NO (QUOTA/MAXSIZE) "Script too big"\r\n',
+  b'OK (TAG "a\\"b") "Done"\r\n',
+  b'BYE (REFERRAL "sieve://example.com") "Moved"\r\n',
+  b'"a" ACTIVE\r\n"b"\r\nOK\r\n',
+  # Literals whose content looks like a status line or contains quotes.
+  b'{10}\r\nOK "x"\r\nNO\r\nOK\r\n',
+  b'{3+}\r\n"\r\n\r\nOK\r\n',
+  b'"a" {15}\r\nkeep "quoted"\r\n ACTIVE\r\nOK\r\n',
+  # A status line with a literal message spanning several lines.
+  b"NO {10}\r\nline\r\nOK\r\n\r\n",
+  # Data lines which start like a status.
+  b'NOTE\r\nOKAY\r\n"OK"\r\nOK\r\n',
+  # Quoted strings with escapes and braces are not literals.
+  b'"say \\"{1}\\"" "{2}"\r\nOK\r\n']
+
+
+@pytest.mark.parametrize("response", RESPONSES)
+def test_complete_response(response):
+  reader = ResponseReader()
+  reader.feed(response + b"NO")
+
+  assert reader.next() == response
+  assert reader.next() is None
+  assert reader.pending() == 2
+
+
+@pytest.mark.parametrize("response", RESPONSES)
+def test_split_reads(response):
+  assert read_split(response) == [response]
+
+
+def test_several_responses_per_read():
+  assert read_split(b"".join(RESPONSES)) == RESPONSES
+
+  reader = ResponseReader()
+  reader.feed(b"".join(RESPONSES))
+
+  assert [reader.next() for _response in RESPONSES] == RESPONSES
+  assert reader.next() is None
+
+
+def test_incomplete_literal():
+  reader = ResponseReader()
+  reader.feed(b"{8}\r\nOK\r\n")
+
+  # The literal swallows the status line.
+  assert reader.next() is None
+
+  reader.feed(b"OK\r\n\r\nOK\r\n")
+  assert reader.next() == b"{8}\r\nOK\r\nOK\r\n\r\nOK\r\n"
+
+
+def test_large_literal():
+  script = b'require "fileinto";\r\nOK\r\n' * 4096
+  response = b"{%d}\r\n%b\r\nOK\r\n" % (len(script), script)
+
+  reader = ResponseReader()
+
+  for offset in range(0, len(response), 1000):
+    assert reader.next() is None
+    reader.feed(response[offset:offset+1000])
+
+  assert reader.next() == response
+
+
+def test_receive():
+  reader = ResponseReader()
+  connection = Connection(b'"a" ACTIVE\r\n', b"O", b"K\r\n")
+
+  assert reader.receive(connection) == 12
+  assert reader.next() is None
+
+  assert reader.receive(connection) == 1
+  assert reader.receive(connection) == 3
+  assert reader.next() == b'"a" ACTIVE\r\nOK\r\n'
+
+  assert reader.receive(connection) == 0
+
+
+def test_take():
+  reader = ResponseReader()
+  reader.feed(b"{5}\r\nab")
+
+  assert reader.next() is None
+  assert reader.take() == b"{5}\r\nab"
+  assert reader.pending() == 0
+
+  # The scan state is reset as well.
+  reader.feed(b"OK\r\n")
+  assert reader.next() == b"OK\r\n"
+
+
+@pytest.mark.parametrize("line, expected", [
+  (b"OK\r\n", True),
+  (b"OK (TAG 1)\r\n", True),
+  (b'NO "Failed"\r\n', True),
+  (b"BYE\r\n", True),
+  (b"OKAY\r\n", False),
+  (b"NOOP\r\n", False),
+  (b'"OK"\r\n', False)])
+def test_is_status(line, expected):
+  assert is_status(bytearray(line), 0) == expected
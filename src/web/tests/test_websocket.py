@@ -0,0 +1,216 @@
+import time
+import struct
+
+import pytest
+
+from script.websocket import (
+  unmask, encode_header, FrameDecoder, WebSocket, MAX_MESSAGE_SIZE,
+  OPCODE_CONTINUATION, OPCODE_TEXT, OPCODE_CLOSE, OPCODE_PING, OPCODE_PONG)
+
+from .fakes import Context, split
+
+MASK = b"\x12\x34\x56\x78"
+
+
+def frame(opcode : int, payload : bytes, fin : bool = True, rsv1 : bool = False,
+  mask : bytes = MASK) -> bytes:
+  """
+  Encodes a client to server frame.
+  """
+
+  header = bytearray(encode_header(fin, opcode, len(payload), rsv1))
+
+  if mask is None:
+    return bytes(header) + payload
+
+  header[1] |= 0b10000000
+  return bytes(header) + mask + bytes(unmask(mask, payload))
+
+
+def receive_all(websocket : WebSocket, reads : int) -> list:
+  """
+  Calls recv once per read and returns the complete messages.
+  """
+
+  messages = []
+
+  for _index in range(reads):
+    message = websocket.recv()
+
+    if message is not None:
+      messages.append(bytes(message))
+
+  return messages
+
+
+@pytest.mark.parametrize("length", [0, 1, 3, 4, 5, 8, 1023])
+def test_unmask(length):
+  payload = bytes(range(256)) * 4
+  payload = payload[:length]
+
+  expected = bytes(byte ^ MASK[index % 4] for index, byte in enumerate(payload))
+
+  assert unmask(MASK, payload) == expected
+  assert unmask(MASK, memoryview(expected)) == payload
+
+
+def test_decode_split_reads():
+  data = frame(OPCODE_TEXT, b"hello")
+  decoder = FrameDecoder()
+
+  for byte in split(data)[:-1]:
+    decoder.feed(byte)
+    assert not decoder.has_frame()
+    assert decoder.decode() is None
+
+  decoder.feed(data[-1:])
+  assert decoder.has_frame()
+
+  result = decoder.decode()
+  assert (result.fin, result.opcode, result.masked) == (True, OPCODE_TEXT, True)
+  assert result.payload == b"hello"
+  assert decoder.decode() is None
+
+
+@pytest.mark.parametrize("length", [125, 126, 0xFFFF, 0x10000])
+def test_decode_extended_length(length):
+  payload = b"x" * length
+  decoder = FrameDecoder()
+
+  for chunk in split(frame(OPCODE_TEXT, payload), 7000):
+    decoder.feed(chunk)
+
+  assert decoder.decode().payload == payload
+
+
+def test_decode_several_frames():
+  decoder = FrameDecoder()
+  decoder.feed(
+    frame(OPCODE_TEXT, b"first", fin=False)
+    + frame(OPCODE_CONTINUATION, b"second")
+    + frame(OPCODE_TEXT, b"third")[:-1])
+
+  assert decoder.decode().payload == b"first"
+  assert decoder.decode().payload == b"second"
+  assert decoder.decode() is None
+
+  decoder.feed(frame(OPCODE_TEXT, b"third")[-1:])
+  assert decoder.decode().payload == b"third"
+
+
+def test_decode_unmasked():
+  decoder = FrameDecoder()
+  decoder.feed(frame(OPCODE_TEXT, b"plain", mask=None))
+
+  result = decoder.decode()
+  assert not result.masked
+  assert result.payload == b"plain"
+
+
+def test_decode_oversized_frame():
+  decoder = FrameDecoder()
+  decoder.feed(struct.pack("!BBQ", 0x81, 0xFF, MAX_MESSAGE_SIZE + 1) + MASK)
+
+  with pytest.raises(Exception, match="maximum message size"):
+    decoder.decode()
+
+
+def test_decode_reserved_bits():
+  data = bytearray(frame(OPCODE_TEXT, b"hello"))
+  data[0] |= 0b00100000
+
+  decoder = FrameDecoder()
+  decoder.feed(data)
+
+  with pytest.raises(Exception, match="Reserved bits"):
+    decoder.decode()
+
+
+def test_recv_interleaved_control():
+  data = (
+    frame(OPCODE_TEXT, b"LIST", fin=False)
+    + frame(OPCODE_PING, b"ping")
+    + frame(OPCODE_CONTINUATION, b"SCRI", fin=False)
+    + frame(OPCODE_PONG, b"unsolicited")
+    + frame(OPCODE_CONTINUATION, b"PTS\r\n"))
+
+  context = Context(*split(data))
+  websocket = WebSocket(None, context)
+
+  assert receive_all(websocket, len(data)) == [b"LISTSCRIPTS\r\n"]
+  assert context.socket.sent == encode_header(True, OPCODE_PONG, 4) + b"ping"
+
+
+def test_recv_several_messages():
+  context = Context(frame(OPCODE_TEXT, b"first") + frame(OPCODE_TEXT, b"second"))
+  websocket = WebSocket(None, context)
+
+  assert websocket.recv() == b"first"
+  assert websocket.pending()
+  assert websocket.recv() == b"second"
+  assert not websocket.pending()
+
+
+def test_recv_close():
+  context = Context(frame(OPCODE_CLOSE, struct.pack("!H", 1001)))
+  websocket = WebSocket(None, context)
+
+  assert websocket.recv() == b''
+  # The status code is echoed.
+  assert context.socket.sent == encode_header(True, OPCODE_CLOSE, 2) + struct.pack("!H", 1001)
+
+
+def test_recv_would_block():
+  context = Context(
+    frame(OPCODE_TEXT, b"first") + frame(OPCODE_PING, b"ping"), BlockingIOError())
+  websocket = WebSocket(None, context)
+
+  assert websocket.recv() == b"first"
+
+  with pytest.raises(BlockingIOError):
+    websocket.recv()
+
+  # The pong was queued before the read would block.
+  assert context.socket.sent == encode_header(True, OPCODE_PONG, 4) + b"ping"
+
+
+def test_ping_timeout_starts_on_flush(monkeypatch):
+  clock = [100.0]
+  monkeypatch.setattr(time, "monotonic", lambda: clock[0])
+
+  context = Context()
+  websocket = WebSocket(None, context, ping_interval=10, ping_timeout=5)
+
+  clock[0] += 10
+  assert websocket.check_keepalive() == 5
+  assert context.socket.sent == b""
+
+  # The ping is still queued, its timeout did not start yet.
+  clock[0] += 20
+  assert websocket.check_keepalive() == 5
+
+  websocket.flush()
+  assert context.socket.sent == encode_header(True, OPCODE_PING, 8) + struct.pack("!Q", 1)
+
+  clock[0] += 4
+  assert websocket.check_keepalive() == pytest.approx(1)
+
+  clock[0] += 1
+  with pytest.raises(TimeoutError):
+    websocket.check_keepalive()
+
+
+def test_recv_disconnected():
+  assert WebSocket(None, Context()).recv() == b''
+
+
+@pytest.mark.parametrize("data, error", [
+  (frame(OPCODE_TEXT, b"hello", mask=None), "masked"),
+  (frame(OPCODE_TEXT, b"hello", rsv1=True), "Compressed"),
+  (frame(OPCODE_TEXT, b"he", fin=False) + frame(OPCODE_CONTINUATION, b"llo", rsv1=True),
+    "continuation")])
+def test_recv_invalid(data, error):
+  websocket = WebSocket(None, Context(data))
+
+  with pytest.raises(Exception, match=error):
+    websocket.recv()